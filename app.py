@@ -1,11 +1,47 @@
 import pandas as pd
 import numpy as np
 import random
-from flask import request, Flask, render_template
+import logging
+import os
+from flask import request, Flask, Response, render_template
 from model import recommenders, utils
+from instrumentation import instrument, log_event, logger, profiling_requested, tracer
 
 app = Flask(__name__)
 
+### instrumentation, see instrumentation.py ###
+instrument(recommenders, ["sample_popular", "quiz_user_user_recommender", "user_user_recommender",
+    "item_item_recommender", "svd_recommender"])
+instrument(utils, ["get_category", "similar_to_cat", "known_positives", "known_positive_ids", "create_new_user",
+    "recipe_ids_to_titles", "titles_to_ids", "get_urls"])
+
+# one JSON line per request at INFO, intermediate results at DEBUG
+if not logger.handlers:
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(os.environ.get("SEASONINGS_LOG_LEVEL", "INFO"))
+
+@app.before_request
+def start_trace():
+    if request.path != "/metrics":
+        tracer.start(request.path, profile=profiling_requested(request.headers))
+
+@app.after_request
+def record_status(response):
+    trace = tracer.current()
+    if trace is not None:
+        trace.status = response.status_code
+    return response
+
+@app.teardown_request
+def finish_trace(exc):
+    tracer.finish(status=500 if exc is not None else None)
+
+@app.route('/metrics')
+def metrics():
+    return Response(tracer.metrics(), mimetype="text/plain")
+
 @app.route('/', methods=['GET','POST'])
 def quiz():
     # choose sample to show for quiz
@@ -17,70 +53,70 @@ def quiz():
         sample = random.sample(quiz_results,2) # for two categories
         title = sample[0]
 
-        print(f'quiz results: {quiz_results}')
-        print(f'title: {title}')
+        log_event("quiz", quiz_results=quiz_results, title=title)
+        new_user = utils.create_new_user(quiz_results)
 
         ### People with Similar Tastes Also Liked ###
-        user_recommended = recommenders.quiz_user_user_recommender(utils.create_new_user(quiz_results))
-        print(f'user_recommended: {user_recommended}')
+        user_recommended = recommenders.quiz_user_user_recommender(new_user)
+        log_event("user_recommended", recipes=user_recommended)
 
         ### Because you liked X ###
-        item_recommended = recommenders.item_item_recommender(title=title, new_user=utils.create_new_user(quiz_results))
+        item_recommended = recommenders.item_item_recommender(title=title, new_user=new_user)
         # from quiz results, get category, and randomly select 2 to return recipes in that category
-        print(f'item_recommended: {item_recommended}')
+        log_event("item_recommended", recipes=item_recommended)
         ### categories ###
         cat1 = utils.get_category(sample[0])
-        cat1_recommended = [utils.recipe_id_to_title(recipe) for recipe in utils.similar_to_cat(cat1)]
+        cat1_recommended = list(utils.recipe_ids_to_titles(utils.similar_to_cat(cat1)))
 
         cat2 = utils.get_category(sample[1])
-        cat2_recommended = [utils.recipe_id_to_title(recipe) for recipe in utils.similar_to_cat(cat2)]
+        cat2_recommended = list(utils.recipe_ids_to_titles(utils.similar_to_cat(cat2)))
 
         cats_recommended = list([cat1_recommended,cat2_recommended])
-        print(f'cats_recommended: {cats_recommended}')
+        log_event("cats_recommended", categories=[cat1,cat2], recipes=cats_recommended)
 
         ### tastebreaker ###
-        tastebreaker = recommenders.item_item_recommender(title=title, new_user=utils.create_new_user(quiz_results), opposite=True)
-        print(f'tastebreaker: {tastebreaker}')
+        tastebreaker = recommenders.item_item_recommender(title=title, new_user=new_user, opposite=True)
+        log_event("tastebreaker", recipes=tastebreaker)
 
-        # svd_recommended = recommenders.svd_recommender(8888888, new_user=utils.create_new_user(quiz_results))
-        # print(f'svd_recommended: {svd_recommended}')
-        all = user_recommended + item_recommended
-        # + svd_recommended
+        svd_recommended = recommenders.svd_recommender(8888888, new_user=new_user)
+        log_event("svd_recommended", recipes=svd_recommended)
+        all = user_recommended + item_recommended + svd_recommended
 
         all = set(all) # remove duplicates
         # remove recipes user has tried & sample 6
-        hybrid_recommended = random.sample([x for x in all if x not in utils.known_positives(8888888,new_user=utils.create_new_user(quiz_results))],6)
+        known_positives = set(utils.known_positives(8888888,new_user=new_user))
+        hybrid_recommended = random.sample([x for x in all if x not in known_positives],6)
 
-        print(f'hybrid_recommended: {hybrid_recommended}')
+        log_event("hybrid_recommended", recipes=hybrid_recommended)
 
         return render_template("result.html",
         title = title,
 
-        cats = (list([cat1,cat2]), cats_recommended, [utils.get_url(utils.title_to_id(recipe)) for recipe in cats_recommended[0]], [utils.get_url(utils.title_to_id(recipe)) for recipe in cats_recommended[1]]),
+        cats = (list([cat1,cat2]), cats_recommended, list(utils.get_urls(utils.titles_to_ids(cats_recommended[0]))), list(utils.get_urls(utils.titles_to_ids(cats_recommended[1])))),
         # tuple, second element is the image url
         most_popular=([utils.strip_filler(recipe) for recipe in most_popular],
-        [utils.get_url(utils.title_to_id(recipe)) for recipe in most_popular]),
+        list(utils.get_urls(utils.titles_to_ids(most_popular)))),
 
         quiz_results=([utils.strip_filler(recipe) for recipe in quiz_results],
-        [utils.get_url(utils.title_to_id(recipe)) for recipe in quiz_results]),
+        list(utils.get_urls(utils.titles_to_ids(quiz_results)))),
 
         user_recommended=([utils.strip_filler(recipe) for recipe in user_recommended],
-        [utils.get_url(utils.title_to_id(recipe)) for recipe in user_recommended]),
+        list(utils.get_urls(utils.titles_to_ids(user_recommended)))),
 
         item_recommended=([utils.strip_filler(recipe) for recipe in item_recommended],
-        [utils.get_url(utils.title_to_id(recipe)) for recipe in item_recommended],utils.strip_filler(title))
+        list(utils.get_urls(utils.titles_to_ids(item_recommended))),utils.strip_filler(title))
         ,
 
         tastebreaker=([utils.strip_filler(recipe) for recipe in tastebreaker],
-        [utils.get_url(utils.title_to_id(recipe)) for recipe in tastebreaker],utils.strip_filler(title)),
+        list(utils.get_urls(utils.titles_to_ids(tastebreaker))),utils.strip_filler(title)),
 
         hybrid_recommended = ([utils.strip_filler(recipe) for recipe in hybrid_recommended],
-        [utils.get_url(utils.title_to_id(recipe)) for recipe in hybrid_recommended])
+        list(utils.get_urls(utils.titles_to_ids(hybrid_recommended))))
         )
 
     # landing screen
     return render_template("quiz.html",
-    most_popular=(most_popular,[utils.get_url(utils.title_to_id(recipe)) for recipe in most_popular])
+    most_popular=(most_popular,list(utils.get_urls(utils.titles_to_ids(most_popular))))
     )
 
 if __name__ == '__main__':
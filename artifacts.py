@@ -0,0 +1,240 @@
+import fcntl
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+# SEASONINGS_MMAP=1 memory-maps array artifacts so gunicorn workers share pages
+MMAP_ENV = "SEASONINGS_MMAP"
+
+
+def is_stale(path, *sources):
+    '''True if the artifact at `path` is missing or older than any of its source files'''
+    if not os.path.exists(path):
+        return True
+    built = os.path.getmtime(path)
+    return any(os.path.exists(source) and os.path.getmtime(source) > built for source in sources)
+
+
+def _versions(path):
+    '''Version directories of the artifact at `path`, oldest first'''
+    directory, name = os.path.split(os.path.abspath(path))
+    versions = []
+    for entry in os.listdir(directory):
+        version = entry[len(name) + 2:]
+        if entry.startswith(name + ".v") and version.isdigit():
+            versions.append((int(version), os.path.join(directory, entry)))
+    return [version_path for _, version_path in sorted(versions)]
+
+
+def _publish(tmp_path, path, keep=2):
+    '''Make a finished temporary directory the current version of the artifact at `path`.
+
+    `path` is a symlink to a `path.v<ns><pid>` directory and is swapped with
+    os.replace, so a reader finds either the old or the new version, never
+    a missing or half-deleted one. The previous version is kept for readers
+    still loading it, older ones are removed.
+    '''
+    # nanoseconds then a 7 digit pid, as time.time_ns() needs Python 3.7 (runtime.txt pins 3.6)
+    version_path = f"{path}.v{int(time.time() * 1e9)}{os.getpid():07d}"
+    os.rename(tmp_path, version_path)
+    link_path = f"{path}.{os.getpid()}.link"
+    if os.path.lexists(link_path):
+        os.remove(link_path)
+    os.symlink(os.path.basename(version_path), link_path)
+    if os.path.isdir(path) and not os.path.islink(path):
+        # saved before artifacts were versioned, becomes the oldest version
+        shutil.rmtree(f"{path}.v0", ignore_errors=True)
+        os.rename(path, f"{path}.v0")
+    os.replace(link_path, path)
+
+    current = os.path.realpath(path)
+    for old_path in _versions(path)[:-keep]:
+        if old_path != current:
+            shutil.rmtree(old_path, ignore_errors=True)
+
+
+@contextmanager
+def build_lock(path):
+    '''Exclusive lock on building the artifact at `path`, shared by all processes.
+
+    Every gunicorn worker imports model.py; with the lock only the first one
+    builds a missing or stale artifact and the others wait, then load it.
+    '''
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(f"{path}.lock", "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def build_if_stale(path, build, *sources):
+    '''Run build() if the artifact at `path` is stale (see is_stale), in one process at a time.
+
+    Returns True if it was built by this call.
+    '''
+    if not is_stale(path, *sources):
+        return False
+    with build_lock(path):
+        # another worker may have built it while we waited
+        if not is_stale(path, *sources):
+            return False
+        build()
+        return True
+
+
+def save_arrays(path, **arrays):
+    '''Save named arrays as a directory of .npy files, which load_arrays can memory-map.
+
+    The directory is written under a temporary name and published as a new
+    version (see _publish), so a concurrent reader never maps a half-written array.
+    '''
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    os.makedirs(tmp_path, exist_ok=True)
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp_path, name + ".npy"), np.asarray(array))
+    _publish(tmp_path, path)
+
+
+class ArrayWriter:
+    '''Writes a save_arrays directory one chunk at a time, for columns too big to hold in memory.
+
+    Chunks of every 1-d column are appended to a raw file, close() turns each
+    raw file into a .npy file block by block and publishes the directory.
+
+    with ArrayWriter("./pickle/ratings") as writer:
+        for chunk in chunks:
+            writer.append(user_codes=..., ratings=...)
+        writer.set(user_dict=user_dict)      # arrays that are only known at the end
+    '''
+
+    def __init__(self, path, block_size=1 << 22):
+        self.path = path
+        self.block_size = block_size
+        self.tmp_path = f"{path}.{os.getpid()}.tmp"
+        if os.path.isdir(self.tmp_path):
+            shutil.rmtree(self.tmp_path)
+        os.makedirs(self.tmp_path)
+        self.columns = {}   # name -> [raw file, dtype, length]
+
+    def append(self, **chunks):
+        for name, chunk in chunks.items():
+            chunk = np.ascontiguousarray(chunk)
+            if name not in self.columns:
+                self.columns[name] = [open(os.path.join(self.tmp_path, name + ".raw"), "wb"), chunk.dtype, 0]
+            column = self.columns[name]
+            column[0].write(chunk.astype(column[1], copy=False).tobytes())
+            column[2] += len(chunk)
+
+    def set(self, **arrays):
+        for name, array in arrays.items():
+            np.save(os.path.join(self.tmp_path, name + ".npy"), np.asarray(array))
+
+    def close(self):
+        for name, (raw, dtype, length) in self.columns.items():
+            raw.close()
+            raw_path = os.path.join(self.tmp_path, name + ".raw")
+            if length == 0:
+                np.save(os.path.join(self.tmp_path, name + ".npy"), np.empty(0, dtype=dtype))
+                os.remove(raw_path)
+                continue
+            array = np.lib.format.open_memmap(os.path.join(self.tmp_path, name + ".npy"), mode="w+", dtype=dtype, shape=(length,))
+            with open(raw_path, "rb") as f:
+                for start in range(0, length, self.block_size):
+                    block = np.frombuffer(f.read(min(self.block_size, length - start) * dtype.itemsize), dtype=dtype)
+                    array[start:start + len(block)] = block
+            array.flush()
+            del array
+            os.remove(raw_path)
+        self.columns = {}
+        _publish(self.tmp_path, self.path)
+
+    def abort(self):
+        for raw, _, _ in self.columns.values():
+            raw.close()
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def load_arrays(path, mmap_mode=None, attempts=3):
+    '''{name: array} for every .npy file in a save_arrays directory'''
+    for attempt in range(attempts):
+        # resolve the version once, a save publishing a new one meanwhile must not mix the two
+        version_path = os.path.realpath(path)
+        try:
+            return {os.path.splitext(f)[0]: np.load(os.path.join(version_path, f), mmap_mode=mmap_mode)
+                    for f in sorted(os.listdir(version_path)) if f.endswith(".npy")}
+        except FileNotFoundError:
+            # removed by later saves since it was resolved, read the current version
+            if attempt == attempts - 1:
+                raise
+
+
+class ArtifactRegistry:
+    '''Loads model artifacts once per process and hands out the cached copy.
+
+    registry.get("item_neighbours")      # loaded from disk on first use only
+    registry.reload("item_neighbours")   # drop the cached copy after retraining
+    registry.reload()               # drop everything
+    '''
+
+    def __init__(self, mmap=None):
+        if mmap is None:
+            mmap = os.environ.get(MMAP_ENV, "0") == "1"
+        self.mmap_mode = "r" if mmap else None
+        self._entries = {}
+        self._cache = {}
+        self._lock = threading.RLock()
+
+    def register(self, name, path, loader):
+        '''loader(path, mmap_mode) -> artifact'''
+        with self._lock:
+            self._entries[name] = (path, loader)
+            self._cache.pop(name, None)
+
+    def get(self, name):
+        try:
+            return self._cache[name]
+        except KeyError:
+            pass
+        with self._lock:
+            # another thread may have loaded it while we waited on the lock
+            if name not in self._cache:
+                path, loader = self._entries[name]
+                self._cache[name] = loader(path, self.mmap_mode)
+            return self._cache[name]
+
+    def __getitem__(self, name):
+        return self.get(name)
+
+    def load_all(self):
+        '''Warm every registered artifact, e.g. from a gunicorn post_fork hook'''
+        for name in list(self._entries):
+            self.get(name)
+
+    def reload(self, name=None):
+        '''Forget cached artifacts so the next get() reads them from disk again'''
+        with self._lock:
+            if name is None:
+                self._cache.clear()
+            else:
+                self._cache.pop(name, None)
+
+    def loaded(self):
+        return sorted(self._cache)
+
+
+registry = ArtifactRegistry()
@@ -0,0 +1,138 @@
+'''Latency benchmark of the quiz endpoint and of every stage it calls.
+
+Drives the Flask test client with synthetic quiz submissions drawn from
+sample_popular titles, and reports p50/p95/p99 per stage and end to end.
+
+python benchmark.py --requests 200 --save-baseline benchmark_baseline.json
+python benchmark.py --requests 200 --compare benchmark_baseline.json
+python benchmark.py --startup        # also time a cold `import app`
+'''
+import argparse
+import json
+import random
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+PERCENTILES = [50, 95, 99]
+
+
+def instrument():
+    '''Import the app, its stages are already instrumented, and time render_template too'''
+    import app as app_module
+    import model
+    from instrumentation import logger, tracer
+
+    # the per-request JSON lines would drown the report
+    logger.setLevel("WARNING")
+    app_module.render_template = tracer.wrap("render_template", app_module.render_template)
+    return app_module.app, model, tracer
+
+
+def quiz_submissions(model, n, seed=42):
+    '''n random quiz forms, each ticking 2-8 of the popular titles shown on the landing page'''
+    rng = random.Random(seed)
+    titles = model.recommenders.sample_popular(n=24)
+    return [rng.sample(titles, rng.randint(2, 8)) for _ in range(n)]
+
+
+def summarize(samples):
+    samples = np.asarray(samples) * 1000
+    summary = {f"p{p}": float(np.percentile(samples, p)) for p in PERCENTILES}
+    summary["mean"] = float(samples.mean())
+    return summary
+
+
+def run(n_requests=100, warmup=5, seed=42):
+    app, model, tracer = instrument()
+    client = app.test_client()
+    random.seed(seed)
+
+    forms = quiz_submissions(model, n_requests + warmup, seed)
+    traces = []
+    tracer.observers.append(traces.append)
+    total = []
+    failures = 0
+    try:
+        for i, checked in enumerate(forms):
+            start = time.perf_counter()
+            response = client.post("/", data={"my_checkbox": checked})
+            elapsed = time.perf_counter() - start
+            if i < warmup:
+                continue
+            if response.status_code != 200:
+                failures += 1
+                continue
+            total.append(elapsed)
+    finally:
+        tracer.observers.remove(traces.append)
+
+    traces = [trace for trace in traces[warmup:] if trace.status == 200]
+    names = sorted({name for trace in traces for name in trace.stages})
+
+    def stage(trace, name, key):
+        return trace.stages[name][key] if name in trace.stages else 0
+
+    return {
+        "config": {"requests": n_requests, "warmup": warmup, "seed": seed, "python": sys.version.split()[0]},
+        "failures": failures,
+        "end_to_end_ms": summarize(total) if total else {},
+        "stages_ms": {name: summarize([stage(t, name, "seconds") for t in traces]) for name in names},
+        "calls_per_request": {name: float(np.mean([stage(t, name, "calls") for t in traces])) for name in names},
+        "rows_per_request": {name: float(np.mean([stage(t, name, "rows") for t in traces])) for name in names},
+    }
+
+
+def startup_seconds(repeat=3):
+    '''Best of `repeat` cold imports of app in a fresh interpreter'''
+    timings = []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, "-c",
+                              "import time; t = time.perf_counter(); import app; print(time.perf_counter() - t)"],
+                             stdout=subprocess.PIPE, universal_newlines=True, check=True)
+        timings.append(float(out.stdout.strip().splitlines()[-1]))
+    return min(timings)
+
+
+def compare(report, baseline, tolerance=0.2):
+    '''Ratio of current / baseline p95 per stage, and the stages slower than 1 + tolerance'''
+    ratios = {}
+    for name, summary in [("end_to_end", report["end_to_end_ms"])] + list(report["stages_ms"].items()):
+        before = baseline["end_to_end_ms"] if name == "end_to_end" else baseline["stages_ms"].get(name)
+        if before and before.get("p95"):
+            ratios[name] = summary["p95"] / before["p95"]
+    return ratios, sorted(name for name, ratio in ratios.items() if ratio > 1 + tolerance)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Latency benchmark of the quiz endpoint")
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--startup", action="store_true", help="also time a cold `import app`")
+    parser.add_argument("--save-baseline", default=None, help="write the report here as the new baseline")
+    parser.add_argument("--compare", default=None, help="baseline report to compare p95 latencies against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed p95 slowdown before failing --compare")
+    args = parser.parse_args()
+
+    report = {}
+    if args.startup:
+        report["startup_seconds"] = startup_seconds()
+    report.update(run(args.requests, args.warmup, args.seed))
+
+    exit_code = 0
+    if args.compare:
+        with open(args.compare) as f:
+            ratios, regressions = compare(report, json.load(f), args.tolerance)
+        report["p95_vs_baseline"] = ratios
+        report["regressions"] = regressions
+        exit_code = 1 if regressions else 0
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+
+    print(json.dumps(report, indent=2))
+    sys.exit(exit_code)
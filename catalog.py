@@ -0,0 +1,149 @@
+import ast
+
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+
+from artifacts import load_arrays, save_arrays
+
+DEFAULT_PHOTO_URL = "https://png.pngtree.com/element_origin_min_pic/17/08/09/28d3afc4b9471eba6f908caf6943d473.jpg"
+
+
+def parse_categories(category):
+    '''"['Main Dish', 'Chicken']" -> ['Main Dish', 'Chicken'], missing -> []'''
+    if not isinstance(category, str):
+        return []
+    return ast.literal_eval(category)
+
+
+class RecipeCatalog:
+    '''Hash indexes over the recipes table, built once at import.
+
+    Lookups used to scan all_recipes on every call; here every lookup is a
+    dict hit. Where a recipe_id or title appears on several rows the first
+    row wins, same as the old `.values[0]` scans.
+
+    catalog = RecipeCatalog(all_recipes)
+    catalog.title(223042)                      >>> 'Chicken Parmesan'
+    catalog.titles([223042, 220854])           >>> array([...], dtype=object)
+    catalog.recipe_ids(['Chicken Parmesan'])   >>> array([223042])
+    '''
+
+    def __init__(self, recipes, photo_urls=None):
+        by_id = recipes.drop_duplicates(subset="recipe_id", keep="first")
+        by_title = recipes.drop_duplicates(subset="title", keep="first")
+
+        self._title = dict(zip(by_id["recipe_id"], by_id["title"]))
+        self._recipe_id = dict(zip(by_title["title"], by_title["recipe_id"]))
+        self._categories = {recipe_id: parse_categories(category)
+                            for recipe_id, category in zip(by_id["recipe_id"], by_id["category"])}
+        self._title_categories = {title: parse_categories(category)
+                                  for title, category in zip(by_title["title"], by_title["category"])}
+
+        self._photo_url = {}
+        if photo_urls is not None:
+            photo_urls = photo_urls.drop_duplicates(subset="recipe_id", keep="first")
+            self._photo_url = dict(zip(photo_urls["recipe_id"], photo_urls["photo_url"]))
+
+    def __len__(self):
+        return len(self._title)
+
+    def __contains__(self, recipe_id):
+        return recipe_id in self._title
+
+    # single lookups
+    def title(self, recipe_id):
+        return self._title[recipe_id]
+
+    def recipe_id(self, title):
+        return self._recipe_id[title]
+
+    def categories(self, recipe_id):
+        return self._categories[recipe_id]
+
+    def title_categories(self, title):
+        return self._title_categories[title]
+
+    def url(self, recipe_id):
+        return self._photo_url.get(recipe_id, DEFAULT_PHOTO_URL)
+
+    # batch lookups
+    def titles(self, recipe_ids):
+        return np.array([self._title[i] for i in recipe_ids], dtype=object)
+
+    def recipe_ids(self, titles):
+        return np.array([self._recipe_id[t] for t in titles], dtype=np.int64)
+
+    def urls(self, recipe_ids):
+        return np.array([self._photo_url.get(i, DEFAULT_PHOTO_URL) for i in recipe_ids], dtype=object)
+
+
+class CategoryIndex:
+    '''Recipe x category incidence matrix (CSR) plus category -> recipe_id posting lists.
+
+    Row i of `matrix` is recipe `recipe_ids[i]`, column j is `categories[j]`.
+
+    index = CategoryIndex.build(all_recipes)
+    index.recipes('Chicken')                   >>> array([...recipe ids...])
+    index.union(['Main Dish', 'Chicken'])      >>> sorted ids in any of them
+    '''
+
+    def __init__(self, matrix, recipe_ids, categories):
+        self.matrix = matrix
+        self.recipe_ids = np.asarray(recipe_ids)
+        self.categories = np.asarray(categories)
+        self._column = {category: j for j, category in enumerate(self.categories.tolist())}
+        self._row = {}
+        for i, recipe_id in enumerate(self.recipe_ids.tolist()):
+            self._row.setdefault(recipe_id, i)
+
+        # posting lists: the CSC column j holds the rows of recipes in category j
+        csc = matrix.tocsc()
+        self._postings = [np.unique(self.recipe_ids[csc.indices[csc.indptr[j]:csc.indptr[j + 1]]])
+                          for j in range(len(self.categories))]
+
+    @classmethod
+    def build(cls, recipes):
+        '''One row per row of `recipes` (needs recipe_id and category columns)'''
+        parsed = [parse_categories(category) for category in recipes["category"]]
+        rows = np.repeat(np.arange(len(parsed)), [len(c) for c in parsed])
+        flat = [category for categories in parsed for category in categories]
+        categories, columns = np.unique(np.array(flat, dtype=str), return_inverse=True)
+
+        matrix = csr_matrix((np.ones(len(rows), dtype=np.int8), (rows, columns.ravel())),
+                            shape=(len(parsed), len(categories)))
+        matrix.sum_duplicates()
+        matrix.data[:] = 1
+        return cls(matrix, recipes["recipe_id"].to_numpy(), categories)
+
+    def save(self, path):
+        save_arrays(path, data=self.matrix.data, indices=self.matrix.indices, indptr=self.matrix.indptr,
+                    recipe_ids=self.recipe_ids, categories=self.categories)
+
+    @classmethod
+    def load(cls, path, mmap_mode=None):
+        arrays = load_arrays(path, mmap_mode)
+        matrix = csr_matrix((arrays["data"], arrays["indices"], arrays["indptr"]),
+                            shape=(len(arrays["recipe_ids"]), len(arrays["categories"])))
+        return cls(matrix, arrays["recipe_ids"], arrays["categories"])
+
+    def row(self, recipe_id):
+        '''Matrix row of a recipe (its first row if the recipe is listed twice)'''
+        return self._row[recipe_id]
+
+    def recipes(self, category):
+        '''Recipe ids in a category, empty for an unknown category'''
+        j = self._column.get(category)
+        return self._postings[j] if j is not None else np.array([], dtype=self.recipe_ids.dtype)
+
+    def union(self, categories):
+        postings = [self.recipes(category) for category in categories]
+        if not postings:
+            return np.array([], dtype=self.recipe_ids.dtype)
+        return np.unique(np.concatenate(postings))
+
+    def to_frame(self):
+        '''Dense one-hot DataFrame: recipe_id followed by one 0/1 column per category'''
+        frame = pd.DataFrame(self.matrix.toarray(), columns=self.categories.tolist())
+        frame.insert(0, "recipe_id", self.recipe_ids)
+        return frame
@@ -0,0 +1,287 @@
+'''Offline evaluation of the recommenders. Run explicitly, never imported by app.py:
+
+python evaluation.py rmse --split 2400          # RMSE of the naive and SVD models
+python evaluation.py ranking --k 10 --workers 4 --output report.json
+python evaluation.py ranking --baseline report.json   # print the change against an older report
+'''
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from sklearn.decomposition import TruncatedSVD
+from sklearn.utils.extmath import randomized_svd
+
+from factorization import SVDModel
+from foldin import item_item_scores
+from neighbours import TopKIndex
+
+RECOMMENDERS = ["popular", "user_user", "item_item", "svd", "rrf"]
+# reciprocal rank fusion of the personalised recommenders, not the hybrid app.py serves
+# (a sample of the union of their picks); fused from the scores they already got in _evaluate_batch
+RRF_PARTS = ["user_user", "item_item", "svd"]
+RRF_K = 60
+
+
+def centred_ratings(X):
+    '''X with the mean rating of every recipe removed (dense)'''
+    sum_ratings_per_recipe = X.sum(axis=0)
+    n_ratings_per_recipe = X.getnnz(axis=0)
+    mean_rating_per_recipe = np.asarray(sum_ratings_per_recipe/n_ratings_per_recipe).ravel()
+    return X.toarray() - mean_rating_per_recipe
+
+def rmse(actual, predicted):
+    return np.sqrt(((np.asarray(actual)-np.asarray(predicted))**2).mean())
+
+def rank_k(U, Sigma, VT, k):
+    U_reduced = U[:,:k]
+    VT_reduced = VT[:k,:]
+    Sigma_reduced = np.eye(k)*Sigma[:k]
+    Sigma_sqrt = np.sqrt(Sigma_reduced)
+    return U_reduced @ Sigma_sqrt, Sigma_reduced, Sigma_sqrt @ VT_reduced
+
+def rmse_report(X, split=2400, n_components=100, k=30):
+    '''RMSE of the naive (predict the recipe mean) and SVD models on a train / test split of users'''
+    X_norm = centred_ratings(X)
+    X_train_norm = X_norm[0:split]
+    X_test_norm = X_norm[split:]
+
+    ### Naive model ###
+    naive_preds = np.zeros(X_norm.shape)
+    report = {
+        'naive_train': rmse(X_train_norm, naive_preds[0:split]),
+        'naive_test': rmse(X_test_norm, naive_preds[split:]),
+    }
+
+    ### Matrix Factorization Metric Calculation ###
+    svd = TruncatedSVD(n_components=n_components, random_state=42)
+    Z_train = svd.fit_transform(X_train_norm)
+    X_train_new = svd.inverse_transform(Z_train)
+    report['svd_explained_variance'] = svd.explained_variance_ratio_.sum()
+
+    # Sklearn Truncated SVD uses randomized_svd
+    U, Sigma, VT = randomized_svd(csr_matrix(X_norm), n_components=n_components, n_iter=10, random_state=None)
+    U_reduced, Sigma_reduced, VT_reduced = rank_k(U, Sigma, VT, k)
+
+    U_new = X_test_norm @ VT_reduced.T @ np.linalg.inv(Sigma_reduced)
+    M_hat = U_new @ VT_reduced
+
+    report['svd_train'] = rmse(X_train_norm, X_train_new)
+    report['svd_test'] = rmse(X_test_norm, M_hat)
+    return report
+
+### Ranking Metrics ###
+def precision_and_recall_at_k(predictions, targets, k=6):
+    '''Returns a tuple of (precision, recall) of the top k items
+
+    precision = TP/(TP+FP) -> what fraction of recommended items did the user consume?
+    recall = TP/(TP+FN) -> What out of all the items the user consumed, was recommended?
+
+    precision_and_recall_at_k(list(all_recipes.title.sample(10)), utils.known_positives(3936048),k=6)
+    precision_and_recall_at_k(recommenders.svd_recommender(3936048), utils.known_positives(3936048),k=6)
+    precision_and_recall_at_k(recommenders.user_user_recommender(3936048), utils.known_positives(3936048),k=6)
+    precision_and_recall_at_k(recommenders.item_item_recommender("Chef John's Italian Meatballs"), utils.known_positives(3936048),k=6)
+
+    '''
+    predictions = predictions[:k]
+    num_hit = len(set(predictions).intersection(set(targets)))
+    try:
+        return float(num_hit) / len(predictions), float(num_hit) / len(targets)
+    except:
+        return "Predictions must be greater than length 1"
+
+### Ranking evaluation over all users ###
+def holdout_split(X, test_fraction=0.2, seed=42):
+    '''Hold out a random test_fraction (at least one) of every user's ratings.
+
+    Users with a single rating keep it for training. Columns are unchanged, so
+    the train and test matrices share the recipe mapping of X.
+    '''
+    X = X.tocsr()
+    row_nnz = np.diff(X.indptr)
+    rows = np.repeat(np.arange(X.shape[0]), row_nnz)
+    keys = np.random.RandomState(seed).random_sample(X.nnz)
+    # sort by row, then by random key; the first n_test of every row are held out
+    order = np.lexsort((keys, rows))
+    rank_in_row = np.arange(X.nnz) - X.indptr[rows[order]]
+    n_test = np.where(row_nnz > 1, np.maximum(1, np.floor(test_fraction * row_nnz)), 0).astype(int)
+    is_test = np.zeros(X.nnz, dtype=bool)
+    is_test[order[rank_in_row < n_test[rows[order]]]] = True
+
+    def subset(mask):
+        return csr_matrix((X.data[mask], (rows[mask], X.indices[mask])), shape=X.shape)
+    return subset(~is_test), subset(is_test)
+
+def train_models(X_train, n_components=100, k=10):
+    return {
+        'popularity': np.asarray(X_train.getnnz(axis=0), dtype=float),
+        'user_neighbours': TopKIndex.build(X_train, k=k),
+        'svd': SVDModel.fit(X_train, n_components=n_components),
+    }
+
+def score_batch(name, rows, context):
+    '''Scores (len(rows) x n_recipes) of one recommender for a batch of training users'''
+    X_train, models = context['X_train'], context['models']
+    if name == 'popular':
+        return np.tile(models['popularity'], (len(rows), 1))
+    if name == 'user_user':
+        user_neighbours = models['user_neighbours']
+        scores = np.empty((len(rows), X_train.shape[1]))
+        for i, row in enumerate(rows):
+            neighbours, similarities = user_neighbours.neighbours(row)
+            scores[i] = X_train[neighbours].T @ similarities
+        return scores
+    if name == 'item_item':
+        return np.array([item_item_scores(X_train[row], context['item_neighbours'], context['category_index'],
+                                          context['recipe_mapper'], context['recipe_inv_mapper']) for row in rows])
+    if name == 'svd':
+        return models['svd'].fold_in_batch(X_train[rows])
+    raise ValueError(f'unknown recommender {name}')
+
+def top_k(scores, k):
+    '''Column indices of the k best scores of every row, best first'''
+    part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, part, axis=1), axis=1, kind='stable')
+    return np.take_along_axis(part, order, axis=1)
+
+def ranking_metrics(recommended, relevant, k):
+    '''precision@k, recall@k, average precision@k and NDCG@k for one user'''
+    hits = np.isin(recommended[:k], relevant)
+    discounts = 1 / np.log2(np.arange(2, k + 2))
+    ideal = discounts[:min(len(relevant), k)].sum()
+    precision_at_i = np.cumsum(hits) / np.arange(1, k + 1)
+    return np.array([
+        hits.sum() / k,
+        hits.sum() / len(relevant),
+        (precision_at_i * hits).sum() / min(len(relevant), k),
+        (discounts * hits).sum() / ideal,
+    ])
+
+_context = {}
+
+def _init_worker(context):
+    _context.update(context)
+
+def _evaluate_batch(rows, k, threshold, recommenders=RECOMMENDERS):
+    '''Summed metrics, user count, recommended columns and seconds spent, per recommender'''
+    X_train, X_test = _context['X_train'], _context['X_test']
+    relevant = [X_test.indices[X_test.indptr[row]:X_test.indptr[row + 1]][
+        X_test.data[X_test.indptr[row]:X_test.indptr[row + 1]] >= threshold] for row in rows]
+    results = {}
+    fused, fuse_seconds = np.zeros((len(rows), X_train.shape[1])), 0.0
+    for name in recommenders:
+        start = time.perf_counter()
+        if name == 'rrf':
+            missing = [part for part in RRF_PARTS if part not in results]
+            if missing:
+                raise ValueError(f'rrf needs {missing} scored before it')
+            scores = fused
+            start -= fuse_seconds
+        else:
+            scores = score_batch(name, rows, _context)
+            if name in RRF_PARTS and 'rrf' in recommenders:
+                # ranks taken before the training ratings are masked below
+                fuse_start = time.perf_counter()
+                fused += 1 / (RRF_K + np.argsort(np.argsort(-scores, axis=1), axis=1))
+                fuse_seconds += time.perf_counter() - fuse_start
+                start += time.perf_counter() - fuse_start
+        # never recommend what the user rated in training
+        for i, row in enumerate(rows):
+            scores[i, X_train.indices[X_train.indptr[row]:X_train.indptr[row + 1]]] = -np.inf
+        recommended = top_k(scores, k)
+        totals = sum(ranking_metrics(recommended[i], relevant[i], k) for i in range(len(rows)))
+        results[name] = (totals, len(rows), np.unique(recommended), time.perf_counter() - start)
+    return results
+
+def evaluate_ranking(X, item_neighbours, category_index, recipe_mapper, recipe_inv_mapper,
+                     k=10, threshold=4, test_fraction=0.2, batch_size=256, workers=None, seed=42):
+    '''precision@k, recall@k, MAP@k, NDCG@k and catalog coverage of every recommender.
+
+    Users are scored in batches on a process pool. Only users with at least one
+    held-out rating >= threshold are evaluated.
+    '''
+    start = time.perf_counter()
+    X_train, X_test = holdout_split(X, test_fraction, seed)
+    context = {
+        'X_train': X_train, 'X_test': X_test, 'models': train_models(X_train),
+        'item_neighbours': item_neighbours, 'category_index': category_index,
+        'recipe_mapper': recipe_mapper, 'recipe_inv_mapper': recipe_inv_mapper,
+    }
+    train_seconds = time.perf_counter() - start
+
+    users = np.flatnonzero(np.diff((X_test >= threshold).tocsr().indptr) > 0)
+    batches = [users[i:i + batch_size] for i in range(0, len(users), batch_size)]
+
+    totals = {name: [np.zeros(4), 0, set(), 0.0] for name in RECOMMENDERS}
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count(), initializer=_init_worker, initargs=(context,)) as pool:
+        for results in pool.map(_evaluate_batch, batches, [k] * len(batches), [threshold] * len(batches)):
+            for name, (metrics, n_users, recommended, seconds) in results.items():
+                total = totals[name]
+                total[0] += metrics
+                total[1] += n_users
+                total[2].update(recommended.tolist())
+                total[3] += seconds
+
+    report = {
+        'config': {'k': k, 'threshold': threshold, 'test_fraction': test_fraction, 'seed': seed,
+                   'n_users': int(X.shape[0]), 'n_recipes': int(X.shape[1]), 'n_ratings': int(X.nnz),
+                   'n_evaluated_users': int(len(users))},
+        'seconds': {'train': train_seconds, 'total': time.perf_counter() - start},
+        'recommenders': {},
+    }
+    for name, (metrics, n_users, recommended, seconds) in totals.items():
+        metrics = metrics / max(n_users, 1)
+        report['recommenders'][name] = {
+            f'precision@{k}': metrics[0], f'recall@{k}': metrics[1],
+            f'map@{k}': metrics[2], f'ndcg@{k}': metrics[3],
+            'coverage': len(recommended) / X.shape[1],
+            'score_seconds': seconds,
+        }
+    return report
+
+def compare_reports(report, baseline):
+    '''{recommender: {metric: change}} of report against an older baseline report'''
+    return {name: {metric: value - baseline['recommenders'][name][metric]
+                   for metric, value in metrics.items() if metric in baseline['recommenders'].get(name, {})}
+            for name, metrics in report['recommenders'].items() if name in baseline['recommenders']}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Offline evaluation of the recipe recommenders")
+    commands = parser.add_subparsers(dest="command")
+    rmse_parser = commands.add_parser("rmse", help="RMSE of the naive and SVD models")
+    rmse_parser.add_argument("--split", type=int, default=2400, help="users before this row are the training set")
+    ranking_parser = commands.add_parser("ranking", help="ranking metrics of every recommender over held-out ratings")
+    ranking_parser.add_argument("--k", type=int, default=10)
+    ranking_parser.add_argument("--threshold", type=int, default=4, help="held-out ratings >= threshold are relevant")
+    ranking_parser.add_argument("--test-fraction", type=float, default=0.2)
+    ranking_parser.add_argument("--batch-size", type=int, default=256)
+    ranking_parser.add_argument("--workers", type=int, default=None)
+    ranking_parser.add_argument("--seed", type=int, default=42)
+    ranking_parser.add_argument("--output", default=None, help="write the JSON report here")
+    ranking_parser.add_argument("--baseline", default=None, help="older JSON report to compare against")
+    args = parser.parse_args()
+
+    from model import X, recipe_mapper, recipe_inv_mapper, registry
+
+    if args.command == "ranking":
+        report = evaluate_ranking(X, registry.get("item_neighbours"), registry.get("category_index"),
+                                  recipe_mapper, recipe_inv_mapper, k=args.k, threshold=args.threshold,
+                                  test_fraction=args.test_fraction, batch_size=args.batch_size,
+                                  workers=args.workers, seed=args.seed)
+        if args.baseline:
+            with open(args.baseline) as f:
+                report['change'] = compare_reports(report, json.load(f))
+        text = json.dumps(report, indent=2)
+        if args.output:
+            with open(args.output, 'w') as f:
+                f.write(text + '\n')
+        print(text)
+    else:
+        report = rmse_report(X, split=getattr(args, "split", 2400))
+        print(f'RMSE Train for naive model: {report["naive_train"]}')
+        print(f'RMSE Test for naive model: {report["naive_test"]}')
+        print(f'RMSE Train for SVD: {report["svd_train"]}')
+        print(f'RMSE Test for SVD: {report["svd_test"]}')
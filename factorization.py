@@ -0,0 +1,96 @@
+import argparse
+import time
+
+import numpy as np
+from scipy.sparse.linalg import LinearOperator, svds
+
+from artifacts import load_arrays, save_arrays
+
+
+def centred_operator(X, item_means):
+    '''X - item_means as a LinearOperator, so the centred matrix is never densified'''
+    X = X.tocsr().astype(np.float64)
+    XT = X.T.tocsr()
+    ones = np.ones(X.shape[0])
+
+    def matmat(V):
+        V = V.reshape(X.shape[1], -1)
+        return X @ V - np.outer(ones, item_means @ V)
+
+    def rmatmat(U):
+        U = U.reshape(X.shape[0], -1)
+        return XT @ U - np.outer(item_means, ones @ U)
+
+    # no rmatmat keyword, it only exists from scipy 1.4 and svds needs no more than rmatvec
+    return LinearOperator(X.shape, matvec=matmat, rmatvec=rmatmat, matmat=matmat, dtype=np.float64)
+
+
+class SVDModel:
+    '''Item factors of a truncated SVD of the item-mean-centred rating matrix.
+
+    Training rows are reconstructed as (x - item_means) V V^T + item_means;
+    fold_in applies the same projection to any sparse rating row, including
+    a quiz user who was never in the fit.
+
+    model = SVDModel.fit(X, n_components=100)
+    model.save("./pickle/svd")
+    SVDModel.load("./pickle/svd").fold_in(X[user])   >>> predicted rating per recipe
+    '''
+
+    def __init__(self, components, singular_values, item_means, recipe_ids=None):
+        self.components = components # k x n_recipes, V^T
+        self.singular_values = singular_values
+        self.item_means = item_means # per-item bias
+        self.recipe_ids = recipe_ids # column -> recipe_id the model was trained on
+        # item_means . V, so centring never densifies the user's sparse row
+        self.mean_projection = components @ item_means
+
+    @classmethod
+    def fit(cls, X, n_components=100, recipe_ids=None, random_state=42):
+        # calculate mean_rating_per_recipe
+        item_means = np.asarray(X.sum(axis=0)).ravel() / np.maximum(X.getnnz(axis=0), 1)
+        # remove item bias implicitly, X - item_means is only ever multiplied
+        k = min(n_components, min(X.shape) - 1)
+        v0 = np.random.RandomState(random_state).uniform(-1, 1, min(X.shape))
+        _, singular_values, components = svds(centred_operator(X, item_means), k=k, v0=v0)
+        order = np.argsort(-singular_values)
+        return cls(components[order], singular_values[order], item_means, recipe_ids)
+
+    def fold_in(self, vector):
+        '''Predicted rating for every column from a (1 x n_recipes) sparse rating row'''
+        return self.fold_in_batch(vector)[0]
+
+    def fold_in_batch(self, vectors):
+        '''Predicted ratings (n_users x n_recipes) for a block of sparse rating rows'''
+        z = np.asarray(vectors @ self.components.T) - self.mean_projection
+        return z @ self.components + self.item_means
+
+    def save(self, path):
+        arrays = dict(components=self.components.astype(np.float32),
+                      singular_values=self.singular_values.astype(np.float32),
+                      item_means=self.item_means.astype(np.float32))
+        if self.recipe_ids is not None:
+            arrays["recipe_ids"] = self.recipe_ids
+        save_arrays(path, **arrays)
+
+    @classmethod
+    def load(cls, path, mmap_mode=None):
+        arrays = load_arrays(path, mmap_mode)
+        return cls(arrays["components"], arrays["singular_values"], arrays["item_means"], arrays.get("recipe_ids"))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Fit the SVD item factors used by svd_recommender")
+    parser.add_argument("--components", type=int, default=100)
+    parser.add_argument("--output", default=None, help="artifact directory, defaults to the registered svd path")
+    args = parser.parse_args()
+
+    from model import X, recipe_inv_mapper, registry, SVD_PATH
+
+    start = time.perf_counter()
+    recipe_ids = np.asarray(recipe_inv_mapper)
+    model = SVDModel.fit(X, n_components=args.components, recipe_ids=recipe_ids)
+    model.save(args.output or SVD_PATH)
+    registry.reload("svd")
+    print(f'svd: {len(model.singular_values)} components for {X.shape[0]} users x {X.shape[1]} recipes '
+          f'in {time.perf_counter() - start:.2f}s -> {args.output or SVD_PATH}')
@@ -0,0 +1,49 @@
+'''Fold-in scoring: score a user who is not in the training matrix.
+
+The new user's ratings become one sparse row vector over the training
+columns, which is projected on precomputed structures (item factors, user
+and item neighbour indexes). X, the mappers and the fitted models are never
+rebuilt for an anonymous quiz user.
+
+vector = rating_vector(new_user, recipe_mapper)
+scores = registry.get("svd").fold_in(vector)      # one score per X column, see factorization.py
+'''
+import numpy as np
+from scipy.sparse import csr_matrix
+
+
+def rating_vector(new_user, recipe_mapper, n_recipes=None):
+    '''1 x n_recipes sparse ratings of a new_user dict, columns follow recipe_mapper.
+
+    {'user_id': [8888888], 'recipe_id': [219936], 'rating': [5]}
+
+    Recipes nobody in the training matrix has rated have no column and are left out.
+    '''
+    n_recipes = len(recipe_mapper) if n_recipes is None else n_recipes
+    pairs = [(recipe_mapper[recipe_id], rating)
+             for recipe_id, rating in zip(new_user['recipe_id'], new_user['rating'])
+             if recipe_id in recipe_mapper]
+    columns = [column for column, _ in pairs]
+    ratings = np.array([rating for _, rating in pairs], dtype=np.float64)
+    vector = csr_matrix((ratings, ([0] * len(columns), columns)), shape=(1, n_recipes))
+    vector.sum_duplicates()
+    return vector
+
+
+def item_item_scores(vector, item_neighbours, category_index, recipe_mapper, recipe_inv_mapper):
+    '''Sum over the user's rated recipes of rating x similarity of their neighbours, one score per column.
+
+    item_neighbours rows follow category_index, columns of the result follow recipe_mapper.
+    '''
+    scores = np.zeros(vector.shape[1])
+    for column, rating in zip(vector.indices, vector.data):
+        try:
+            row = category_index.row(recipe_inv_mapper[column])
+        except KeyError:
+            continue # rated recipe has no categories
+        rows, similarities = item_neighbours.neighbours(row)
+        for recipe_id, similarity in zip(category_index.recipe_ids[rows], similarities):
+            neighbour = recipe_mapper.get(recipe_id)
+            if neighbour is not None:
+                scores[neighbour] += rating * similarity
+    return scores
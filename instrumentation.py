@@ -0,0 +1,260 @@
+'''Per-request stage timings for the quiz route.
+
+Every instrumented recommender / utils call adds its wall time, call count
+and rows scanned to the trace of the request being served. A finished
+trace is logged as one JSON line and folded into latency histograms,
+which app.py serves on /metrics. Outside a request the wrappers only
+forward the call, so evaluation.py and the CLIs are not affected.
+
+instrument(recommenders, ["item_item_recommender", "svd_recommender"])   # once at import
+with tracer.request("/"): ...          # app.py does this in before/teardown_request
+add_rows(len(all_users))               # inside a stage that scans a table
+
+SEASONINGS_PROFILE=1, or a request with the X-Seasonings-Profile: 1 header,
+also samples the request thread's stack and logs the hottest stacks.
+Histograms are per process, every gunicorn worker serves its own.
+'''
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+logger = logging.getLogger("seasonings")
+
+PROFILE_ENV = "SEASONINGS_PROFILE"
+PROFILE_HEADER = "X-Seasonings-Profile"
+# upper bounds in seconds, Prometheus style
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def profiling_requested(headers=None):
+    '''True if the environment or the request headers ask for a profile'''
+    if os.environ.get(PROFILE_ENV, "0") == "1":
+        return True
+    return headers is not None and headers.get(PROFILE_HEADER, "0") == "1"
+
+
+def log_event(event, **fields):
+    '''One JSON line at DEBUG, tagged with the current request id if any'''
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+    trace = tracer.current()
+    if trace is not None:
+        fields["request_id"] = trace.request_id
+    logger.debug(json.dumps(dict(event=event, **fields), default=str))
+
+
+class Histogram:
+    '''Cumulative bucket counts, sum and count of observed values'''
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+    def lines(self, name, labels):
+        '''Prometheus text exposition lines for this histogram'''
+        label = ",".join(f'{key}="{value}"' for key, value in labels.items())
+        lines = [f'{name}_bucket{{{label},le="{bound}"}} {n}' for bound, n in zip(self.buckets, self.counts)]
+        lines.append(f'{name}_bucket{{{label},le="+Inf"}} {self.count}')
+        lines.append(f'{name}_sum{{{label}}} {self.sum:.6f}')
+        lines.append(f'{name}_count{{{label}}} {self.count}')
+        return lines
+
+
+class SamplingProfiler:
+    '''Samples one thread's Python stack every `interval` seconds from a background thread.
+
+    Stacks are counted in collapsed form, root first: "app.py:quiz;model.py:known_positives".
+    '''
+
+    def __init__(self, thread_id, interval=0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self, top=20):
+        '''Stop sampling, returns the `top` most sampled stacks as [stack, samples]'''
+        self._stop.set()
+        self._thread.join()
+        return [[stack, n] for stack, n in self.stacks.most_common(top)]
+
+
+class RequestTrace:
+    '''Wall time, calls and rows scanned per stage of one request'''
+
+    def __init__(self, path):
+        self.request_id = uuid.uuid4().hex[:12]
+        self.path = path
+        self.status = None
+        self.stages = defaultdict(lambda: {"seconds": 0.0, "calls": 0, "rows": 0})
+        self.active = []
+        self.profiler = None
+        self.profile = None
+        self._start = time.perf_counter()
+        self.seconds = None
+
+    def as_dict(self):
+        report = {
+            "event": "request",
+            "request_id": self.request_id,
+            "path": self.path,
+            "status": self.status,
+            "ms": round(self.seconds * 1000, 3),
+            "stages": {name: {"ms": round(stage["seconds"] * 1000, 3), "calls": stage["calls"], "rows": stage["rows"]}
+                       for name, stage in self.stages.items()},
+        }
+        if self.profile is not None:
+            report["profile"] = self.profile
+        return report
+
+
+class Tracer:
+    '''Keeps the trace of the request each thread is serving, and the histograms of finished ones.
+
+    Stage times are inclusive: item_item_recommender includes the
+    known_positives calls it makes. Rows go to the innermost stage.
+    '''
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.request_seconds = defaultdict(Histogram)
+        self.stage_seconds = defaultdict(Histogram)
+        self.stage_calls = Counter()
+        self.stage_rows = Counter()
+        # callables taking each finished RequestTrace, e.g. benchmark.py
+        self.observers = []
+
+    def current(self):
+        return getattr(self._local, "trace", None)
+
+    def start(self, path, profile=False):
+        trace = RequestTrace(path)
+        if profile:
+            trace.profiler = SamplingProfiler(threading.get_ident()).start()
+        self._local.trace = trace
+        return trace
+
+    def finish(self, status=None):
+        '''Close the current trace, log it and add it to the histograms'''
+        trace = self.current()
+        if trace is None:
+            return None
+        self._local.trace = None
+        trace.seconds = time.perf_counter() - trace._start
+        if status is not None:
+            trace.status = status
+        if trace.profiler is not None:
+            trace.profile = trace.profiler.stop()
+
+        with self._lock:
+            self.request_seconds[trace.path].observe(trace.seconds)
+            for name, stage in trace.stages.items():
+                self.stage_seconds[name].observe(stage["seconds"])
+                self.stage_calls[name] += stage["calls"]
+                self.stage_rows[name] += stage["rows"]
+        logger.info(json.dumps(trace.as_dict()))
+        for observer in self.observers:
+            observer(trace)
+        return trace
+
+    @contextmanager
+    def request(self, path, profile=False):
+        trace = self.start(path, profile)
+        try:
+            yield trace
+        finally:
+            self.finish()
+
+    @contextmanager
+    def stage(self, name):
+        trace = self.current()
+        if trace is None:
+            yield
+            return
+        trace.active.append(name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            stage = trace.stages[name]
+            stage["seconds"] += time.perf_counter() - start
+            stage["calls"] += 1
+            trace.active.pop()
+
+    def wrap(self, name, function):
+        def timed(*args, **kwargs):
+            if self.current() is None:
+                return function(*args, **kwargs)
+            with self.stage(name):
+                return function(*args, **kwargs)
+        timed.__name__ = function.__name__
+        timed.__doc__ = function.__doc__
+        timed.__wrapped__ = function
+        return timed
+
+    def add_rows(self, n):
+        '''Count n rows scanned against the innermost running stage'''
+        trace = self.current()
+        if trace is not None and trace.active:
+            trace.stages[trace.active[-1]]["rows"] += int(n)
+
+    def metrics(self):
+        '''Prometheus text exposition of every histogram and counter'''
+        with self._lock:
+            lines = ["# TYPE seasonings_request_seconds histogram"]
+            for path, histogram in sorted(self.request_seconds.items()):
+                lines.extend(histogram.lines("seasonings_request_seconds", {"path": path}))
+            lines.append("# TYPE seasonings_stage_seconds histogram")
+            for name, histogram in sorted(self.stage_seconds.items()):
+                lines.extend(histogram.lines("seasonings_stage_seconds", {"stage": name}))
+            lines.append("# TYPE seasonings_stage_calls_total counter")
+            lines.extend(f'seasonings_stage_calls_total{{stage="{name}"}} {n}' for name, n in sorted(self.stage_calls.items()))
+            lines.append("# TYPE seasonings_stage_rows_total counter")
+            lines.extend(f'seasonings_stage_rows_total{{stage="{name}"}} {n}' for name, n in sorted(self.stage_rows.items()))
+        return "\n".join(lines) + "\n"
+
+
+tracer = Tracer()
+
+
+def add_rows(n):
+    tracer.add_rows(n)
+
+
+def instrument(owner, names, tracer=tracer):
+    '''Replace owner.<name> for every name with a wrapper that records it as a stage'''
+    for name in names:
+        function = getattr(owner, name)
+        if not hasattr(function, "__wrapped__"):
+            setattr(owner, name, tracer.wrap(name, function))
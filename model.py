@@ -2,40 +2,57 @@
 import pandas as pd
 import numpy as np
 from random import sample
-from collections import Counter
-import ast
 import re
 import random
-import pickle
 
-# modelling & evaluation
-from sklearn.metrics.pairwise import cosine_similarity
+from artifacts import build_if_stale, build_lock, is_stale, registry
+from catalog import CategoryIndex, RecipeCatalog
+from neighbours import TopKIndex
+from factorization import SVDModel
+from foldin import rating_vector
+from instrumentation import add_rows
+from ratings import IdMapper, PositivesIndex, RatingsStore, convert_csv
+
+# modelling, see evaluation.py for the evaluation imports
 from scipy.sparse import csr_matrix
-from sklearn.preprocessing import LabelEncoder
-from sklearn.neighbors import NearestNeighbors
-from sklearn.decomposition import TruncatedSVD
-from sklearn.utils.extmath import randomized_svd
-from sklearn.metrics import roc_auc_score
 
 # scientific notation off
 np.set_printoptions(suppress=True)
 pd.options.display.float_format = '{:.2f}'.format
 
 # load data / global variables
-all_users = pd.read_csv("./data/all_users.csv")
-all_users.drop_duplicates(inplace=True)
-all_recipes = pd.read_csv("./data/recipes.csv")
+# ratings come from the columnar store in ./pickle/ratings, converted from all_users.csv
+# when it is missing or older, see ratings.py
+ALL_USERS_CSV = "./data/all_users.csv"
+RATINGS_PATH = "./pickle/ratings"
+
+def load_ratings(path, mmap_mode=None):
+    build_if_stale(path, lambda: convert_csv([ALL_USERS_CSV], path), ALL_USERS_CSV)
+    return RatingsStore.load(path, mmap_mode)
+
+registry.register("ratings", RATINGS_PATH, load_ratings)
+ratings_store = registry.get("ratings")
+all_users = ratings_store.to_frame()
+RECIPES_CSV = "./data/recipes.csv"
+all_recipes = pd.read_csv(RECIPES_CSV)
 all_recipes.drop_duplicates(inplace=True)
 # photo_urls = pd.read_csv("./data/photo_url/photo_urls.csv")
 # photo_urls.drop_duplicates(inplace=True)
-recipe_lookup = all_recipes[["id","title"]]
+recipe_lookup = all_recipes[["recipe_id","title"]]
+catalog = RecipeCatalog(all_recipes)
+# user -> recipes they rated, for known_positives and the similar users' picks
+positives = PositivesIndex.build(all_users)
+
+def load_category_index(path, mmap_mode=None):
+    '''Recipe x category matrix, built from all_recipes and saved on first use'''
+    # rebuild when recipes.csv is newer than the saved matrix
+    build_if_stale(path, lambda: CategoryIndex.build(all_recipes).save(path), RECIPES_CSV)
+    return CategoryIndex.load(path, mmap_mode)
+
+registry.register("category_index", "./pickle/category_index", load_category_index)
 
 # Collaborative filtering for those with at least 3 reviews
-# ratings_by_user = all_users.groupby(["user_id","username"])[["rating"]].count().sort_values("rating",ascending=False)
-# at_least_3_ids = list(ratings_by_user[ratings_by_user["rating"]>=3].reset_index().user_id)
-# users3 = all_users[all_users.user_id.isin(at_least_3_ids)][["user_id","recipe_id","rating"]]
-# pickle.dump(users3, open("users3.pkl", "wb"))
-users3 = pickle.load(open("./pickle/users3.pkl","rb"))
+users3 = ratings_store.min_ratings(3).to_frame()
 
 class utils:
     def __init__(self,all_recipes):
@@ -44,24 +61,27 @@ class utils:
     def get_category(title):
         '''get_category("Chef John's Chicken Cacciatore")
         Return multiple categories to ensure it's not too niche'''
-        df = all_recipes[["category","title"]]
-        my_category = df[df.title == title].category
-        categories = ast.literal_eval(my_category.values[0])
-        return categories
+        return catalog.title_categories(title)
 
     def recipe_id_to_title(recipe_id):
         ''' recipe_id_to_title(223042) >>> 'Chicken Parmesan'
         '''
-        df = all_recipes[["recipe_id","title"]]
-        my_title = df[df.recipe_id == recipe_id].title
-        return my_title.values[0]
+        return catalog.title(recipe_id)
 
     def title_to_id(title):
         ''' title_to_id('Chicken Parmesan') >>> '223042'
         '''
-        df = all_recipes[["recipe_id","title"]]
-        my_recipe = df[df.title == title].recipe_id
-        return my_recipe.values[0]
+        return catalog.recipe_id(title)
+
+    def recipe_ids_to_titles(recipe_ids):
+        ''' recipe_ids_to_titles([223042, 220854]) >>> array(['Chicken Parmesan', ...])
+        '''
+        return catalog.titles(recipe_ids)
+
+    def titles_to_ids(titles):
+        ''' titles_to_ids(['Chicken Parmesan']) >>> array([223042])
+        '''
+        return catalog.recipe_ids(titles)
 
     def strip_filler(str):
         '''Remove filler words'''
@@ -70,24 +90,26 @@ class utils:
         return " ".join(words)
 
     def known_positives(user_id,threshold=4,new_user=None):
-        '''Return known positives, by default no new_user input
+        '''Return titles of known positives, by default no new_user input
         new_user is a dictionary
 
         {'user_id': [8888888], 'recipe_id': [219936], 'rating': [5]}'''
 
-        users = all_users[["user_id","recipe_id","rating"]]
-        users = pd.concat([users,pd.DataFrame(new_user)])
+        recipe_ids = utils.known_positive_ids(user_id,threshold,new_user)
+        return list(utils.recipe_ids_to_titles([i for i in recipe_ids if i in catalog]))
 
-        user_preferences = pd.merge(users, recipe_lookup, on='recipe_id', how='left')
-        known_positives = user_preferences[(user_preferences["user_id"] == user_id)&(user_preferences["rating"] >= threshold)]
-        known_positives_list = list(known_positives.title)
-        return known_positives_list
+    def known_positive_ids(user_id,threshold=4,new_user=None):
+        '''Sorted recipe ids of known positives, the new_user overlay is not stored
+        known_positive_ids(8888888, new_user=utils.create_new_user(quiz_results))'''
+        recipe_ids = positives.positives(user_id,threshold,new_user)
+        add_rows(len(recipe_ids))
+        return recipe_ids
 
     def create_new_user(quiz_results):
         '''quiz_results = ['Spicy Chicken Thai Soup']
         create_new_user(quiz_results)'''
 
-        input = [utils.title_to_id(recipe) for recipe in quiz_results]
+        input = list(utils.titles_to_ids(quiz_results))
         new_user_id = [8888888] * len(input)
         new_user_recipe_ids = input
         new_user_ratings = [5] * len(input)
@@ -99,46 +121,35 @@ class utils:
         return new_user
 
     def count_categories(all_recipes_df):
-        ''' Returns a string of all unique categories of recipes
+        ''' Returns a one-hot dataframe of recipe_id and all unique categories of recipes
         count_categories(all_recipes)
         '''
-        all_recipes_df.dropna(axis=0,how='any',inplace=True)
-        recipe_categories = all_recipes.drop(["title","category","ingredients"],axis=1)
-        categories = []
-        # ast.literal turns str rep of list into list
-        # dropna otherwise we will experience errors with eval!
-        for i in [ast.literal_eval(j) for j in all_recipes_df.category.dropna()] :
-            categories.extend(i)
-        categories = list(set(categories))
-        for category in categories:
-            recipe_categories[category] = all_recipes_df["category"].apply(lambda row: int(category in row))
-
-        return recipe_categories.drop(["calories", "ratings", "reviews", "total_mins"],axis=1)
+        # dropna otherwise we will experience errors with eval! (on a copy, callers' frames are left alone)
+        return CategoryIndex.build(all_recipes_df.dropna(axis=0,how='any')).to_frame()
 
     def get_url(recipe_id):
-        '''url(220854)'''
-        try:
-            url = photo_urls.query(f'recipe_id=={recipe_id}').photo_url.values[0]
-        except: #image does not exist
-            url = "https://png.pngtree.com/element_origin_min_pic/17/08/09/28d3afc4b9471eba6f908caf6943d473.jpg"
-        return url
-
-    def similar_to_cat(categories, top_N=10, all_recipes=all_recipes):
+        '''url(220854), falls back to a placeholder if the image does not exist'''
+        return catalog.url(recipe_id)
+
+    def get_urls(recipe_ids):
+        '''get_urls([220854, 223042])'''
+        return catalog.urls(recipe_ids)
+
+    def similar_to_cat(categories, top_N=10, all_recipes=None):
         '''Return a sample of 6 of the top_N new recipes most similar to the chosen
         categories
 
         similar_to_cat(['Main Dish', 'Chicken', 'Chicken Cacciatore'])
 
         '''
-        sample_list = []
-        matrix = utils.count_categories(all_recipes)
-        for category in categories:
-            try:
-                recipes = list(matrix[matrix[category]==1].recipe_id)
-                sample_list.extend(recipes)
-            except:
-                pass
-        return random.sample(sample_list,6)
+        if all_recipes is None:
+            index = registry.get("category_index")
+        else:
+            index = CategoryIndex.build(all_recipes)
+        # union of the category posting lists, unknown categories contribute nothing
+        recipes = index.union(categories)
+        add_rows(len(recipes))
+        return random.sample(list(recipes),min(6,len(recipes)))
 
 def create_X(df):
     """
@@ -149,44 +160,95 @@ def create_X(df):
 
     Returns:
         X: sparse user-item matrix
-        user_mapper: dict that maps user id's to user indices
-        user_inv_mapper: dict that maps user indices to user id's
-        recipe_mapper: dict that maps recipe id's to recipe indices
-        recipe_inv_mapper: dict that maps recipe indices to movie id's
+        user_mapper: IdMapper that maps user id's to user indices
+        recipe_mapper: IdMapper that maps recipe id's to recipe indices
+        user_inv_mapper: array that maps user indices to user id's
+        recipe_inv_mapper: array that maps recipe indices to recipe id's
 
     X, user_mapper, recipe_mapper, user_inv_mapper, recipe_inv_mapper = create_X(users3)
 
     """
-    M = df['user_id'].nunique()
-    N = df['recipe_id'].nunique()
+    # one np.unique per column gives both the sorted ids and every row's code
+    user_mapper, user_index = IdMapper.factorize(df["user_id"].to_numpy())
+    recipe_mapper, item_index = IdMapper.factorize(df["recipe_id"].to_numpy())
 
-    user_mapper = dict(zip(np.unique(df["user_id"]), list(range(M))))
-    recipe_mapper = dict(zip(np.unique(df["recipe_id"]), list(range(N))))
+    X = csr_matrix((df["rating"].to_numpy(), (user_index, item_index)), shape=(len(user_mapper),len(recipe_mapper)))
 
-    user_inv_mapper = dict(zip(list(range(M)), np.unique(df["user_id"])))
-    recipe_inv_mapper = dict(zip(list(range(N)), np.unique(df["recipe_id"])))
+    return X, user_mapper, recipe_mapper, user_mapper.ids, recipe_mapper.ids
 
-    user_index = [user_mapper[i] for i in df['user_id']]
-    item_index = [recipe_mapper[i] for i in df['recipe_id']]
+def append_X(X, user_mapper, recipe_mapper, df):
+    """
+    Adds the ratings in df to a matrix from create_X. Existing users and recipes
+    keep their indices, new ones are appended as new rows / columns.
 
-    X = csr_matrix((df["rating"], (user_index, item_index)), shape=(M,N))
+    X, user_mapper, recipe_mapper, user_inv_mapper, recipe_inv_mapper = append_X(X, user_mapper, recipe_mapper, new_ratings)
 
-    return X, user_mapper, recipe_mapper, user_inv_mapper, recipe_inv_mapper
+    """
+    user_mapper, user_index = user_mapper.append(df["user_id"].to_numpy())
+    recipe_mapper, item_index = recipe_mapper.append(df["recipe_id"].to_numpy())
 
-X, user_mapper, recipe_mapper, user_inv_mapper, recipe_inv_mapper = create_X(users3)
+    shape = (len(user_mapper),len(recipe_mapper))
+    added = csr_matrix((df["rating"].to_numpy(), (user_index, item_index)), shape=shape)
+    X = X.tocsr(copy=True)
+    X.resize(shape)
+    X = X + added
 
-# pre-calculate for speed for Heroku website
+    return X, user_mapper, recipe_mapper, user_mapper.ids, recipe_mapper.ids
 
-# 1
-# pickle.dump(similarity_matrix, open("similarity_matrix.pkl", "wb"))
-# similarity_matrix = cosine_similarity(X,X)
+X, user_mapper, recipe_mapper, user_inv_mapper, recipe_inv_mapper = create_X(users3)
 
-# 2
-# recipe_categories = utils.count_categories(all_recipes).iloc[:,1:]
-# A = csr_matrix(recipe_categories)
-# del recipe_categories
-# cosine_sim = cosine_similarity(A, A)
-# pickle.dump(cosine_sim, open("cosine_sim.pkl","wb"))
+# pre-calculate for speed for Heroku website
+# top-k neighbour indexes replace the dense cosine_similarity(X,X) and
+# cosine_similarity(A,A) matrices: only k neighbours are kept per user / recipe.
+# Built on first use and saved to ./pickle, or rebuilt with `python neighbours.py`
+
+NEIGHBOUR_ARTIFACTS = {
+    # 1 users who rated similarly, rows follow user_mapper
+    "user_neighbours": (lambda: TopKIndex.build(X, k=10), "./pickle/user_neighbours"),
+    # 2 recipes sharing categories, rows follow the category_index matrix
+    "item_neighbours": (lambda: TopKIndex.build(registry.get("category_index").matrix, k=20),
+        "./pickle/item_neighbours"),
+    "item_far_neighbours": (lambda: TopKIndex.build(registry.get("category_index").matrix, k=20, largest=False),
+        "./pickle/item_far_neighbours"),
+}
+
+def neighbour_loader(build, *sources):
+    def load(path, mmap_mode=None):
+        build_if_stale(path, lambda: build().save(path), *sources)
+        return TopKIndex.load(path, mmap_mode)
+    return load
+
+registry.register("user_neighbours", NEIGHBOUR_ARTIFACTS["user_neighbours"][1],
+    neighbour_loader(NEIGHBOUR_ARTIFACTS["user_neighbours"][0], RATINGS_PATH))
+registry.register("item_neighbours", NEIGHBOUR_ARTIFACTS["item_neighbours"][1],
+    neighbour_loader(NEIGHBOUR_ARTIFACTS["item_neighbours"][0], RECIPES_CSV))
+registry.register("item_far_neighbours", NEIGHBOUR_ARTIFACTS["item_far_neighbours"][1],
+    neighbour_loader(NEIGHBOUR_ARTIFACTS["item_far_neighbours"][0], RECIPES_CSV))
+
+# 3 item factors for svd_recommender, trained offline with `python factorization.py`
+SVD_PATH = "./pickle/svd"
+
+def load_svd(path, mmap_mode=None):
+    recipe_ids = np.asarray(recipe_inv_mapper)
+
+    def saved():
+        svd = None if is_stale(path, RATINGS_PATH) else SVDModel.load(path, mmap_mode)
+        # retrain if missing, older than the ratings store or trained on other recipe columns
+        if svd is None or svd.recipe_ids is None or not np.array_equal(svd.recipe_ids, recipe_ids):
+            return None
+        return svd
+
+    svd = saved()
+    if svd is None:
+        with build_lock(path):
+            # another worker may have trained it while we waited
+            svd = saved()
+            if svd is None:
+                svd = SVDModel.fit(X, n_components=100, recipe_ids=recipe_ids)
+                svd.save(path)
+    return svd
+
+registry.register("svd", SVD_PATH, load_svd)
 
 class recommenders:
     def __init__(self):
@@ -194,57 +256,51 @@ class recommenders:
 
     def sample_popular(n=24):
         '''Return a sample of 12 of top 1000/1000+ recipes'''
+        add_rows(len(all_users))
         df = all_users[["rating","recipe_id"]].groupby("recipe_id").count().sort_values(by="rating",ascending=False).reset_index()
-        top_1000 = [utils.recipe_id_to_title(thing) for thing in df[0:500].recipe_id]
+        top_1000 = list(utils.recipe_ids_to_titles(df[0:500].recipe_id))
         return sample(top_1000,n)
 
-    def user_user_recommender(top_N, user_id, threshold=4, X_sparse=X, user_mapper=user_mapper, recipe_lookup = recipe_lookup, all_users=all_users,new_user=None):
-        '''Return a sample of 6 of top_N new recipes based on similar users
+    def user_user_recommender(user_id, threshold=4, user_mapper=user_mapper, recipe_lookup = recipe_lookup, all_users=None,new_user=None):
+        '''Return a sample of 6 of the first 25 new recipes rated by similar users
 
-        X: sparse user-item utility matrix, not normalized
-
-        recommenders.user_user_recommender(top_N=20, user_id=3936048)
+        recommenders.user_user_recommender(user_id=3936048)
 
         '''
 
-        similarity_matrix = pickle.load(open("./pickle/similarity_matrix.pkl", "rb"))
-        user = user_mapper[user_id]
-        # negate for most similar
-        similar_users = np.argsort(-similarity_matrix[user])[1:11] # remove original user, peak at top 10 similar users
-        sorted(-similarity_matrix[user])[1:]
-        recommended_recipes = []
+        user_neighbours = registry.get("user_neighbours")
+        if new_user is None:
+            # existing user, peak at the top 10 precomputed similar users
+            similar_users, _ = user_neighbours.neighbours(user_mapper[user_id])
+        else:
+            # new user is not in the index, score it against every stored user
+            similar_users, _ = user_neighbours.query(rating_vector(new_user, recipe_mapper), k=10)
+        # ratings of the similar users, from the per-user index unless another all_users is given
+        index = positives if all_users is None else PositivesIndex.build(all_users)
         # returns enough recipes ~100, so good coverage
-        # loop through all users to get top_N items, only if the recipes > threshold
-        for i in similar_users:
-            similar_user = (all_users[all_users["user_id"]==user_inv_mapper[i]])
-            recommended_recipes.extend(list(similar_user[similar_user.rating>=threshold].recipe_id))
+        # items of the similar users, only if the recipes > threshold, in the order of their all_users rows
+        recommended_recipes = np.concatenate([index.rated(user_inv_mapper[i], threshold) for i in similar_users])
+        add_rows(len(recommended_recipes))
 
-        picks = recommended_recipes[0:25]
+        # remove already tried items, one membership test for all candidates
+        picks = positives.exclude(recommended_recipes[0:25], user_id, threshold, new_user)
         # convert recipe_id to title
-        picks = [recipe_lookup.query(f'recipe_id=={i}').title.values[0] for i in picks]
-
-        # remove already tried items
-        new_picks = [pick for pick in picks if pick not in utils.known_positives(user_id,threshold,new_user)]
+        new_picks = list(utils.recipe_ids_to_titles(picks))
 
         # remove duplicates & sample 6
-        return sample(set(new_picks),6)
+        return sample(list(set(new_picks)),6)
 
     def quiz_user_user_recommender(new_user):
         '''
         Accept new user input and applies user_user_recommender function
         recommenders.quiz_user_user_recommender(utils.create_new_user(quiz_results))'''
 
-        pd_new_user = pd.DataFrame(new_user)
-        # concat new_user rows
-        new_user_df = pd.concat([users3,pd_new_user])
-        # create a X_new
-        X_new, user_mapper_new, recipe_mapper_new, user_inv_mapper_new, recipe_inv_mapper_new = create_X(new_user_df)
+        # the quiz user is folded into the user index at query time, X is left untouched
+        return recommenders.user_user_recommender(user_id=8888888, threshold=4,
+        recipe_lookup = recipe_lookup, new_user=new_user)
 
-        return recommenders.user_user_recommender(top_N=30, user_id=8888888, threshold=4, X_sparse=X_new,
-        user_mapper=user_mapper_new, recipe_lookup = recipe_lookup, all_users=all_users,new_user=new_user)
 
-
-    def item_item_recommender(title, top_N=10, opposite=False, threshold=4, all_recipes=all_recipes, new_user=None, user_id=8888888):
+    def item_item_recommender(title, top_N=10, opposite=False, threshold=4, new_user=None, user_id=8888888):
         '''Return a sample of 6 of top_N new recipes most similar to chosen recipe,
         by default top_N is 10, so items are very similar. Opposite=False by default.
 
@@ -253,27 +309,26 @@ class recommenders:
         recommenders.item_item_recommender(title="Chef John's Italian Meatballs", new_user=utils.create_new_user(quiz_results))
         '''
 
-        cosine_sim = pickle.load(open("./pickle/cosine_sim.pkl","rb"))
+        category_index = registry.get("category_index")
+        item_neighbours = registry.get("item_far_neighbours" if opposite else "item_neighbours")
+
+        recipe_id = utils.title_to_id(title)
+        idx = category_index.row(recipe_id)
 
-        recipe_idx = dict(zip(all_recipes['title'], list(all_recipes.index)))
-        idx = recipe_idx[title]
+        if top_N + 2 <= item_neighbours.k:
+            neighbour_rows, _ = item_neighbours.neighbours(idx)
+        else:
+            neighbour_rows, _ = item_neighbours.query(item_neighbours.vectors[idx], k=top_N+2, exclude=[idx])
+        # a recipe listed on two rows is its own neighbour, drop it
+        neighbour_ids = category_index.recipe_ids[neighbour_rows]
+        neighbour_ids = pd.unique(neighbour_ids[neighbour_ids != recipe_id])[:top_N]
+        # filter out items chosen, by default filter out new user 8888888
+        neighbour_ids = positives.exclude(neighbour_ids, user_id, threshold, new_user)
+        new_picks = list(utils.recipe_ids_to_titles(neighbour_ids))
 
-        sim_scores = list(enumerate(cosine_sim[idx]))
         if opposite:
-            sim_scores.sort(key=lambda x: x[1], reverse=False)
-            sim_scores = sim_scores[1:(top_N+1)] # taking the first top_N makes it run a lot faster
-            dissimilar_recipes_idx = [i[0] for i in sim_scores]
-            picks = list(all_recipes['title'].iloc[dissimilar_recipes_idx])
-            new_picks = [pick for pick in picks if pick not in utils.known_positives(user_id,threshold,new_user)]
             return sample(new_picks[0:100],6)
-
         else:
-            sim_scores = sorted(sim_scores, key=lambda x: x[1], reverse=True)
-            sim_scores = sim_scores[1:(top_N+1)]
-            similar_recipes_idx = [i[0] for i in sim_scores]
-            picks = list(all_recipes['title'].iloc[similar_recipes_idx])
-            # filter out items chosen, by default filter out new user 8888888
-            new_picks = [pick for pick in picks if pick not in utils.known_positives(user_id,threshold,new_user)]
             # choose the top 6 from ranked new_picks to display
             return sample(new_picks[0:10],6)
 
@@ -295,52 +350,22 @@ class recommenders:
         # new user
         recommenders.svd_recommender(8888888, new_user=new_user)
         '''
-        # for new user predictions
+        svd = registry.get("svd")
+        # for new user predictions, fold the quiz ratings into the trained factors
         if new_user != None:
-            pd_new_user = pd.DataFrame(new_user)
-            # concat new_user rows
-            new_user_df = pd.concat([users3,pd_new_user])
-            # create a X_new
-            X_new, user_mapper_new, recipe_mapper_new, user_inv_mapper_new, recipe_inv_mapper_new = create_X(new_user_df)
-
-            X = X_new
-            user_mapper = user_mapper_new
-            recipe_inv_mapper = recipe_inv_mapper_new
+            vector = rating_vector(new_user, recipe_mapper)
         else:
-            X, user_mapper, recipe_mapper, user_inv_mapper, recipe_inv_mapper = create_X(users3)
-            X = X
-            user_mapper = user_mapper
-            recipe_inv_mapper = recipe_inv_mapper
-
-        # calculate mean_rating_per_recipe
-        sum_ratings_per_recipe = X.sum(axis=0)
-        n_ratings_per_recipe = X.getnnz(axis=0)
-        mean_rating_per_recipe = sum_ratings_per_recipe/n_ratings_per_recipe
-        X_mean_recipe = np.tile(mean_rating_per_recipe, (X.shape[0],1))
-
-        user = user_mapper[user_id]
-        # remove item bias
-        X_norm = X - csr_matrix(X_mean_recipe)
-
-        svd = TruncatedSVD(n_components=100,random_state=42)
-        Z = svd.fit_transform(X_norm)
-        X_new = svd.inverse_transform(Z)
-        # add back the mean so it's interpretable
-        X_new = X_new + np.array(X_mean_recipe)
-
-        top_N_indices = X_new[user].argsort()[::-1]
-
-        # check that it's greater than a threshold
-        mask = X_new[user][top_N_indices]>threshold
-        num_greater_than = len(X_new[user][top_N_indices][mask])
-        # indices in order
-        top_N_indices = top_N_indices[:num_greater_than]
-        recommended = []
-        for i in top_N_indices:
-            recipe_id = recipe_inv_mapper[i]
-            recommended.append((recipe_id, utils.recipe_id_to_title(recipe_id)))
-
-        picks = [recipe[1] for recipe in recommended[0:10]]
+            vector = X[user_mapper[user_id]]
+        predicted = svd.fold_in(vector)
+        add_rows(len(predicted))
+
+        # check that it's greater than a threshold, keep the top 10 in order
+        top_N_indices = np.flatnonzero(predicted > threshold)
+        if len(top_N_indices) > 10:
+            top_N_indices = top_N_indices[np.argpartition(-predicted[top_N_indices], 10)[:10]]
+        top_N_indices = top_N_indices[np.argsort(-predicted[top_N_indices], kind="stable")]
+
+        picks = list(utils.recipe_ids_to_titles([recipe_inv_mapper[i] for i in top_N_indices]))
 
         # there may not always be more than 6 things > 4 rating
         if len(picks) >= 6:
@@ -348,65 +373,4 @@ class recommenders:
         else:
             return picks
 
-### evaluation ###
-sum_ratings_per_recipe = X.sum(axis=0)
-n_ratings_per_recipe = X.getnnz(axis=0)
-mean_rating_per_recipe = sum_ratings_per_recipe/n_ratings_per_recipe
-X_mean_recipe = np.tile(mean_rating_per_recipe, (X.shape[0],1))
-X_norm = X - csr_matrix(X_mean_recipe)
-
-X_train_norm = X_norm.todense()[0:2400]
-X_test_norm = X_norm.todense()[2400:]
-
-### Naive model ###
-naive_preds = np.tile(0,(3211,1053))
-print(f'RMSE Train for naive model: {np.sqrt(((np.array(X_train_norm)-naive_preds[0:2400])**2).mean())}')
-print(f'RMSE Test for naive model: {np.sqrt(((np.array(X_test_norm)-naive_preds[2400:])**2).mean())}')
-
-### Matrix Factorization Metric Calculation ###
-
-svd = TruncatedSVD(n_components=100, random_state=42)
-Z_train = svd.fit_transform(X_train_norm)
-X_train_new = svd.inverse_transform(Z_train)
-svd.explained_variance_ratio_.sum()
-
-# Sklearn Truncated SVD uses randomized_svd
-U, Sigma, VT = randomized_svd(X_norm,
-                              n_components=100,
-                              n_iter=10,
-                              random_state=None)
-
-def rank_k(k):
-    U_reduced = np.mat(U[:,:k])
-    VT_reduced = np.mat(VT[:k,:])
-    Sigma_reduced = Sigma_reduced = np.eye(k)*Sigma[:k]
-    Sigma_sqrt = np.sqrt(Sigma_reduced)
-    return U_reduced*Sigma_sqrt, Sigma_reduced, Sigma_sqrt*VT_reduced
-
-U_reduced, Sigma_reduced, VT_reduced = rank_k(30)
-
-U_new = np.dot(X_test_norm, np.dot(VT_reduced.T,np.linalg.inv(Sigma_reduced)))
-M_hat = np.dot(U_new,VT_reduced)
-
-print(f'RMSE Train for SVD: {np.sqrt(((np.array(X_train_norm)-X_train_new)**2).mean())}')
-print(f'RMSE Test for SVD: {np.sqrt(((np.array(X_test_norm)-np.array(M_hat))**2).mean())}')
-
-### Ranking Metrics ###
-def precision_and_recall_at_k(predictions, targets, k=6):
-    '''Returns a tuple of (precision, recall) of the top k items
-
-    precision = TP/(TP+FP) -> what fraction of recommended items did the user consume?
-    recall = TP/(TP+FN) -> What out of all the items the user consumed, was recommended?
-
-    precision_and_recall_at_k(list(all_recipes.title.sample(10)), utils.known_positives(3936048),k=6)
-    precision_and_recall_at_k(recommenders.svd_recommender(3936048), utils.known_positives(3936048),k=6)
-    precision_and_recall_at_k(recommenders.user_user_recommender(20,3936048), utils.known_positives(3936048),k=6)
-    precision_and_recall_at_k(recommenders.item_item_recommender("Chef John's Italian Meatballs"), utils.known_positives(3936048),k=6)
-
-    '''
-    predictions = predictions[:k]
-    num_hit = len(set(predictions).intersection(set(targets)))
-    try:
-        return float(num_hit) / len(predictions), float(num_hit) / len(targets)
-    except:
-        return "Predictions must be greater than length 1"
+# evaluation lives in evaluation.py (`python evaluation.py`), so importing model stays cheap
@@ -0,0 +1,113 @@
+import numpy as np
+from scipy.sparse import csr_matrix, diags
+
+from artifacts import load_arrays, save_arrays
+
+
+def normalize_rows(X):
+    '''Scale every row of a sparse matrix to unit L2 norm, all-zero rows stay zero'''
+    X = csr_matrix(X, dtype=np.float32)
+    norms = np.sqrt(np.asarray(X.multiply(X).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    return (diags((1 / norms).astype(np.float32)) @ X).tocsr()
+
+
+def blocked_top_k(vectors, k, largest=True, block_size=1024):
+    '''Top-k cosine neighbours of every row of the row-normalized sparse `vectors`.
+
+    Similarities are computed one block of rows at a time, so peak memory is
+    block_size x N instead of N x N. A row is never its own neighbour.
+    largest=False returns the k least similar rows instead.
+
+    Returns (indices, scores), both shaped (N, k) and sorted best first.
+    '''
+    n = vectors.shape[0]
+    k = min(k, n - 1)
+    indices = np.empty((n, k), dtype=np.int32)
+    scores = np.empty((n, k), dtype=np.float32)
+    sign = 1.0 if largest else -1.0
+
+    for start in range(0, n, block_size):
+        stop = min(start + block_size, n)
+        block = sign * (vectors[start:stop] @ vectors.T).toarray()
+        block[np.arange(stop - start), np.arange(start, stop)] = -np.inf
+        part = np.argpartition(-block, k - 1, axis=1)[:, :k]
+        order = np.argsort(-np.take_along_axis(block, part, axis=1), axis=1, kind="stable")
+        best = np.take_along_axis(part, order, axis=1)
+        indices[start:stop] = best
+        scores[start:stop] = sign * np.take_along_axis(block, best, axis=1)
+
+    return indices, scores
+
+
+class TopKIndex:
+    '''k nearest rows of a matrix by cosine similarity, never materializing N x N.
+
+    Stores the k best neighbours per row plus the row-normalized vectors, so
+    rows that were not in the matrix (e.g. a new quiz user) can be queried too.
+
+    index = TopKIndex.build(X, k=10)
+    index.neighbours(user_mapper[3936048])   >>> (rows, scores)
+    index.query(new_user_vector, k=10)       >>> (rows, scores)
+    '''
+
+    def __init__(self, indices, scores, vectors, largest=True):
+        self.indices = indices
+        self.scores = scores
+        self.vectors = vectors
+        self.largest = largest
+
+    @classmethod
+    def build(cls, X, k=10, largest=True, block_size=1024):
+        vectors = normalize_rows(X)
+        indices, scores = blocked_top_k(vectors, k, largest, block_size)
+        return cls(indices, scores, vectors, largest)
+
+    @property
+    def k(self):
+        return self.indices.shape[1]
+
+    def neighbours(self, row):
+        return self.indices[row], self.scores[row]
+
+    def similarities(self, vector):
+        '''Cosine similarity of a (1 x M) sparse row against every stored row'''
+        vector = normalize_rows(vector)
+        return (self.vectors @ vector.T).toarray().ravel()
+
+    def query(self, vector, k=None, exclude=()):
+        '''Top-k rows for a vector that is not (or not necessarily) in the index'''
+        sims = self.similarities(vector)
+        if not self.largest:
+            sims = -sims
+        sims[list(exclude)] = -np.inf
+        k = min(k or self.k, len(sims) - len(exclude))
+        part = np.argpartition(-sims, k - 1)[:k]
+        best = part[np.argsort(-sims[part], kind="stable")]
+        sims = sims[best]
+        return best, (sims if self.largest else -sims)
+
+    def save(self, path):
+        save_arrays(path, indices=self.indices, scores=self.scores, largest=np.array(self.largest),
+                    data=self.vectors.data, vector_indices=self.vectors.indices,
+                    indptr=self.vectors.indptr, shape=np.array(self.vectors.shape))
+
+    @classmethod
+    def load(cls, path, mmap_mode=None):
+        arrays = load_arrays(path, mmap_mode)
+        vectors = csr_matrix((arrays["data"], arrays["vector_indices"], arrays["indptr"]),
+                             shape=tuple(arrays["shape"]))
+        return cls(arrays["indices"], arrays["scores"], vectors, bool(arrays["largest"]))
+
+
+if __name__ == '__main__':
+    # rebuild every neighbour index, e.g. after new data has been scraped
+    import time
+    from model import registry, NEIGHBOUR_ARTIFACTS
+
+    for name in NEIGHBOUR_ARTIFACTS:
+        start = time.perf_counter()
+        build, path = NEIGHBOUR_ARTIFACTS[name]
+        build().save(path)
+        registry.reload(name)
+        print(f'{name}: built in {time.perf_counter() - start:.2f}s -> {path}')
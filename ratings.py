@@ -0,0 +1,467 @@
+'''Ratings tables: a compact columnar store and a per-user positives index.
+
+RatingsStore keeps one row per rating as int32 user / recipe codes, int8
+ratings, int32 days since 1970 and int32 username codes, with the ids and
+usernames in separate dictionaries. It is saved as a directory of .npy
+files (artifacts.save_arrays), so it loads in milliseconds and can be
+memory-mapped, instead of parsing all_users.csv or unpickling a DataFrame.
+
+CSVs are converted in chunks of rows (RatingsEncoder): ids are encoded and
+duplicate rows dropped as the chunks stream by, and convert_csv appends
+every chunk to the store on disk, so no whole CSV is held in memory.
+
+python ratings.py data/all_users.csv src/data/reviews.csv --output ./pickle/ratings
+'''
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from artifacts import ArrayWriter, load_arrays, save_arrays
+
+NO_DATE = np.iinfo(np.int32).min
+CHUNK_ROWS = 100_000
+
+
+def encode_dates(values):
+    '''int32 days since 1970 of date strings, NO_DATE where missing or unparsable'''
+    days = pd.to_datetime(pd.Series(values), errors="coerce").values.astype("datetime64[D]")
+    return np.where(np.isnat(days), NO_DATE, days.astype(np.int64)).astype(np.int32)
+
+
+class StringDictionary:
+    '''Unique strings stored as one utf-8 byte array plus offsets, so it can be memory-mapped.
+
+    names, codes = StringDictionary.build(['b', 'a', 'b'])   # codes >>> array([1, 0, 1])
+    names[1]                                                  >>> 'b'
+    '''
+
+    def __init__(self, data, offsets):
+        self.data = data
+        self.offsets = offsets
+        self._strings = None
+
+    @classmethod
+    def build(cls, strings):
+        '''(dictionary, int32 code of every string), missing values become ""'''
+        strings = pd.Series(strings).fillna("").astype(str).to_numpy()
+        unique, codes = np.unique(strings, return_inverse=True)
+        return cls.from_strings(unique), codes.astype(np.int32)
+
+    @classmethod
+    def from_strings(cls, strings):
+        '''Dictionary of unique strings, codes follow their order'''
+        encoded = [string.encode("utf-8") for string in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in encoded], out=offsets[1:])
+        data = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        return cls(data, offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, code):
+        return bytes(self.data[self.offsets[code]:self.offsets[code + 1]]).decode("utf-8")
+
+    def strings(self):
+        '''Every string as an object array, decoded once'''
+        if self._strings is None:
+            blob = bytes(self.data)
+            self._strings = np.array([blob[start:stop].decode("utf-8")
+                                      for start, stop in zip(self.offsets[:-1], self.offsets[1:])], dtype=object)
+        return self._strings
+
+    def decode(self, codes):
+        return self.strings()[codes]
+
+
+class IdMapper:
+    '''id -> matrix index, backed by an id array instead of a dict.
+
+    ids[code] is the id of code, so the array itself is the inverse mapper.
+    Appended ids take the next codes and existing codes never move, lookups
+    binary-search a sorted copy of the ids.
+
+    user_mapper, codes = IdMapper.factorize(df["user_id"].to_numpy())
+    user_mapper[3936048]                  >>> 17
+    user_mapper.get(1)                    >>> None
+    user_mapper.codes([3936048, 1])       >>> array([17, -1])
+    '''
+
+    def __init__(self, ids, order=None):
+        self.ids = np.asarray(ids)
+        self.order = np.argsort(self.ids, kind="stable") if order is None else order
+        self.sorted_ids = self.ids[self.order]
+
+    @classmethod
+    def factorize(cls, values):
+        '''(mapper over the sorted unique values, code of every value)'''
+        ids, codes = np.unique(values, return_inverse=True)
+        return cls(ids, np.arange(len(ids))), codes.ravel()
+
+    def codes(self, ids, missing=-1):
+        '''Vectorized lookup, `missing` for ids that are not mapped'''
+        ids = np.asarray(ids)
+        if len(self.ids) == 0:
+            return np.full(ids.shape, missing, dtype=np.int64)
+        pos = np.minimum(np.searchsorted(self.sorted_ids, ids), len(self.ids) - 1)
+        return np.where(self.sorted_ids[pos] == ids, self.order[pos], missing)
+
+    def append(self, values):
+        '''(extended mapper, code of every value), unseen values get new codes in sorted order'''
+        values = np.asarray(values)
+        new_ids = np.unique(values[self.codes(values) == -1])
+        mapper = IdMapper(np.concatenate([self.ids, new_ids]).astype(self.ids.dtype, copy=False))
+        return mapper, mapper.codes(values)
+
+    def get(self, key, default=None):
+        i = np.searchsorted(self.sorted_ids, key)
+        if i < len(self.sorted_ids) and self.sorted_ids[i] == key:
+            return int(self.order[i])
+        return default
+
+    def __getitem__(self, key):
+        code = self.get(key)
+        if code is None:
+            raise KeyError(key)
+        return code
+
+    def __contains__(self, id):
+        return self.get(id) is not None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        return iter(self.ids)
+
+    def keys(self):
+        return self.ids
+
+    def values(self):
+        return np.arange(len(self.ids))
+
+    def items(self):
+        return zip(self.ids, range(len(self.ids)))
+
+
+class RatingsStore:
+    '''Columnar ratings table with dictionary-encoded ids.
+
+    store = RatingsStore.from_csv("./data/all_users.csv")
+    store.save("./pickle/ratings")
+    store = RatingsStore.load("./pickle/ratings", mmap_mode="r")
+    store.to_frame()                    >>> user_id, recipe_id, rating DataFrame
+    store.min_ratings(3).to_frame()     >>> users3
+    '''
+
+    def __init__(self, user_codes, recipe_codes, ratings, dates, username_codes,
+                 user_dict, recipe_dict, usernames):
+        self.user_codes = user_codes
+        self.recipe_codes = recipe_codes
+        self.ratings = ratings
+        self.dates = dates
+        self.username_codes = username_codes
+        self.user_dict = user_dict
+        self.recipe_dict = recipe_dict
+        self.usernames = usernames
+
+    @classmethod
+    def from_frame(cls, df):
+        '''df has user_id, recipe_id and rating columns, date and username are optional'''
+        user_dict, user_codes = np.unique(df["user_id"].to_numpy(np.int64), return_inverse=True)
+        recipe_dict, recipe_codes = np.unique(df["recipe_id"].to_numpy(np.int64), return_inverse=True)
+        if "date" in df:
+            dates = encode_dates(df["date"])
+        else:
+            dates = np.full(len(df), NO_DATE, dtype=np.int32)
+        usernames, username_codes = StringDictionary.build(df["username"] if "username" in df else [""] * len(df))
+        return cls(user_codes.astype(np.int32), recipe_codes.astype(np.int32),
+                   df["rating"].to_numpy(np.int8), dates, username_codes,
+                   user_dict, recipe_dict, usernames)
+
+    @classmethod
+    def from_csv(cls, *paths, chunksize=CHUNK_ROWS):
+        '''Concatenate ratings CSVs (date, rating, recipe_id, user_id, username), exact duplicate rows dropped.
+
+        The CSVs are read `chunksize` rows at a time, only the encoded columns are kept.
+        '''
+        encoder = RatingsEncoder()
+        chunks = [encoder.encode(df) for df in read_csv_chunks(paths, chunksize)]
+        columns = {name: np.concatenate([chunk[name] for chunk in chunks] + [np.empty(0, dtype=dtype)])
+                   for name, dtype in RatingsEncoder.COLUMNS}
+        return cls(columns["user_codes"], columns["recipe_codes"], columns["ratings"], columns["dates"],
+                   columns["username_codes"], *encoder.dictionaries())
+
+    def save(self, path):
+        save_arrays(path, user_codes=self.user_codes, recipe_codes=self.recipe_codes, ratings=self.ratings,
+                    dates=self.dates, username_codes=self.username_codes, user_dict=self.user_dict,
+                    recipe_dict=self.recipe_dict, username_data=self.usernames.data,
+                    username_offsets=self.usernames.offsets)
+
+    @classmethod
+    def load(cls, path, mmap_mode=None):
+        arrays = load_arrays(path, mmap_mode)
+        return cls(arrays["user_codes"], arrays["recipe_codes"], arrays["ratings"], arrays["dates"],
+                   arrays["username_codes"], arrays["user_dict"], arrays["recipe_dict"],
+                   StringDictionary(arrays["username_data"], arrays["username_offsets"]))
+
+    def __len__(self):
+        return len(self.ratings)
+
+    @property
+    def user_ids(self):
+        return self.user_dict[self.user_codes]
+
+    @property
+    def recipe_ids(self):
+        return self.recipe_dict[self.recipe_codes]
+
+    def select(self, rows):
+        '''A store of the given rows (mask or positions), sharing the dictionaries'''
+        return RatingsStore(self.user_codes[rows], self.recipe_codes[rows], self.ratings[rows], self.dates[rows],
+                            self.username_codes[rows], self.user_dict, self.recipe_dict, self.usernames)
+
+    def min_ratings(self, n=3):
+        '''Rows of users with at least n ratings, e.g. users3 for collaborative filtering'''
+        counts = np.bincount(self.user_codes, minlength=len(self.user_dict))
+        return self.select(counts[self.user_codes] >= n)
+
+    def to_frame(self, columns=("user_id", "recipe_id", "rating")):
+        '''DataFrame of the requested columns out of user_id, recipe_id, rating, date and username'''
+        values = {
+            "user_id": lambda: self.user_ids,
+            "recipe_id": lambda: self.recipe_ids,
+            "rating": lambda: self.ratings.astype(np.int64),
+            "date": lambda: np.where(self.dates == NO_DATE, np.datetime64("NaT"),
+                                     self.dates.astype("datetime64[D]")),
+            "username": lambda: self.usernames.decode(self.username_codes),
+        }
+        return pd.DataFrame({column: values[column]() for column in columns}, columns=list(columns))
+
+
+def read_csv_chunks(paths, chunksize=CHUNK_ROWS):
+    '''DataFrames of at most `chunksize` rows, through every CSV in turn'''
+    for path in paths:
+        for df in pd.read_csv(path, chunksize=chunksize):
+            yield df
+
+
+class RatingsEncoder:
+    '''Encodes ratings chunk by chunk into RatingsStore columns.
+
+    Ids and usernames get codes as they are first seen, codes never move, and
+    a row equal to one kept before (in this chunk or an earlier one) in
+    every column (user, recipe, rating, date and username) is dropped, as
+    drop_duplicates on the concatenated CSVs would. Rows of the same (user,
+    recipe) that differ anywhere else are all kept. Memory grows with the
+    unique rows (17 bytes each) and ids, not with the CSVs.
+
+    encoder = RatingsEncoder()
+    for df in read_csv_chunks(["./data/all_users.csv"]):
+        columns = encoder.encode(df)      # user_codes, recipe_codes, ratings, dates, username_codes
+    user_dict, recipe_dict, usernames = encoder.dictionaries()
+    '''
+
+    COLUMNS = (("user_codes", np.int32), ("recipe_codes", np.int32), ("ratings", np.int8),
+               ("dates", np.int32), ("username_codes", np.int32))
+
+    def __init__(self):
+        self.user_mapper = IdMapper(np.empty(0, dtype=np.int64))
+        self.recipe_mapper = IdMapper(np.empty(0, dtype=np.int64))
+        # usernames are strings, a dict is much faster to search than a sorted object array
+        self.username_codes = {}
+        self.usernames = []
+        # kept rows as sorted runs of (pairs, dates_usernames, ratings) sorted by pair,
+        # (user code << 32 | recipe code), merged while a run is no longer than the next
+        self._runs = []
+
+    def encode(self, df):
+        '''{column: array} of the rows of df that are not duplicates'''
+        self.user_mapper, user_codes = self.user_mapper.append(df["user_id"].to_numpy(np.int64))
+        self.recipe_mapper, recipe_codes = self.recipe_mapper.append(df["recipe_id"].to_numpy(np.int64))
+        usernames = df["username"].fillna("").astype(str) if "username" in df else pd.Series([""] * len(df))
+        username_codes = self._username_codes(usernames)
+        ratings = df["rating"].to_numpy(np.int8)
+        dates = encode_dates(df["date"]) if "date" in df else np.full(len(df), NO_DATE, dtype=np.int32)
+
+        keep = self._first_seen(user_codes, recipe_codes, ratings, dates, username_codes)
+        return {"user_codes": user_codes[keep].astype(np.int32), "recipe_codes": recipe_codes[keep].astype(np.int32),
+                "ratings": ratings[keep], "dates": dates[keep], "username_codes": username_codes[keep].astype(np.int32)}
+
+    def _username_codes(self, usernames):
+        inverse, uniques = pd.factorize(usernames)
+        codes = np.empty(len(uniques), dtype=np.int32)
+        for i, username in enumerate(uniques):
+            code = self.username_codes.get(username)
+            if code is None:
+                code = self.username_codes[username] = len(self.usernames)
+                self.usernames.append(username)
+            codes[i] = code
+        return codes[inverse]
+
+    def _first_seen(self, user_codes, recipe_codes, ratings, dates, username_codes):
+        '''Mask of the rows not seen before, which are then remembered'''
+        shift = np.uint64(32)
+        pairs = (user_codes.astype(np.uint64) << shift) | recipe_codes.astype(np.uint64)
+        dates_usernames = (dates.astype(np.uint32).astype(np.uint64) << shift) | username_codes.astype(np.uint64)
+        keep = ~pd.DataFrame({"pair": pairs, "rest": dates_usernames, "rating": ratings}).duplicated().to_numpy()
+        for run in self._runs:
+            self._drop_seen(run, pairs, dates_usernames, ratings, keep)
+
+        order = np.argsort(pairs[keep], kind="stable")
+        self._runs.append((pairs[keep][order], dates_usernames[keep][order], ratings[keep][order]))
+        # each row is merged O(log rows) times, so remembering them all costs O(rows log rows)
+        while len(self._runs) > 1 and len(self._runs[-2][0]) <= 2 * len(self._runs[-1][0]):
+            older, newer = self._runs.pop(-2), self._runs.pop()
+            merged = [np.concatenate((old, new)) for old, new in zip(older, newer)]
+            order = np.argsort(merged[0], kind="stable")
+            self._runs.append(tuple(column[order] for column in merged))
+        return keep
+
+    @staticmethod
+    def _drop_seen(run, pairs, dates_usernames, ratings, keep):
+        '''Clear keep for the rows equal to a row of the run'''
+        run_pairs, run_dates_usernames, run_ratings = run
+        # rows whose (user, recipe) pair is in the run need the rest of the row compared
+        left = np.searchsorted(run_pairs, pairs, side="left")
+        right = np.searchsorted(run_pairs, pairs, side="right")
+        candidates = np.flatnonzero(keep & (right > left))
+        single = candidates[right[candidates] - left[candidates] == 1]
+        same = (run_dates_usernames[left[single]] == dates_usernames[single]) & (run_ratings[left[single]] == ratings[single])
+        keep[single[same]] = False
+        for i in candidates[right[candidates] - left[candidates] > 1]:
+            span = slice(left[i], right[i])
+            if np.any((run_dates_usernames[span] == dates_usernames[i]) & (run_ratings[span] == ratings[i])):
+                keep[i] = False
+
+    def dictionaries(self):
+        '''(user_dict, recipe_dict, usernames) of every code handed out so far'''
+        return self.user_mapper.ids, self.recipe_mapper.ids, StringDictionary.from_strings(self.usernames)
+
+
+def convert_csv(paths, output, chunksize=CHUNK_ROWS):
+    '''Write the RatingsStore of the CSVs to `output` chunk by chunk, see RatingsStore.save.
+
+    Returns (number of ratings, users, recipes).
+    '''
+    encoder = RatingsEncoder()
+    n_ratings = 0
+    with ArrayWriter(output) as writer:
+        for df in read_csv_chunks(paths, chunksize):
+            columns = encoder.encode(df)
+            writer.append(**columns)
+            n_ratings += len(columns["ratings"])
+        user_dict, recipe_dict, usernames = encoder.dictionaries()
+        # columns of CSVs without a single row still need their files
+        writer.append(**{name: np.empty(0, dtype=dtype) for name, dtype in RatingsEncoder.COLUMNS})
+        writer.set(user_dict=user_dict, recipe_dict=recipe_dict,
+                   username_data=usernames.data, username_offsets=usernames.offsets)
+    return n_ratings, len(user_dict), len(recipe_dict)
+
+
+class PositivesIndex:
+    '''Per-user ratings, user -> recipe ids sorted ascending with their ratings.
+
+    Replaces scanning and merging all_users on every known_positives call.
+    A recipe rated twice by the same user keeps its highest rating, so
+    thresholding gives the same set as filtering the raw rows.
+    The raw rows of every user are kept too, in the order of the frame,
+    for rated() which has to list them like filtering all_users did.
+
+    index = PositivesIndex.build(all_users)
+    index.user_ratings(3936048)                     >>> (recipe_ids, ratings)
+    index.positives(3936048, threshold=4)           >>> sorted recipe ids rated >= 4
+    index.positives(8888888, new_user=new_user)     >>> the quiz user, overlaid for this call only
+    index.rated(3936048, threshold=4)               >>> recipe ids of the rows rated >= 4, in row order
+    '''
+
+    def __init__(self, user_ids, indptr, recipe_ids, ratings, row_indptr, row_recipe_ids, row_ratings):
+        self.user_ids = user_ids
+        self.indptr = indptr
+        self.recipe_ids = recipe_ids
+        self.ratings = ratings
+        # every row of every user, grouped by user in the order of the frame
+        self.row_indptr = row_indptr
+        self.row_recipe_ids = row_recipe_ids
+        self.row_ratings = row_ratings
+
+    @classmethod
+    def build(cls, df):
+        '''df needs user_id, recipe_id and rating columns'''
+        users = df["user_id"].to_numpy()
+        recipes = df["recipe_id"].to_numpy()
+        ratings = df["rating"].to_numpy()
+
+        rows = np.argsort(users, kind="stable")
+        row_starts = np.flatnonzero(np.r_[True, users[rows][1:] != users[rows][:-1]]) if len(rows) else rows
+        row_indptr = np.append(row_starts, len(rows))
+        row_recipes, row_ratings = recipes[rows], ratings[rows]
+
+        # by user, then recipe, then highest rating first so the first of each pair wins
+        order = np.lexsort((-ratings, recipes, users))
+        users, recipes, ratings = users[order], recipes[order], ratings[order]
+        first = np.ones(len(users), dtype=bool)
+        first[1:] = (users[1:] != users[:-1]) | (recipes[1:] != recipes[:-1])
+        users, recipes, ratings = users[first], recipes[first], ratings[first]
+
+        user_ids, starts = np.unique(users, return_index=True)
+        indptr = np.append(starts, len(users))
+        return cls(user_ids, indptr, recipes, ratings, row_indptr, row_recipes, row_ratings)
+
+    def __len__(self):
+        return len(self.user_ids)
+
+    def __contains__(self, user_id):
+        i = np.searchsorted(self.user_ids, user_id)
+        return i < len(self.user_ids) and self.user_ids[i] == user_id
+
+    def user_ratings(self, user_id):
+        '''(recipe_ids, ratings) of a user, both empty for an unknown user'''
+        i = np.searchsorted(self.user_ids, user_id)
+        if i == len(self.user_ids) or self.user_ids[i] != user_id:
+            return self.recipe_ids[:0], self.ratings[:0]
+        start, stop = self.indptr[i], self.indptr[i + 1]
+        return self.recipe_ids[start:stop], self.ratings[start:stop]
+
+    def rated(self, user_id, threshold=4):
+        '''Recipe ids of the user's rows rated >= threshold in the order of the frame, a recipe rated twice appears twice'''
+        i = np.searchsorted(self.user_ids, user_id)
+        if i == len(self.user_ids) or self.user_ids[i] != user_id:
+            return self.row_recipe_ids[:0]
+        start, stop = self.row_indptr[i], self.row_indptr[i + 1]
+        return self.row_recipe_ids[start:stop][self.row_ratings[start:stop] >= threshold]
+
+    def positives(self, user_id, threshold=4, new_user=None):
+        '''Sorted recipe ids the user rated >= threshold.
+
+        new_user rows ({'user_id': [...], 'recipe_id': [...], 'rating': [...]})
+        are added on top of the stored ratings for this call only.
+        '''
+        recipe_ids, ratings = self.user_ratings(user_id)
+        positives = recipe_ids[ratings >= threshold]
+        if new_user is not None:
+            extra = np.array([recipe_id for uid, recipe_id, rating
+                              in zip(new_user['user_id'], new_user['recipe_id'], new_user['rating'])
+                              if uid == user_id and rating >= threshold], dtype=positives.dtype)
+            positives = np.union1d(positives, extra)
+        return positives
+
+    def exclude(self, recipe_ids, user_id, threshold=4, new_user=None):
+        '''recipe_ids without the user's positives, order kept, in one set-membership pass'''
+        recipe_ids = np.asarray(recipe_ids)
+        return recipe_ids[~np.isin(recipe_ids, self.positives(user_id, threshold, new_user))]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Convert ratings CSVs to a columnar ratings store")
+    parser.add_argument("csv", nargs="+", help="ratings CSVs, e.g. data/all_users.csv src/data/reviews.csv")
+    parser.add_argument("--output", default="./pickle/ratings")
+    parser.add_argument("--chunksize", type=int, default=CHUNK_ROWS, help="CSV rows read and converted at a time")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    n_ratings, n_users, n_recipes = convert_csv(args.csv, args.output, args.chunksize)
+    print(f'{n_ratings} ratings, {n_users} users, {n_recipes} recipes '
+          f'converted in {time.perf_counter() - start:.2f}s -> {args.output}')
@@ -0,0 +1,121 @@
+"""Scripted check that the collaborative filtering engines give the results of the reference per-user loops.
+
+On a slice of ../data/reviews.csv, for the cosine and Pearson measures with and without the user average on non-rated recipes,
+the similarity weights of a few main users (and of a user without reviews) are measured with the merge loops
+cosine_user_similarity_weight / pearson_user_similarity_weight over every user, as measure_user_similarity first did, and their
+ratings predicted with predict_recipe_rating_by_memory_based. The engines must give the same weights and predictions:
+	- measure_user_similarity, on the overlap kernel (overlap_user_similarity_weights)
+	- the sparse engine (--use-sparse-engine=1)
+	- the shared-memory FilteringPool, through filter_by_memory_based_collaborative_filtering
+	- the batch mode (--batch), whose written top-k must be the top-k of the reference predictions
+
+python check_collaborative_filtering.py
+"""
+import csv
+import io
+import itertools
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+import collaborative_filtering as cf
+
+# Constants
+REVIEWS_CSV_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'reviews.csv')
+SLICE_ROWS = 6000
+MAIN_USERS = 3
+RECIPES_TO_PREDICT = 25
+TOP_K = 10
+RTOL = 1e-9
+ATOL = 1e-12
+
+def write_slice(directory, rows=SLICE_ROWS):
+	"""Write the header and the first rows of the reviews csv to directory, returns the path of the slice."""
+	slice_path = os.path.join(directory, 'reviews.csv')
+	with open(REVIEWS_CSV_PATH, 'r', newline='') as reviews_file, open(slice_path, 'w', newline='') as slice_file:
+		slice_file.writelines(itertools.islice(reviews_file, rows + 1))
+	return slice_path
+
+def reference_weights(main_user_data, store, use_cosine_approach, use_avg_on_non_rated_recipe):
+	"""{user_id: weight} of every other user, with the merge loops over each pair of users."""
+	similarity_weight = cf.cosine_user_similarity_weight if use_cosine_approach else cf.pearson_user_similarity_weight
+	return {user_data.user_id: similarity_weight(main_user_data, user_data, use_avg_on_non_rated_recipe) for user_data in store if user_data.user_id != main_user_data.user_id}
+
+def assert_close(actual, expected, what):
+	actual, expected = np.asarray(actual, dtype=np.float64), np.asarray(expected, dtype=np.float64)
+	error = np.max(np.abs(actual - expected) / np.maximum(np.abs(expected), 1.0)) if len(expected) else 0.0
+	assert np.allclose(actual, expected, rtol=RTOL, atol=ATOL), '{}: off by up to {:.3g}'.format(what, error)
+	return error
+
+def check_batch(store, main_user_ids, recipe_id_to_predict_list, expected_predictions, use_cosine_approach, use_avg_on_non_rated_recipe):
+	"""The batch mode over recipe_id_to_predict_list writes the top-k of the reference predictions of every main user."""
+	output_file = io.StringIO()
+	cf.filter_in_batch_by_collaborative_filtering(main_user_ids, store, output_file, TOP_K, recipe_id_to_predict_list, use_cosine_approach, use_avg_on_non_rated_recipe, block_size=2)
+	output_file.seek(0)
+	written = dict()
+	for row in csv.DictReader(output_file):
+		written.setdefault(row['user_id'], []).append((int(row['recipe_id']), float(row['predicted_rating'])))
+
+	for user_id in main_user_ids:
+		expected = expected_predictions[user_id]
+		top_k = sorted(expected.values(), reverse=True)[:TOP_K]
+		assert [rank_rating for _, rank_rating in written[user_id]] == [float('%.5f' % rating) for rating in top_k], 'batch top-k of user {}'.format(user_id)
+		for recipe_id, rating in written[user_id]:
+			assert abs(rating - expected[recipe_id]) <= 5e-6, 'batch prediction of recipe {} for user {}'.format(recipe_id, user_id)
+
+def check_options(store, rating_matrix, pool, main_user_ids, recipe_id_to_predict_list, use_cosine_approach, use_avg_on_non_rated_recipe):
+	"""Compare every engine with the reference loops for one set of similarity options, returns the largest relative error."""
+	errors = []
+	expected_predictions = dict()
+	for user_id in main_user_ids:
+		main_row = store.row(user_id)
+		main_user_data = cf.UserData(user_id, '', []) if main_row is None else store[main_row]
+		other_user_ids = [other_user_id for other_user_id in store.user_ids if other_user_id != user_id]
+
+		expected_weights = reference_weights(main_user_data, store, use_cosine_approach, use_avg_on_non_rated_recipe)
+		expected = dict(cf.predict_recipe_rating_by_memory_based(main_user_data, store, recipe_id_to_predict_list, expected_weights, None, use_avg_on_non_rated_recipe))
+		expected_predictions[user_id] = expected
+		expected_weights = [expected_weights[other_user_id] for other_user_id in other_user_ids]
+		expected = [expected[recipe_id] for recipe_id in recipe_id_to_predict_list]
+
+		weights, _ = cf.measure_user_similarity(main_user_data, store, use_cosine_approach, use_avg_on_non_rated_recipe)
+		errors.append(assert_close([weights[other_user_id] for other_user_id in other_user_ids], expected_weights, 'overlap kernel weights of user {}'.format(user_id)))
+
+		weights, _ = cf.sparse_user_similarity_weights(main_user_data, rating_matrix, use_cosine_approach, use_avg_on_non_rated_recipe)
+		errors.append(assert_close([weights[rating_matrix.user_index[other_user_id]] for other_user_id in other_user_ids], expected_weights, 'sparse engine weights of user {}'.format(user_id)))
+		prediction_result = cf.filter_by_memory_based_collaborative_filtering(user_id, store, recipe_id_to_predict_list, use_cosine_approach, use_avg_on_non_rated_recipe, use_sparse_engine=True)
+		errors.append(assert_close([rating for _, rating in prediction_result], expected, 'sparse engine predictions of user {}'.format(user_id)))
+
+		prediction_result = cf.filter_by_memory_based_collaborative_filtering(user_id, store, recipe_id_to_predict_list, use_cosine_approach, use_avg_on_non_rated_recipe, pool=pool)
+		errors.append(assert_close([rating for _, rating in prediction_result], expected, 'pool predictions of user {}'.format(user_id)))
+		errors.append(assert_close(pool.weights[[store.row(other_user_id) for other_user_id in other_user_ids]], expected_weights, 'pool weights of user {}'.format(user_id)))
+
+	check_batch(store, main_user_ids, recipe_id_to_predict_list, expected_predictions, use_cosine_approach, use_avg_on_non_rated_recipe)
+	return max(errors)
+
+def main():
+	working_dir = tempfile.mkdtemp()
+	try:
+		store = cf.load_user_data_from_reviews_data(write_slice(working_dir))
+	finally:
+		shutil.rmtree(working_dir, ignore_errors=True)
+
+	# The users with the most reviews in the slice, and a user without any
+	counts = np.diff(store.offsets)
+	main_user_ids = [store.user_ids[row] for row in np.argsort(-counts, kind='stable')[:MAIN_USERS]] + ['0']
+	recipe_id_to_predict_list = cf.determine_recipe_to_predict(main_user_ids[0], store)[:RECIPES_TO_PREDICT]
+	print('Slice of {} reviews: {} users, {} recipes, main users {} with {} reviews'.format(
+		len(store.recipe_ids), len(store), len(np.unique(store.recipe_ids)), main_user_ids, [int(counts[store.row(user_id)]) for user_id in main_user_ids[:-1]]))
+
+	rating_matrix = cf.RatingMatrix(store)
+	with cf.FilteringPool(store, num_of_processes=2) as pool:
+		for use_cosine_approach, use_avg_on_non_rated_recipe in itertools.product([True, False], [True, False]):
+			error = check_options(store, rating_matrix, pool, main_user_ids, recipe_id_to_predict_list, use_cosine_approach, use_avg_on_non_rated_recipe)
+			print('{} similarity, {} on non-rated recipes: largest relative error {:.3g}'.format(
+				'Cosine' if use_cosine_approach else 'Pearson', 'average' if use_avg_on_non_rated_recipe else 'EPS', error))
+	print('ok')
+
+if __name__ == '__main__':
+	main()
@@ -1,62 +1,227 @@
-
+import array
 import csv
 import math
 import multiprocessing
 import sys
 import time
 
+import numpy as np
+from scipy.sparse import csr_matrix
+
+from similarity_cache import SimilarityCache
+
 """ Constants """
 EPS = 1e-5	# Epsilon to use for optimizations (i.e., returning EPS value instead of a flat 0.0 in the calculation)
 
 class Review:
 	"""A data structure for a single user review, consisting two parameters: a recipe ID and its rating (1-5)."""
 
+	__slots__ = ('recipe_id', 'rating')
+
 	def __init__(self, recipe_id, rating):
-		self.recipe_id = recipe_id
+		self.recipe_id = int(recipe_id)
 		self.rating = float(rating)
 
+def _first_reviews(rows, recipe_ids):
+	"""Mask of the first review of every (row, recipe ID) pair, for reviews sorted by row then recipe ID."""
+	first = np.ones(len(recipe_ids), dtype=bool)
+	first[1:] = (rows[1:] != rows[:-1]) | (recipe_ids[1:] != recipe_ids[:-1])
+	return first
+
+class UserStore:
+	"""Reviews data of many users in CSR layout: an offsets array, an int32 recipe ID array and a float32 rating array.
+
+	The reviews of user row i are recipe_ids[offsets[i]:offsets[i+1]], sorted by recipe ID, and the matching ratings.
+	Per-user statistics (count, sum, sum of squares, centred sum of squares, average and norm of the ratings) are computed once,
+	and recipe_users() inverts the store into the users of every recipe. Indexing or iterating the store gives UserData views of its rows.
+
+	user_data_list = load_user_data_from_reviews_data('../data/reviews.csv')
+	user_data_list[user_data_list.row('3419993')].avg_rating
+	"""
+
+	def __init__(self, user_ids, usernames, offsets, recipe_ids, ratings):
+		self.user_ids = user_ids
+		self.usernames = usernames
+		self.offsets = np.asarray(offsets, dtype=np.int64)
+		self.recipe_ids = np.asarray(recipe_ids, dtype=np.int32)
+		self.ratings = np.asarray(ratings, dtype=np.float32)
+		self._user_index = None
+		self._recipe_users = None
+
+		# Statistics over every review, duplicates included, as the merge loops see them.
+		counts = np.diff(self.offsets)
+		rows = np.repeat(np.arange(len(counts)), counts)
+		ratings = self.ratings.astype(np.float64)
+		self.counts = counts.astype(np.float64)
+		self.sums = np.bincount(rows, weights=ratings, minlength=len(counts))
+		self.squares = np.bincount(rows, weights=ratings * ratings, minlength=len(counts))
+		self.avg_ratings = np.full(len(counts), EPS)
+		np.divide(self.sums, counts, out=self.avg_ratings, where=counts > 0)
+		self.centred_squares = np.bincount(rows, weights=(ratings - self.avg_ratings[rows]) ** 2, minlength=len(counts))
+		self.norms = np.sqrt(self.squares)
+
+	@classmethod
+	def from_columns(cls, user_ids, usernames, rows, recipe_ids, ratings):
+		"""Build the store from one (row, recipe ID, rating) entry per review, in any order.
+
+		Args:
+	    	user_ids: List of user IDs, one per row.
+	    	usernames: List of usernames, one per row.
+	    	rows: Row of the user of every review.
+	    	recipe_ids: Recipe ID of every review.
+	    	ratings: Rating of every review.
+
+	    Returns:
+			UserStore object. Reviews of the same recipe by the same user keep their order.
+		"""
+		rows = np.asarray(rows, dtype=np.int64)
+		recipe_ids = np.asarray(recipe_ids, dtype=np.int32)
+		order = np.lexsort((recipe_ids, rows))
+		offsets = np.zeros(len(user_ids) + 1, dtype=np.int64)
+		np.cumsum(np.bincount(rows, minlength=len(user_ids)), out=offsets[1:])
+		return cls(user_ids, usernames, offsets, recipe_ids[order], np.asarray(ratings, dtype=np.float32)[order])
+
+	@classmethod
+	def from_user_data_list(cls, user_data_list):
+		"""Pack a list of UserData objects into one store, a UserStore is returned as it is."""
+		if isinstance(user_data_list, UserStore):
+			return user_data_list
+		offsets = np.zeros(len(user_data_list) + 1, dtype=np.int64)
+		np.cumsum([len(user_data.recipe_ids) for user_data in user_data_list], out=offsets[1:])
+		return cls(
+			[user_data.user_id for user_data in user_data_list],
+			[user_data.username for user_data in user_data_list],
+			offsets,
+			np.concatenate([user_data.recipe_ids for user_data in user_data_list] + [np.empty(0, dtype=np.int32)]),
+			np.concatenate([user_data.ratings for user_data in user_data_list] + [np.empty(0, dtype=np.float32)])
+		)
+
+	def row(self, user_id):
+		"""Row of the given user ID, or None if the user has no reviews in the store."""
+		if self._user_index is None:
+			self._user_index = dict()
+			for row, store_user_id in enumerate(self.user_ids):
+				self._user_index.setdefault(store_user_id, row)
+		return self._user_index.get(user_id)
+
+	def stats(self, rows=slice(None)):
+		"""Tuple of the (count, sum, sum of squares, centred sum of squares, average) of the given rows, every row by default."""
+		return tuple(values[rows] for values in (self.counts, self.sums, self.squares, self.centred_squares, self.avg_ratings))
+
+	def recipe_users(self):
+		"""Inverted index of the store, built on first use: the users of every recipe, with the first rating each of them gave it.
+
+	    Returns:
+			Tuple of (recipe_ids, offsets, rows, ratings): the users who rated recipe_ids[k] (sorted) are rows[offsets[k]:offsets[k+1]] (ascending), with their ratings.
+		"""
+		if self._recipe_users is None:
+			rows = np.repeat(np.arange(len(self)), np.diff(self.offsets))
+			first = _first_reviews(rows, self.recipe_ids)
+			order = np.argsort(self.recipe_ids[first], kind='stable')
+			recipe_ids, counts = np.unique(self.recipe_ids[first], return_counts=True)
+			offsets = np.zeros(len(recipe_ids) + 1, dtype=np.int64)
+			np.cumsum(counts, out=offsets[1:])
+			self._recipe_users = (recipe_ids, offsets, rows[first][order], self.ratings[first][order])
+		return self._recipe_users
+
+	@property
+	def nbytes(self):
+		return sum(values.nbytes for values in (self.offsets, self.recipe_ids, self.ratings, self.counts, self.sums, self.squares, self.centred_squares, self.avg_ratings, self.norms))
+
+	def __len__(self):
+		return len(self.offsets) - 1
+
+	def __getitem__(self, row):
+		if isinstance(row, slice):
+			return [UserData.view(self, i) for i in range(*row.indices(len(self)))]
+		if row < 0:
+			row += len(self)
+		if not 0 <= row < len(self):
+			raise IndexError('UserStore row out of range')
+		return UserData.view(self, row)
+
+	def __iter__(self):
+		for row in range(len(self)):
+			yield UserData.view(self, row)
+
 class UserData:
-	"""A data structure for a single user's data, consisting three parameters: a user ID, a username, and a list of reviews (Review class objects)."""
+	"""A data structure for a single user's data, consisting three parameters: a user ID, a username, and a list of reviews (Review class objects).
 
-	def __init__(self, user_id, username, reviews):
-		self.user_id = user_id
-		self.username = username
-		self.reviews = reviews
-		self.reviews.sort(key=lambda x:int(x.recipe_id))
-		
-		avg_rating = 0.0
-		if len(reviews) > 0:
-			for review in reviews:
-				avg_rating += review.rating
-			avg_rating /= len(reviews)
-		else:
-			avg_rating = EPS
+	The reviews are not kept as objects: a UserData is a view of one row of a UserStore, and UserData(user_id, username, reviews) builds a store of one user.
+	"""
+
+	__slots__ = ('store', 'row')
 
-		self.avg_rating = avg_rating
+	def __init__(self, user_id, username, reviews):
+		reviews = sorted(reviews, key=lambda x:int(x.recipe_id))
+		self.store = UserStore([user_id], [username], [0, len(reviews)], [int(review.recipe_id) for review in reviews], [review.rating for review in reviews])
+		self.row = 0
+
+	@classmethod
+	def view(cls, store, row):
+		user_data = cls.__new__(cls)
+		user_data.store = store
+		user_data.row = row
+		return user_data
+
+	@classmethod
+	def from_arrays(cls, user_id, username, recipe_ids, ratings):
+		"""UserData of one user from recipe IDs already sorted and their ratings."""
+		return cls.view(UserStore([user_id], [username], [0, len(recipe_ids)], recipe_ids, ratings), 0)
+
+	def __reduce__(self):
+		# Pickle this user's reviews only, not the whole store the view belongs to.
+		return (UserData.from_arrays, (self.user_id, self.username, self.recipe_ids.copy(), self.ratings.copy()))
+
+	@property
+	def user_id(self):
+		return self.row if self.store.user_ids is None else self.store.user_ids[self.row]
+
+	@property
+	def username(self):
+		return '' if self.store.usernames is None else self.store.usernames[self.row]
+
+	@property
+	def avg_rating(self):
+		return float(self.store.avg_ratings[self.row])
+
+	@property
+	def norm(self):
+		return float(self.store.norms[self.row])
+
+	@property
+	def stats(self):
+		"""Tuple of the (count, sum, sum of squares, centred sum of squares, average) of the user's ratings."""
+		return tuple(float(value) for value in self.store.stats(self.row))
+
+	@property
+	def recipe_ids(self):
+		return self.store.recipe_ids[self.store.offsets[self.row]:self.store.offsets[self.row+1]]
+
+	@property
+	def ratings(self):
+		return self.store.ratings[self.store.offsets[self.row]:self.store.offsets[self.row+1]]
+
+	@property
+	def reviews(self):
+		return [Review(recipe_id, rating) for recipe_id, rating in zip(self.recipe_ids.tolist(), self.ratings.tolist())]
 
 	def find_rating_by_recipe_id(self, recipe_id, use_avg_on_non_rated_recipe=True):
 		"""Find the rating od the given recipe ID.
 
 		Args:
-	    	recipe_id: String of recipe ID.
+	    	recipe_id: Integer (or string) of recipe ID.
 	    	use_avg_on_non_rated_recipe: If set to True, non-rated item will be assigned with user average rating value. Otherwise, non-rated item is treated as EPS rating. Defaults to True.
 
 	    Returns:
 			Rating of the given recipe ID.
 		"""
+		recipe_ids = self.recipe_ids
+		recipe_id = int(recipe_id)
+		j = int(np.searchsorted(recipe_ids, recipe_id))
 
-		i = 0
-		j = len(self.reviews)
-
-		while i < j:
-			mid = (i + j) >> 1
-			if self.reviews[mid].recipe_id >= recipe_id:
-				j = mid
-			else:
-				i = mid+1
-
-		if j < len(self.reviews) and self.reviews[j].recipe_id == recipe_id:
-			return self.reviews[j].rating
+		if j < len(recipe_ids) and recipe_ids[j] == recipe_id:
+			return float(self.ratings[j])
 		else:
 			return self.avg_rating if use_avg_on_non_rated_recipe else EPS
 
@@ -66,12 +231,20 @@ def print_program_usage_guide():
 	print('usage: "python collaborative_filtering.py <user_id>"')
 	print('for example, try: "python collaborative_filtering.py 3419993"')
 	print('')
+	print('batch usage: "python collaborative_filtering.py --batch <USER_IDS_PATH|all>"')
+	print('for example, try: "python collaborative_filtering.py --batch all -o recommendations.csv"')
+	print('')
 	print('optionals:')
 	print('		[—-use-average-on-non-rated=1/0] ==> When set to 0, disable the usage of user\'s average rating on non-rated recipes. Otherwise, the usage is enabled.')
 	print('		[--use-pearson=1/0] ==> When the value is 1, the similarity measure will use Pearson correlation coefficient method. Otherwise, Cosine method is used.')
+	print('		[--use-sparse-engine=1/0] ==> When the value is 1, similarities and predictions are computed with sparse matrix products in a single process. Otherwise, the per-user loops run in NUM_OF_PROCESSES processes.')
+	print('		[--use-similarity-cache=1/0] ==> When set to 0, similarities are always measured. Otherwise, they are read from and written to the similarity cache, keyed by the content of the reviews file and the similarity options.')
+	print('		[-c CACHE_DIR] ==> Directory of the similarity cache. The default is similarity_cache.')
 	print('		[-i REVIEWS_CSV_PATH] ==> Path to CSV path with required fields of [\'rating\', \'recipe_id\', \'user_id\']. Default path is ../data/all_users.csv.')
 	print('		[-k TOP_K_RESULT] ==> Number of recipes the recommendation will filter for the given user\'s recommendation. The default is 10 results.')
 	print('		[-p NUM_OF_PROCESSES] ==> Number of processes used in the parallel processing of the filtering. The default is 20 processes.')
+	print('		[-o OUTPUT_CSV_PATH] ==> Batch mode only. CSV the top-k results of every user are streamed to (user_id, rank, recipe_id, predicted_rating). The default is recommendations.csv.')
+	print('		[-b BLOCK_SIZE] ==> Batch mode only. Number of users whose similarities and predictions are computed together. The default is 64 users.')
 	print('		[-r RECIPE_ID_1 RECIPE_ID_2 …. RECIPE_ID_N] ==> Recipe candidates for the filtering. The default is all non-rated recipes of the given user are the candidates.')
 	print('')
 
@@ -88,18 +261,27 @@ def config_from_sys_argv():
 		if not len(argv) > 1:
 			raise Exception('Invalid arguments')
 
-		if not argv[1].isdigit():
-			raise Exception('Invalid arguments')
-
 		# Default values
-		config_dict['main-user-id'] = argv[1]
 		config_dict['csv-path'] = '../data/all_users.csv'
 		config_dict['use-pearson'] = False
 		config_dict['use-average-on-non-rated'] = True
 		config_dict['top-k'] = 10
 		config_dict['num-of-processes'] = 20
+		config_dict['use-sparse-engine'] = False
+		config_dict['output-path'] = 'recommendations.csv'
+		config_dict['block-size'] = 64
+		config_dict['use-similarity-cache'] = True
+		config_dict['cache-dir'] = 'similarity_cache'
+
+		if argv[1] == '--batch' and len(argv) > 2:
+			config_dict['batch-users'] = argv[2]
+			i = 3
+		elif argv[1].isdigit():
+			config_dict['main-user-id'] = argv[1]
+			i = 2
+		else:
+			raise Exception('Invalid arguments')
 
-		i = 2
 		while i < len(argv):
 			if argv[i] == '--use-average-on-non-rated=1':
 				config_dict['use-average-on-non-rated'] = True
@@ -113,12 +295,33 @@ def config_from_sys_argv():
 			elif argv[i] == '--use-pearson=0':
 				config_dict['use-pearson'] = False
 				i += 1
+			elif argv[i] == '--use-sparse-engine=1':
+				config_dict['use-sparse-engine'] = True
+				i += 1
+			elif argv[i] == '--use-sparse-engine=0':
+				config_dict['use-sparse-engine'] = False
+				i += 1
+			elif argv[i] == '--use-similarity-cache=1':
+				config_dict['use-similarity-cache'] = True
+				i += 1
+			elif argv[i] == '--use-similarity-cache=0':
+				config_dict['use-similarity-cache'] = False
+				i += 1
+			elif argv[i] == '-c':
+				config_dict['cache-dir'] = argv[i+1]
+				i += 2
 			elif argv[i] == '-i':
 				config_dict['csv-path'] = argv[i+1]
 				i += 2
 			elif argv[i] == '-k':
 				config_dict['top-k'] = int(argv[i+1])
 				i += 2
+			elif argv[i] == '-o':
+				config_dict['output-path'] = argv[i+1]
+				i += 2
+			elif argv[i] == '-b':
+				config_dict['block-size'] = int(argv[i+1])
+				i += 2
 			elif argv[i] == '-p':
 				config_dict['num-of-processes'] = int(argv[i+1])
 				i += 2
@@ -126,7 +329,7 @@ def config_from_sys_argv():
 				i += 1
 				config_dict['recipe-list'] = []
 				while i < len(argv) and argv[i].isdigit():
-					config_dict['recipe-list'].append(argv[i])
+					config_dict['recipe-list'].append(int(argv[i]))
 					i += 1
 			else:
 				raise Exception('Invalid arguments')
@@ -154,33 +357,40 @@ def pearson_user_similarity_weight(user_a, user_b, use_avg_on_non_rated_recipe=F
 	i = 0
 	j = 0
 
-	placeholder_rating_a = user_a.avg_rating if use_avg_on_non_rated_recipe else EPS
-	placeholder_rating_b = user_b.avg_rating if use_avg_on_non_rated_recipe else EPS
+	avg_a = user_a.avg_rating
+	avg_b = user_b.avg_rating
+	recipe_ids_a = user_a.recipe_ids.tolist()
+	recipe_ids_b = user_b.recipe_ids.tolist()
+	ratings_a = user_a.ratings.tolist()
+	ratings_b = user_b.ratings.tolist()
+
+	placeholder_rating_a = avg_a if use_avg_on_non_rated_recipe else EPS
+	placeholder_rating_b = avg_b if use_avg_on_non_rated_recipe else EPS
 
-	len_a = len(user_a.reviews)
-	len_b = len(user_b.reviews)
+	len_a = len(recipe_ids_a)
+	len_b = len(recipe_ids_b)
 
 	while (i < len_a) and j < (len_b):
-		review_a = user_a.reviews[i]
-		review_b = user_b.reviews[j]
+		rating_a = ratings_a[i]
+		rating_b = ratings_b[j]
 
-		if review_a.recipe_id < review_b.recipe_id:
-			diff_a = review_a.rating - user_a.avg_rating
-			diff_b = placeholder_rating_b - user_b.avg_rating
+		if recipe_ids_a[i] < recipe_ids_b[j]:
+			diff_a = rating_a - avg_a
+			diff_b = placeholder_rating_b - avg_b
 			sum_cross += diff_a * diff_b
 			sum_square_a += diff_a * diff_a
 			sum_square_b += diff_b * diff_b
 			i += 1
-		elif review_b.recipe_id < review_a.recipe_id:
-			diff_a = placeholder_rating_a - user_a.avg_rating
-			diff_b = review_b.rating - user_b.avg_rating
+		elif recipe_ids_b[j] < recipe_ids_a[i]:
+			diff_a = placeholder_rating_a - avg_a
+			diff_b = rating_b - avg_b
 			sum_cross += diff_a * diff_b
 			sum_square_a += diff_a * diff_a
 			sum_square_b += diff_b * diff_b
 			j += 1
 		else:
-			diff_a = review_a.rating - user_a.avg_rating
-			diff_b = review_b.rating - user_b.avg_rating
+			diff_a = rating_a - avg_a
+			diff_b = rating_b - avg_b
 			sum_cross += diff_a * diff_b
 			sum_square_a += diff_a * diff_a
 			sum_square_b += diff_b * diff_b
@@ -188,17 +398,18 @@ def pearson_user_similarity_weight(user_a, user_b, use_avg_on_non_rated_recipe=F
 			j += 1
 
 	while i < len_a:
-		review_a = user_a.reviews[i]
-		diff_a = review_a.rating - user_a.avg_rating
-		diff_b = placeholder_rating_b - user_b.avg_rating
+		rating_a = ratings_a[i]
+		diff_a = rating_a - avg_a
+		diff_b = placeholder_rating_b - avg_b
 		sum_cross += diff_a * diff_b
 		sum_square_a += diff_a * diff_a
 		sum_square_b += diff_b * diff_b
 		i += 1
 
 	while j < len_b:
-		diff_a = placeholder_rating_a - user_a.avg_rating
-		diff_b = review_b.rating - user_b.avg_rating
+		rating_b = ratings_b[j]
+		diff_a = placeholder_rating_a - avg_a
+		diff_b = rating_b - avg_b
 		sum_cross += diff_a * diff_b
 		sum_square_a += diff_a * diff_a
 		sum_square_b += diff_b * diff_b
@@ -223,50 +434,106 @@ def cosine_user_similarity_weight(user_a, user_b, use_avg_on_non_rated_recipe=Fa
 	i = 0
 	j = 0
 
-	placeholder_rating_a = user_a.avg_rating if use_avg_on_non_rated_recipe else EPS
-	placeholder_rating_b = user_b.avg_rating if use_avg_on_non_rated_recipe else EPS
+	avg_a = user_a.avg_rating
+	avg_b = user_b.avg_rating
+	recipe_ids_a = user_a.recipe_ids.tolist()
+	recipe_ids_b = user_b.recipe_ids.tolist()
+	ratings_a = user_a.ratings.tolist()
+	ratings_b = user_b.ratings.tolist()
 
-	len_a = len(user_a.reviews)
-	len_b = len(user_b.reviews)
+	placeholder_rating_a = avg_a if use_avg_on_non_rated_recipe else EPS
+	placeholder_rating_b = avg_b if use_avg_on_non_rated_recipe else EPS
+
+	len_a = len(recipe_ids_a)
+	len_b = len(recipe_ids_b)
 
 	while (i < len_a) and (j < len_b):
-		review_a = user_a.reviews[i]
-		review_b = user_b.reviews[j]
+		rating_a = ratings_a[i]
+		rating_b = ratings_b[j]
 
-		if review_a.recipe_id < review_b.recipe_id:
-			sum_cross += review_a.rating * placeholder_rating_b
-			sum_square_a += review_a.rating * review_a.rating
+		if recipe_ids_a[i] < recipe_ids_b[j]:
+			sum_cross += rating_a * placeholder_rating_b
+			sum_square_a += rating_a * rating_a
 			sum_square_b += placeholder_rating_b * placeholder_rating_b
 			i += 1
-		elif review_b.recipe_id < review_a.recipe_id:
-			sum_cross += placeholder_rating_a * review_b.rating
+		elif recipe_ids_b[j] < recipe_ids_a[i]:
+			sum_cross += placeholder_rating_a * rating_b
 			sum_square_a += placeholder_rating_a * placeholder_rating_a
-			sum_square_b += review_b.rating * review_b.rating
+			sum_square_b += rating_b * rating_b
 			j += 1
 		else:
-			sum_cross += review_a.rating * review_b.rating
-			sum_square_a += review_a.rating * review_a.rating
-			sum_square_b += review_b.rating * review_b.rating
+			sum_cross += rating_a * rating_b
+			sum_square_a += rating_a * rating_a
+			sum_square_b += rating_b * rating_b
 			i += 1
 			j += 1
 
 	while i < len_a:
-		review_a = user_a.reviews[i]
-		sum_cross += review_a.rating * placeholder_rating_b
-		sum_square_a += review_a.rating * review_a.rating
+		rating_a = ratings_a[i]
+		sum_cross += rating_a * placeholder_rating_b
+		sum_square_a += rating_a * rating_a
 		sum_square_b += placeholder_rating_b * placeholder_rating_b
 		i += 1
 
 	while j < len_b:
-		review_b = user_b.reviews[j]
-		sum_cross += placeholder_rating_a * review_b.rating
+		rating_b = ratings_b[j]
+		sum_cross += placeholder_rating_a * rating_b
 		sum_square_a += placeholder_rating_a * placeholder_rating_a
-		sum_square_b += review_b.rating * review_b.rating
+		sum_square_b += rating_b * rating_b
 		j += 1
 
 	return (sum_cross + EPS) / math.sqrt((sum_square_a * sum_square_b) + EPS)
 
 
+def overlap_user_similarity_weights(main_user_data, store, rows=None, use_cosine_approach=True, use_avg_on_non_rated_recipe=False):
+	"""Similarity weights of the main user to the given store rows, enumerating co-rated recipes only.
+
+	The placeholder terms of cosine_user_similarity_weight and pearson_user_similarity_weight, for recipes only one of the two users rated,
+	follow from both users' cached statistics (see UserStore.stats). Only the co-rated pairs are walked, through the store's inverted
+	recipe -> users index, so users who share no recipe with the main user are never visited: their weight comes from their statistics alone.
+
+	Args:
+    	main_user_data: User data which the prediction based on.
+    	store: UserStore of the users to compare against.
+    	rows: Numpy array of the store rows to measure, defaults to every row.
+    	use_cosine_approach: If True, the cosine approach will be used in the calculation. Otherwise, Pearson correlation coefficient measures will be used instead.
+    	use_avg_on_non_rated_recipe: If True, optimization by using user's rating average value in calculations for non-rated items will be used. Otherwise, such optimization is not used.
+
+    Returns:
+		Numpy array of the weights of the rows, including the main user's own row if it is one of them.
+	"""
+	rows = np.arange(len(store)) if rows is None else np.asarray(rows, dtype=np.int64)
+	positions_of_rows = np.full(len(store), -1, dtype=np.int64)
+	positions_of_rows[rows] = np.arange(len(rows))
+	index_recipe_ids, index_offsets, index_rows, index_ratings = store.recipe_users()
+
+	recipe_ids_a = main_user_data.recipe_ids
+	first = np.ones(len(recipe_ids_a), dtype=bool)	# The first review of a recipe rated twice, as in the sparse engine
+	first[1:] = recipe_ids_a[1:] != recipe_ids_a[:-1]
+	recipe_ids_a = recipe_ids_a[first]
+	ratings_a = main_user_data.ratings[first].astype(np.float64)
+
+	# Posting lists of the main user's recipes, concatenated
+	positions = np.searchsorted(index_recipe_ids, recipe_ids_a)
+	found = positions < len(index_recipe_ids)
+	found[found] = index_recipe_ids[positions[found]] == recipe_ids_a[found]
+	starts = index_offsets[positions[found]]
+	lengths = index_offsets[positions[found] + 1] - starts
+	postings = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+
+	positions = positions_of_rows[index_rows[postings]]
+	measured = positions >= 0
+	positions = positions[measured]
+	co_ratings_a = np.repeat(ratings_a[found], lengths)[measured]
+	co_ratings_b = index_ratings[postings][measured].astype(np.float64)
+
+	dot = np.bincount(positions, weights=co_ratings_a * co_ratings_b, minlength=len(rows))
+	sum_a_co = np.bincount(positions, weights=co_ratings_a, minlength=len(rows))
+	sum_b_co = np.bincount(positions, weights=co_ratings_b, minlength=len(rows))
+	n_co = np.bincount(positions, minlength=len(rows)).astype(np.float64)
+
+	return _closed_form_similarity_weights(dot, sum_a_co, sum_b_co, n_co, main_user_data.stats, store.stats(rows), use_cosine_approach, use_avg_on_non_rated_recipe)
+
 def measure_user_similarity(main_user_data, user_data_list, use_cosine_approach=True, use_avg_on_non_rated_recipe=False, process_id=None, process_result_dict=None):
 	"""Measure user similarity weight between the main user's and other users' data.
 
@@ -282,15 +549,17 @@ def measure_user_similarity(main_user_data, user_data_list, use_cosine_approach=
 		Tuple containing two values: the dictionary of {user_id: user_similarity_weight} and a float value of total sum of all similarity weights.
 		These results are inserted to the process_result_dict, if provided, with process ID as its key, and the result tuple mentioned above as its value.
 	"""
+	store = UserStore.from_user_data_list(user_data_list)
+	weights = overlap_user_similarity_weights(main_user_data, store, None, use_cosine_approach, use_avg_on_non_rated_recipe)
+
 	user_similarity_weight_cache = dict()
 	similarity_weight_sum = 0.0
 
-	for user_data in user_data_list:
-		if user_data.user_id == main_user_data.user_id:
+	for user_id, user_similarity_weight in zip(store.user_ids, weights.tolist()):
+		if user_id == main_user_data.user_id:
 			continue
 
-		user_similarity_weight = cosine_user_similarity_weight(main_user_data, user_data, use_avg_on_non_rated_recipe) if use_cosine_approach else pearson_user_similarity_weight(main_user_data, user_data, use_avg_on_non_rated_recipe)
-		user_similarity_weight_cache[user_data.user_id] = user_similarity_weight
+		user_similarity_weight_cache[user_id] = user_similarity_weight
 		similarity_weight_sum += user_similarity_weight
 
 	if process_id != None and process_result_dict != None:
@@ -339,129 +608,516 @@ def predict_recipe_rating_by_memory_based(main_user_data, user_data_list, recipe
 
 	return prediction_result.items()
 
-def filter_by_memory_based_collaborative_filtering(user_id, user_data_list, recipe_id_to_predict_list, use_cosine_approach=True, use_avg_on_non_rated_recipe=False, num_of_processes=15):
-	"""A basic collaborative filtering approach with memory based approach, taught in UIUC CS410 Fall 2020.
+class RatingMatrix:
+	"""Sparse users x recipes rating matrix built once from a UserData list, with the per-user statistics the sparse engine needs.
+
+	Row i is user_data_list[i]. Where a user rated a recipe more than once the first review is used, as find_rating_by_recipe_id does,
+	while counts, sums and sums of squares cover every review, as the merge loops do.
+	"""
+
+	def __init__(self, user_data_list):
+		store = UserStore.from_user_data_list(user_data_list)
+		self.user_ids = list(store.user_ids)
+		self.user_index = {user_id: i for i, user_id in enumerate(self.user_ids)}
+
+		self.counts, self.sums, self.squares, self.centred_squares, self.avg_ratings = store.stats()
+		rows = np.repeat(np.arange(len(store)), np.diff(store.offsets))
+
+		# Columns follow the order recipes are first seen in, rows keep the first review of each recipe (reviews are sorted by recipe ID within a row).
+		recipe_ids, first_seen, codes = np.unique(store.recipe_ids, return_index=True, return_inverse=True)
+		column_order = np.argsort(first_seen, kind='stable')
+		columns = np.empty(len(column_order), dtype=np.int64)
+		columns[column_order] = np.arange(len(column_order))
+		self.recipe_index = dict(zip(recipe_ids[column_order].tolist(), range(len(column_order))))
+
+		first = _first_reviews(rows, store.recipe_ids)
+		shape = (len(store), len(self.recipe_index))
+		rows, columns = rows[first], columns[codes][first]
+		self.ratings = csr_matrix((store.ratings[first].astype(np.float64), (rows, columns)), shape=shape)
+		self.rated = csr_matrix((np.ones(len(rows)), (rows, columns)), shape=shape)
+
+	@property
+	def stats(self):
+		"""Tuple of the per-row (count, sum, sum of squares, centred sum of squares, average) arrays."""
+		return (self.counts, self.sums, self.squares, self.centred_squares, self.avg_ratings)
+
+	def user_vectors(self, user_data):
+		"""Dense rating and rated-indicator vectors of a user over the matrix columns.
+
+		Args:
+	    	user_data: UserData object, it does not have to be a row of the matrix.
+
+	    Returns:
+			Tuple of (ratings, rated) numpy arrays, recipes outside the matrix are left out.
+		"""
+		ratings = np.zeros(self.ratings.shape[1])
+		rated = np.zeros(self.ratings.shape[1])
+		for recipe_id, rating in zip(user_data.recipe_ids.tolist(), user_data.ratings.tolist()):
+			col = self.recipe_index.get(recipe_id)
+			if col is not None and rated[col] == 0:
+				ratings[col] = rating
+				rated[col] = 1
+		return ratings, rated
+
+def sparse_user_similarity_weights(main_user_data, rating_matrix, use_cosine_approach=True, use_avg_on_non_rated_recipe=False):
+	"""Similarity weights of the main user to every row of the rating matrix, as sparse matrix-vector products.
+
+	The merge loops of cosine_user_similarity_weight and pearson_user_similarity_weight are written in closed form:
+	co-rated terms come from the products with the main user's vectors, and the placeholder terms for recipes only one
+	of the two users rated follow from each user's count, sum and sum of squares.
 
 	Args:
-    	user_id: String of user ID.
-    	user_data_list: List of UserData objects parsed from the reviews data.
+    	main_user_data: User data which the prediction based on.
+    	rating_matrix: RatingMatrix of the users to compare against.
+    	use_cosine_approach: If True, the cosine approach will be used in the calculation. Otherwise, Pearson correlation coefficient measures will be used instead.
+    	use_avg_on_non_rated_recipe: If True, optimization by using user's rating average value in calculations for non-rated items will be used. Otherwise, such optimization is not used.
+
+    Returns:
+		Tuple of a numpy array of weights, one per matrix row with 0.0 for the main user's own row, and the sum of all weights.
+	"""
+	ratings_a, rated_a = rating_matrix.user_vectors(main_user_data)
+
+	dot = rating_matrix.ratings @ ratings_a	# sum over co-rated recipes of rating_a * rating_b
+	sum_a_co = rating_matrix.rated @ ratings_a	# main user's ratings on the recipes user b rated
+	sum_b_co = rating_matrix.ratings @ rated_a	# user b's ratings on the recipes the main user rated
+	n_co = rating_matrix.rated @ rated_a
+
+	weights = _closed_form_similarity_weights(dot, sum_a_co, sum_b_co, n_co, main_user_data.stats, rating_matrix.stats, use_cosine_approach, use_avg_on_non_rated_recipe)
+	main_row = rating_matrix.user_index.get(main_user_data.user_id)
+	if main_row is not None:
+		weights[main_row] = 0.0
+	return weights, float(weights.sum())
+
+def _closed_form_similarity_weights(dot, sum_a_co, sum_b_co, n_co, stats_a, stats_b, use_cosine_approach, use_avg_on_non_rated_recipe):
+	"""The merge loop sums in closed form. The main user's stats_a (count, sum, sum of squares, centred sum of squares, average)
+	are scalars, or column vectors for a block of main users, stats_b are the same arrays for the other users, and the co-rated sums are shaped to match."""
+	n_a, sum_a, square_a, centred_square_a, avg_a = stats_a
+	n_b, sum_b, square_b, centred_square_b, avg_b = stats_b
+	placeholder_a = avg_a if use_avg_on_non_rated_recipe else EPS
+	placeholder_b = avg_b if use_avg_on_non_rated_recipe else np.full(len(avg_b), EPS)
+
+	if use_cosine_approach:
+		sum_cross = dot + placeholder_b * (sum_a - sum_a_co) + placeholder_a * (sum_b - sum_b_co)
+		sum_square_a = square_a + (n_b - n_co) * placeholder_a * placeholder_a
+		sum_square_b = square_b + (n_a - n_co) * placeholder_b * placeholder_b
+	else:
+		diff_a = placeholder_a - avg_a
+		diff_b = placeholder_b - avg_b
+		sum_cross = (dot - avg_b * sum_a_co - avg_a * sum_b_co + n_co * avg_a * avg_b
+			+ diff_b * ((sum_a - n_a * avg_a) - (sum_a_co - n_co * avg_a))
+			+ diff_a * ((sum_b - n_b * avg_b) - (sum_b_co - n_co * avg_b)))
+		sum_square_a = centred_square_a + (n_b - n_co) * diff_a * diff_a
+		sum_square_b = centred_square_b + (n_a - n_co) * diff_b * diff_b
+
+	return (sum_cross + EPS) / np.sqrt((sum_square_a * sum_square_b) + EPS)
+
+def sparse_predict_recipe_rating(main_user_data, rating_matrix, recipe_id_to_predict_list, weights, similarity_weight_sum, use_avg_on_non_rated_recipe=False):
+	"""Predict recipe ratings for the main user as one weighted sparse matrix product.
+
+	Args:
+    	main_user_data: User data which the prediction based on.
+    	rating_matrix: RatingMatrix the weights were measured against.
+    	recipe_id_to_predict_list: List of recipe IDs that the program will predict the rating value.
+    	weights: Numpy array of similarity weights, one per matrix row, 0.0 for the main user.
+    	similarity_weight_sum: Sum of all measured similarity weight.
+    	use_avg_on_non_rated_recipe: If True, optimization by using user's rating average value in calculations for non-rated items will be used. Otherwise, such optimization is not used.
+
+    Returns:
+		List of rating predictions tuple of <rating_id, predicted_rating>.
+	"""
+	avg_b = rating_matrix.avg_ratings
+	placeholder_b = avg_b if use_avg_on_non_rated_recipe else np.full(len(avg_b), EPS)
+
+	# every user adds weight * (placeholder - avg), the users who rated a recipe swap the placeholder for their rating
+	base = float(weights @ (placeholder_b - avg_b))
+	rated_sum = rating_matrix.ratings.T @ weights - rating_matrix.rated.T @ (weights * placeholder_b)
+
+	prediction_result = []
+	for recipe_id in recipe_id_to_predict_list:
+		col = rating_matrix.recipe_index.get(int(recipe_id))
+		prediction_rating = base + (rated_sum[col] if col is not None else 0.0)
+		prediction_result.append((recipe_id, max((prediction_rating / similarity_weight_sum) + main_user_data.avg_rating, EPS)))
+	return prediction_result
+
+def filter_by_sparse_collaborative_filtering(main_user_data, rating_matrix, recipe_id_to_predict_list, use_cosine_approach=True, use_avg_on_non_rated_recipe=False):
+	"""Same filtering as filter_by_memory_based_collaborative_filtering, computed with sparse matrix products in a single process.
+
+	Args:
+    	main_user_data: User data which the prediction based on.
+    	rating_matrix: RatingMatrix of the users to compare against.
     	recipe_id_to_predict_list: List of recipe IDs that the program will predict the rating value.
     	use_cosine_approach: If True, the cosine approach will be used in the calculation. Otherwise, Pearson correlation coefficient measures will be used instead.
     	use_avg_on_non_rated_recipe: If True, optimization by using user's rating average value in calculations for non-rated items will be used. Otherwise, such optimization is not used.
-    	num_of_processes: Number of processes will be used in the parallel processing of the filtering. Defaults to 20.
 
     Returns:
 		List of rating predictions tuple of <rating_id, predicted_rating>, based on the user data of the given user ID.
 	"""
-	main_user_data = UserData(user_id, '', [])	# Placeholder user data
-	for user_data in user_data_list:
-		if user_data.user_id == user_id:
-			main_user_data = user_data
-			break
-
-	# Measure user similarity.
-	jobs = []
-	user_data_list_len = len(user_data_list)
-	processed_user_id_per_process = int(user_data_list_len / num_of_processes)
-
-	user_similarity_measure_process_result_dict = multiprocessing.Manager().dict()
-	for process_id in range(num_of_processes):
-		start_idx = processed_user_id_per_process * process_id
-		end_idx = user_data_list_len if (process_id == num_of_processes - 1) else processed_user_id_per_process * (process_id + 1)
-		proc = multiprocessing.Process(
-			target=measure_user_similarity,
-			args=(main_user_data, user_data_list[start_idx:end_idx], use_cosine_approach, use_avg_on_non_rated_recipe, process_id, user_similarity_measure_process_result_dict)
-		)
-		jobs.append(proc)
-		proc.start()
+	weights, similarity_weight_sum = sparse_user_similarity_weights(main_user_data, rating_matrix, use_cosine_approach, use_avg_on_non_rated_recipe)
+	return sparse_predict_recipe_rating(main_user_data, rating_matrix, recipe_id_to_predict_list, weights, similarity_weight_sum, use_avg_on_non_rated_recipe)
 
-	for proc in jobs:
-		proc.join()
+def sparse_block_similarity_weights(rating_matrix, rows, use_cosine_approach=True, use_avg_on_non_rated_recipe=False):
+	"""Similarity weights of a block of main users, all rows of the rating matrix, to every row of it.
 
-	user_similarity_weight_cache = dict()
-	similarity_weight_sum = 0.0
-	for partial_user_similarity_weight_cache, partial_similarity_weight_sum in user_similarity_measure_process_result_dict.values():
-		user_similarity_weight_cache.update(partial_user_similarity_weight_cache)
-		similarity_weight_sum += partial_similarity_weight_sum
-
-	# Calculate prediction rating using measured user similarity.
-	jobs = []
-	recipe_id_to_predict_list_len = len(recipe_id_to_predict_list)
-	processed_recipe_id_per_process = int(recipe_id_to_predict_list_len / num_of_processes)
-
-	prediction_result_dict = multiprocessing.Manager().dict()
-	for process_id in range(num_of_processes):
-		start_idx = processed_recipe_id_per_process * process_id
-		end_idx = user_data_list_len if (process_id == num_of_processes - 1) else processed_recipe_id_per_process * (process_id + 1)
-		proc = multiprocessing.Process(
-			target=predict_recipe_rating_by_memory_based,
-			args=(main_user_data, user_data_list, recipe_id_to_predict_list[start_idx:end_idx], user_similarity_weight_cache, similarity_weight_sum, use_avg_on_non_rated_recipe, process_id, prediction_result_dict)
-		)
-		jobs.append(proc)
-		proc.start()
+	Args:
+    	rating_matrix: RatingMatrix of the users.
+    	rows: List of matrix rows of the main users.
+    	use_cosine_approach: If True, the cosine approach will be used in the calculation. Otherwise, Pearson correlation coefficient measures will be used instead.
+    	use_avg_on_non_rated_recipe: If True, optimization by using user's rating average value in calculations for non-rated items will be used. Otherwise, such optimization is not used.
 
-	for proc in jobs:
-		proc.join()
+    Returns:
+		Tuple of a (len(rows), num_of_users) numpy array of weights, 0.0 for every main user's own row, and the sum of each main user's weights.
+	"""
+	rows = np.asarray(rows)
+	block_ratings = rating_matrix.ratings[rows]
+	block_rated = rating_matrix.rated[rows]
 
-	return prediction_result_dict.items()
+	dot = (block_ratings @ rating_matrix.ratings.T).toarray()
+	sum_a_co = (block_ratings @ rating_matrix.rated.T).toarray()
+	sum_b_co = (block_rated @ rating_matrix.ratings.T).toarray()
+	n_co = (block_rated @ rating_matrix.rated.T).toarray()
+	stats_a = tuple(values[rows][:, None] for values in rating_matrix.stats)
 
-def load_user_data_from_reviews_data(reviews_csv_path):
-	"""Load the user data from the available reviews data.
+	weights = _closed_form_similarity_weights(dot, sum_a_co, sum_b_co, n_co, stats_a, rating_matrix.stats, use_cosine_approach, use_avg_on_non_rated_recipe)
+	weights[np.arange(len(rows)), rows] = 0.0
+	return weights, weights.sum(axis=1)
+
+def sparse_block_predict_recipe_rating(rating_matrix, rows, weights, similarity_weight_sums, use_avg_on_non_rated_recipe=False):
+	"""Predicted rating of every recipe column for a block of main users, see sparse_predict_recipe_rating.
+
+	Returns:
+		A (len(rows), num_of_recipes) numpy array of predictions.
+	"""
+	avg_b = rating_matrix.avg_ratings
+	placeholder_b = avg_b if use_avg_on_non_rated_recipe else np.full(len(avg_b), EPS)
+
+	base = weights @ (placeholder_b - avg_b)
+	rated_sum = (rating_matrix.ratings.T @ weights.T).T - (rating_matrix.rated.T @ (weights * placeholder_b).T).T
+	predictions = (base[:, None] + rated_sum) / similarity_weight_sums[:, None] + rating_matrix.avg_ratings[np.asarray(rows)][:, None]
+	return np.maximum(predictions, EPS)
+
+def filter_in_batch_by_collaborative_filtering(user_id_list, user_data_list, output_file, top_k=10, recipe_id_to_predict_list=None, use_cosine_approach=True, use_avg_on_non_rated_recipe=False, block_size=64, rating_matrix=None):
+	"""Top-k recommendations of many users, computed block by block with sparse matrix products and streamed as CSV rows.
+
+	Each user's candidates are the recipes they have not rated (as determine_recipe_to_predict), or recipe_id_to_predict_list when given.
+	Users missing from the reviews data are filtered one by one as a user without reviews.
+
+	Args:
+    	user_id_list: List of user IDs to recommend for.
+    	user_data_list: List of UserData objects parsed from the reviews data.
+    	output_file: Writable text file, receives "user_id,rank,recipe_id,predicted_rating" rows.
+    	top_k: Number of recipes written per user.
+    	recipe_id_to_predict_list: Optional list of recipe ID candidates shared by every user.
+    	use_cosine_approach: If True, the cosine approach will be used in the calculation. Otherwise, Pearson correlation coefficient measures will be used instead.
+    	use_avg_on_non_rated_recipe: If True, optimization by using user's rating average value in calculations for non-rated items will be used. Otherwise, such optimization is not used.
+    	block_size: Number of users computed together, memory grows with block_size x number of users.
+    	rating_matrix: RatingMatrix of user_data_list to reuse, built here if None.
 
     Returns:
-		List of UserData object parsed from the reviews data.
+		Number of users written.
 	"""
-	user_reviews_dict = dict()
-	user_username_dict = dict()
+	rating_matrix = RatingMatrix(user_data_list) if rating_matrix is None else rating_matrix
+	column_recipe_ids = list(rating_matrix.recipe_index)	# recipe_index keys are in column order
+	candidate_columns = None
+	if recipe_id_to_predict_list is not None:
+		candidate_columns = np.array([rating_matrix.recipe_index[int(recipe_id)] for recipe_id in recipe_id_to_predict_list if int(recipe_id) in rating_matrix.recipe_index], dtype=np.int64)
+
+	writer = csv.writer(output_file)
+	writer.writerow(['user_id', 'rank', 'recipe_id', 'predicted_rating'])
+
+	def write_top_k(user_id, columns, predictions):
+		order = np.argsort(-predictions, kind='stable')[:top_k]
+		for rank, k in enumerate(order):
+			writer.writerow([user_id, rank + 1, column_recipe_ids[columns[k]], '%.5f' % predictions[k]])
+
+	known_user_id_list = [user_id for user_id in user_id_list if user_id in rating_matrix.user_index]
+	for user_id in user_id_list:
+		if user_id not in rating_matrix.user_index:
+			recipe_ids = column_recipe_ids if recipe_id_to_predict_list is None else [column_recipe_ids[col] for col in candidate_columns]
+			prediction_result = filter_by_sparse_collaborative_filtering(UserData(user_id, '', []), rating_matrix, recipe_ids, use_cosine_approach, use_avg_on_non_rated_recipe)
+			write_top_k(user_id, [rating_matrix.recipe_index[recipe_id] for recipe_id, _ in prediction_result], np.array([rating for _, rating in prediction_result]))
+
+	for start_idx in range(0, len(known_user_id_list), block_size):
+		block_user_id_list = known_user_id_list[start_idx:start_idx + block_size]
+		rows = [rating_matrix.user_index[user_id] for user_id in block_user_id_list]
+		weights, similarity_weight_sums = sparse_block_similarity_weights(rating_matrix, rows, use_cosine_approach, use_avg_on_non_rated_recipe)
+		predictions = sparse_block_predict_recipe_rating(rating_matrix, rows, weights, similarity_weight_sums, use_avg_on_non_rated_recipe)
+		block_rated = rating_matrix.rated[rows].toarray()
+
+		for k, user_id in enumerate(block_user_id_list):
+			columns = np.flatnonzero(block_rated[k] == 0) if candidate_columns is None else candidate_columns
+			write_top_k(user_id, columns, predictions[k, columns])
+		output_file.flush()
+
+	return len(user_id_list)
+
+_worker_state = dict()	# Per worker process: a UserStore over the shared arrays, and the shared weights array.
+
+def _attach_shared_user_data(offsets, recipe_ids, ratings, weights, num_of_users):
+	"""Pool initializer, wraps the shared buffers in a UserStore without copying them."""
+	offsets = np.frombuffer(offsets, dtype=np.int64)
+	num_of_reviews = int(offsets[-1])
+	_worker_state['store'] = UserStore(None, None, offsets, np.frombuffer(recipe_ids, dtype=np.int32)[:num_of_reviews], np.frombuffer(ratings, dtype=np.float32)[:num_of_reviews])
+	_worker_state['weights'] = np.frombuffer(weights, dtype=np.float64)[:num_of_users]
+
+def _measure_user_similarity_chunk(task):
+	"""Similarity weights of the main user to the shared users in rows [start_idx, end_idx), written into the shared weights array."""
+	main_user_data, main_row, start_idx, end_idx, use_cosine_approach, use_avg_on_non_rated_recipe = task
+	weights = _worker_state['weights']
+
+	weights[start_idx:end_idx] = overlap_user_similarity_weights(main_user_data, _worker_state['store'], np.arange(start_idx, end_idx), use_cosine_approach, use_avg_on_non_rated_recipe)
+	if start_idx <= main_row < end_idx:
+		weights[main_row] = 0.0
+
+def _predict_recipe_rating_chunk(task):
+	"""Rating predictions of one chunk of recipe IDs, using the weights in the shared weights array.
+
+	Each user's ratings of the whole chunk are looked up at once with a binary search over the user's sorted recipe IDs,
+	and added to the predictions user by user, in the same order as predict_recipe_rating_by_memory_based adds them.
+	"""
+	main_user_data, main_row, recipe_id_to_predict_list, similarity_weight_sum, use_avg_on_non_rated_recipe = task
+	store = _worker_state['store']
+	weights = _worker_state['weights'].tolist()
+	offsets = store.offsets.tolist()
+	avg_ratings = store.avg_ratings.tolist()
+	recipe_ids = np.array([int(recipe_id) for recipe_id in recipe_id_to_predict_list], dtype=np.int32)
+
+	prediction_ratings = np.zeros(len(recipe_ids))
+	for row in range(len(store)):
+		if row == main_row:
+			continue
+		avg_rating = avg_ratings[row]
+		user_recipe_ids = store.recipe_ids[offsets[row]:offsets[row+1]]
+		placeholder_rating = avg_rating if use_avg_on_non_rated_recipe else EPS
+		if len(user_recipe_ids) == 0:
+			prediction_ratings += weights[row] * (placeholder_rating - avg_rating)
+			continue
 
-	with open(reviews_csv_path, 'r') as csv_file:
-		reader = csv.DictReader(csv_file)
-		for row in reader:
-			user_id = row['user_id']
-			review = Review(row['recipe_id'], row['rating'])
+		positions = np.minimum(np.searchsorted(user_recipe_ids, recipe_ids), len(user_recipe_ids) - 1)
+		ratings = np.where(user_recipe_ids[positions] == recipe_ids, store.ratings[offsets[row] + positions].astype(np.float64), placeholder_rating)
+		prediction_ratings += weights[row] * (ratings - avg_rating)
+
+	return np.maximum((prediction_ratings / similarity_weight_sum) + main_user_data.avg_rating, EPS)
 
-			user_username_dict[user_id] = row['username']
+class FilteringPool:
+	"""A persistent pool of worker processes sharing one copy of the reviews data.
 
-			if not (user_id in user_reviews_dict):
-				user_reviews_dict[user_id] = []
+	The UserStore arrays (offsets, recipe IDs and ratings) are copied once into shared memory, which the workers attach to when they start.
+	Tasks only carry the main user's data and a chunk range, and results come back as numpy arrays instead of Manager().dict() proxies.
+	The pool can be reused for any number of users, close it (or use it as a context manager) when done.
 
-			user_reviews_dict[user_id].append(review)
+	with FilteringPool(user_data_list, num_of_processes=8) as pool:
+		weights, similarity_weight_sum = pool.measure_user_similarity(main_user_data)
+		predictions = pool.predict_recipe_rating(main_user_data, recipe_id_to_predict_list, similarity_weight_sum)
+	"""
 
-	return [UserData(user_id, user_username_dict[user_id], reviews) for user_id, reviews in user_reviews_dict.items()]
+	def __init__(self, user_data_list, num_of_processes=15, chunks_per_process=4):
+		self.store = UserStore.from_user_data_list(user_data_list)
+		self.num_of_users = len(self.store)
+		self.num_of_chunks = max(1, num_of_processes * chunks_per_process)
 
-def determine_recipe_to_predict(user_id, user_data_list):
-	"""Decide the recipe IDs list that the user with the given user id should try to predict. Basically the objects in the list are the recipes that the user hasn't rated yet.
+		num_of_reviews = len(self.store.recipe_ids)
+		offsets = multiprocessing.RawArray('q', self.num_of_users + 1)
+		recipe_ids = multiprocessing.RawArray('i', max(1, num_of_reviews))
+		ratings = multiprocessing.RawArray('f', max(1, num_of_reviews))
+		weights = multiprocessing.RawArray('d', max(1, self.num_of_users))
+
+		np.frombuffer(offsets, dtype=np.int64)[:] = self.store.offsets
+		np.frombuffer(recipe_ids, dtype=np.int32)[:num_of_reviews] = self.store.recipe_ids
+		np.frombuffer(ratings, dtype=np.float32)[:num_of_reviews] = self.store.ratings
+
+		self.weights = np.frombuffer(weights, dtype=np.float64)[:self.num_of_users]
+		self.pool = multiprocessing.Pool(num_of_processes, initializer=_attach_shared_user_data, initargs=(offsets, recipe_ids, ratings, weights, self.num_of_users))
+
+	def _main_row(self, main_user_data):
+		row = self.store.row(main_user_data.user_id)
+		return -1 if row is None else row
+
+	def _ranges(self, length):
+		step = max(1, -(-length // self.num_of_chunks))
+		return [(start, min(start + step, length)) for start in range(0, length, step)]
+
+	def measure_user_similarity(self, main_user_data, use_cosine_approach=True, use_avg_on_non_rated_recipe=False):
+		"""Measure user similarity weight between the main user's and every shared user's data.
+
+		Args:
+	    	main_user_data: User data which the prediction based on.
+	    	use_cosine_approach: If True, the cosine approach will be used in the calculation. Otherwise, Pearson correlation coefficient measures will be used instead.
+	    	use_avg_on_non_rated_recipe: If True, optimization by using user's rating average value in calculations for non-rated items will be used. Otherwise, such optimization is not used.
+
+	    Returns:
+			Tuple of a copy of the numpy array of weights, one per user with 0.0 for the main user, and the sum of all weights.
+		"""
+		main_row = self._main_row(main_user_data)
+		self.pool.map(_measure_user_similarity_chunk, [(main_user_data, main_row, start_idx, end_idx, use_cosine_approach, use_avg_on_non_rated_recipe) for start_idx, end_idx in self._ranges(self.num_of_users)])
+		return self.weights.copy(), float(self.weights.sum())
+
+	def predict_recipe_rating(self, main_user_data, recipe_id_to_predict_list, similarity_weight_sum, use_avg_on_non_rated_recipe=False):
+		"""Predict recipe rating of the given recipe IDs list, with the weights of the last measure_user_similarity call.
+
+		Returns:
+			Numpy array of predicted ratings, in the order of recipe_id_to_predict_list.
+		"""
+		main_row = self._main_row(main_user_data)
+		chunks = self.pool.map(_predict_recipe_rating_chunk, [(main_user_data, main_row, recipe_id_to_predict_list[start_idx:end_idx], similarity_weight_sum, use_avg_on_non_rated_recipe) for start_idx, end_idx in self._ranges(len(recipe_id_to_predict_list))])
+		return np.concatenate(chunks) if chunks else np.empty(0)
+
+	def set_weights(self, weights):
+		"""Use weights measured elsewhere (e.g. cached ones) for the next predict_recipe_rating calls.
+
+		Returns:
+			The sum of all weights.
+		"""
+		self.weights[:] = weights
+		return float(self.weights.sum())
+
+	def close(self):
+		self.pool.close()
+		self.pool.join()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc_info):
+		self.close()
+
+def filter_by_memory_based_collaborative_filtering(user_id, user_data_list, recipe_id_to_predict_list, use_cosine_approach=True, use_avg_on_non_rated_recipe=False, num_of_processes=15, use_sparse_engine=False, pool=None, similarity_cache=None):
+	"""A basic collaborative filtering approach with memory based approach, taught in UIUC CS410 Fall 2020.
 
 	Args:
     	user_id: String of user ID.
     	user_data_list: List of UserData objects parsed from the reviews data.
+    	recipe_id_to_predict_list: List of recipe IDs that the program will predict the rating value.
+    	use_cosine_approach: If True, the cosine approach will be used in the calculation. Otherwise, Pearson correlation coefficient measures will be used instead.
+    	use_avg_on_non_rated_recipe: If True, optimization by using user's rating average value in calculations for non-rated items will be used. Otherwise, such optimization is not used.
+    	num_of_processes: Number of processes will be used in the parallel processing of the filtering. Defaults to 20.
+    	use_sparse_engine: If True, similarities and predictions are computed with sparse matrix products in this process (see RatingMatrix) instead of the per-user loops.
+    	pool: FilteringPool over the same user_data_list to reuse across calls. If None, one is started for this call and closed afterwards.
+    	similarity_cache: SimilarityCache of the reviews file user_data_list was loaded from. Cached weights are used instead of measuring them, and measured ones are stored.
 
     Returns:
-		List of recipe IDs to predict in the collaborative filtering for the given user ID.
+		List of rating predictions tuple of <rating_id, predicted_rating>, based on the user data of the given user ID.
 	"""
-	recipe_id_to_predict_set = set()
+	store = UserStore.from_user_data_list(user_data_list)
+	main_row = store.row(user_id)
+	main_user_data = UserData(user_id, '', []) if main_row is None else store[main_row]	# Placeholder user data when the user has no reviews
+
+	weights = None
+	if similarity_cache is not None:
+		def recompute(rows):
+			return overlap_user_similarity_weights(main_user_data, store, rows, use_cosine_approach, use_avg_on_non_rated_recipe)
+		weights = similarity_cache.get(user_id, store, use_cosine_approach, use_avg_on_non_rated_recipe, recompute)
+
+	if use_sparse_engine:
+		rating_matrix = RatingMatrix(store)
+		if weights is None:
+			weights, _ = sparse_user_similarity_weights(main_user_data, rating_matrix, use_cosine_approach, use_avg_on_non_rated_recipe)
+			if similarity_cache is not None:
+				similarity_cache.put(user_id, use_cosine_approach, use_avg_on_non_rated_recipe, weights)
+		return sparse_predict_recipe_rating(main_user_data, rating_matrix, recipe_id_to_predict_list, weights, float(weights.sum()), use_avg_on_non_rated_recipe)
+
+	# Measure user similarity, then predict, in one pool of workers attached to the shared reviews data.
+	own_pool = pool is None
+	if own_pool:
+		pool = FilteringPool(store, num_of_processes)
+	try:
+		if weights is None:
+			weights, similarity_weight_sum = pool.measure_user_similarity(main_user_data, use_cosine_approach, use_avg_on_non_rated_recipe)
+			if similarity_cache is not None:
+				similarity_cache.put(user_id, use_cosine_approach, use_avg_on_non_rated_recipe, weights)
+		else:
+			similarity_weight_sum = pool.set_weights(weights)
+		prediction_ratings = pool.predict_recipe_rating(main_user_data, recipe_id_to_predict_list, similarity_weight_sum, use_avg_on_non_rated_recipe)
+	finally:
+		if own_pool:
+			pool.close()
 
-	main_user_data = UserData(user_id, '', [])	# Placeholder user data
+	return list(zip(recipe_id_to_predict_list, prediction_ratings.tolist()))
 
-	for user_data in user_data_list:
-		if user_data.user_id == user_id:
-			main_user_data = user_data
-			continue
+def load_user_data_from_reviews_data(reviews_csv_path):
+	"""Load the user data from the available reviews data.
 
-		for review in user_data.reviews:
-			recipe_id_to_predict_set.add(review.recipe_id)
+    Returns:
+		UserStore of the users parsed from the reviews data, in the order they first appear. It can be used as a list of UserData objects.
+	"""
+	user_rows = dict()
+	usernames = []
+	rows = array.array('q')
+	recipe_ids = array.array('i')
+	ratings = array.array('f')
+
+	# Rows are streamed into typed arrays (4 to 8 bytes per value), only the users are kept as Python objects.
+	with open(reviews_csv_path, 'r', newline='') as csv_file:
+		reader = csv.reader(csv_file)
+		header = next(reader, [])
+		user_id_idx, username_idx, recipe_id_idx, rating_idx = (header.index(column) for column in ('user_id', 'username', 'recipe_id', 'rating'))
+		for row in reader:
+			if not row:
+				continue
+			user_row = user_rows.setdefault(row[user_id_idx], len(user_rows))
+			if user_row == len(usernames):
+				usernames.append(row[username_idx])
+			else:
+				usernames[user_row] = row[username_idx]
+
+			rows.append(user_row)
+			recipe_ids.append(int(row[recipe_id_idx]))
+			ratings.append(float(row[rating_idx]))
+
+	return UserStore.from_columns(list(user_rows), usernames, rows, recipe_ids, ratings)
+
+def determine_recipe_to_predict(user_id, user_data_list):
+	"""Decide the recipe IDs list that the user with the given user id should try to predict. Basically the objects in the list are the recipes that the user hasn't rated yet.
+
+	Args:
+    	user_id: String of user ID.
+    	user_data_list: UserStore, or list of UserData objects, parsed from the reviews data.
+
+    Returns:
+		Sorted list of recipe IDs to predict in the collaborative filtering for the given user ID.
+	"""
+	store = UserStore.from_user_data_list(user_data_list)
+	main_row = store.row(user_id)
+	if main_row is None:
+		return np.unique(store.recipe_ids).tolist()
+
+	start_idx, end_idx = store.offsets[main_row], store.offsets[main_row+1]
+	other_recipe_ids = np.concatenate((store.recipe_ids[:start_idx], store.recipe_ids[end_idx:]))
+	return np.setdiff1d(other_recipe_ids, store.recipe_ids[start_idx:end_idx]).tolist()
 
-	for review in main_user_data.reviews:
-		if review.recipe_id in recipe_id_to_predict_set:
-			recipe_id_to_predict_set.remove(review.recipe_id)
+def load_batch_user_ids(batch_users, user_data_list):
+	"""User IDs for the batch mode: every user for 'all', otherwise one user ID per line of the given file."""
+	if batch_users == 'all':
+		return [user_data.user_id for user_data in user_data_list]
 
-	return list(recipe_id_to_predict_set)		
+	with open(batch_users, 'r') as user_ids_file:
+		return [line.strip() for line in user_ids_file if line.strip()]
 
 if __name__ == '__main__':
 	config_dict = config_from_sys_argv()
-	main_user_id = config_dict['main-user-id']
 	user_data_list = load_user_data_from_reviews_data(config_dict['csv-path'])
 
+	if 'batch-users' in config_dict:
+		user_id_list = load_batch_user_ids(config_dict['batch-users'], user_data_list)
+		start_time = time.perf_counter()
+
+		with open(config_dict['output-path'], 'w', newline='') as output_file:
+			filter_in_batch_by_collaborative_filtering(
+				user_id_list=user_id_list,
+				user_data_list=user_data_list,
+				output_file=output_file,
+				top_k=config_dict['top-k'],
+				recipe_id_to_predict_list=config_dict.get('recipe-list'),
+				use_cosine_approach=(not config_dict['use-pearson']),
+				use_avg_on_non_rated_recipe=config_dict['use-average-on-non-rated'],
+				block_size=config_dict['block-size']
+			)
+
+		finish_time = time.perf_counter()
+		print('Done filtering top-%d recipes for %d users (out of %d users) in %.2lf second(s), written to %s.' % (config_dict['top-k'], len(user_id_list), len(user_data_list), round(finish_time-start_time, 2), config_dict['output-path']))
+		sys.exit()
+
+	main_user_id = config_dict['main-user-id']
+
 	if 'recipe-list' in config_dict:
 		recipe_id_to_predict_list = config_dict['recipe-list']
 	else:
@@ -469,13 +1125,16 @@ if __name__ == '__main__':
 
 	start_time = time.perf_counter()
 
+	similarity_cache = SimilarityCache(config_dict['cache-dir'], config_dict['csv-path']) if config_dict['use-similarity-cache'] else None
 	prediction_result = filter_by_memory_based_collaborative_filtering(
 		user_id=main_user_id,
 		user_data_list=user_data_list, 
 		recipe_id_to_predict_list=recipe_id_to_predict_list,
 		use_cosine_approach=(not config_dict['use-pearson']),
 		use_avg_on_non_rated_recipe=config_dict['use-average-on-non-rated'],
-		num_of_processes=config_dict['num-of-processes']
+		num_of_processes=config_dict['num-of-processes'],
+		use_sparse_engine=config_dict['use-sparse-engine'],
+		similarity_cache=similarity_cache
 	)
 
 	finish_time = time.perf_counter()
@@ -0,0 +1,195 @@
+"""On-disk cache of the user similarity weights measured by collaborative_filtering.py.
+
+An entry holds the weights of one main user to every user of a reviews file, for one choice of similarity options.
+Reviews files are identified by the SHA-1 of their content, so the cache follows the data rather than the path.
+When rows were only appended to a file, the entries of its previous version are updated instead of dropped:
+the weights of the users with new reviews (and of the new users) are recomputed, the others are kept.
+Least recently used entries are evicted once the entries take more than max_bytes on disk.
+
+cache = SimilarityCache('similarity_cache', '../data/reviews.csv')
+weights = cache.get(user_id, store, use_cosine_approach, use_avg_on_non_rated_recipe, recompute)
+cache.put(user_id, use_cosine_approach, use_avg_on_non_rated_recipe, weights)
+"""
+import csv
+import hashlib
+import io
+import json
+import os
+import time
+
+import numpy as np
+
+""" Constants """
+CACHE_VERSION = 1
+INDEX_FILE = 'index.json'
+HASH_BLOCK_SIZE = 1 << 20
+
+class SimilarityCache:
+	"""Similarity weights of a reviews file, stored as one .npy file per entry plus an index.json in cache_dir."""
+
+	def __init__(self, cache_dir, reviews_csv_path, max_bytes=256 * 1024 * 1024):
+		self.cache_dir = cache_dir
+		self.reviews_csv_path = os.path.abspath(reviews_csv_path)
+		self.max_bytes = max_bytes
+		os.makedirs(cache_dir, exist_ok=True)
+
+		self.index = self._load_index()
+		self._appended_user_ids = dict()	# {base dataset size: user IDs with reviews after that size}
+		self.fingerprint, self.prefixes = self._fingerprint()
+
+		stat = os.stat(self.reviews_csv_path)
+		self.index['datasets'].setdefault(self.fingerprint, dict()).update(size=stat.st_size, path=self.reviews_csv_path, mtime_ns=stat.st_mtime_ns)
+
+	def _load_index(self):
+		try:
+			with open(os.path.join(self.cache_dir, INDEX_FILE), 'r') as index_file:
+				index = json.load(index_file)
+			if index.get('version') == CACHE_VERSION:
+				return index
+		except (OSError, ValueError):
+			pass
+		return {'version': CACHE_VERSION, 'datasets': dict(), 'entries': dict()}
+
+	def _save_index(self):
+		path = os.path.join(self.cache_dir, INDEX_FILE)
+		with open(path + '.tmp', 'w') as index_file:
+			json.dump(self.index, index_file)
+		os.replace(path + '.tmp', path)
+
+	def _fingerprint(self):
+		"""SHA-1 of the reviews file, and the known datasets it starts with (its earlier versions).
+
+	    Returns:
+			Tuple of the hex digest and a dictionary of {fingerprint: size} of the datasets that are a strict prefix of the file.
+		"""
+		stat = os.stat(self.reviews_csv_path)
+		datasets = self.index['datasets']
+
+		# Unchanged file since the last run, no need to read it.
+		for fingerprint, dataset in datasets.items():
+			if dataset.get('path') == self.reviews_csv_path and dataset['size'] == stat.st_size and dataset.get('mtime_ns') == stat.st_mtime_ns:
+				return fingerprint, {other: datasets[other]['size'] for other in dataset.get('prefixes', []) if other in datasets}
+
+		# One pass over the file, taking a digest at the size of every smaller known dataset.
+		sizes = sorted({dataset['size'] for dataset in datasets.values() if dataset['size'] < stat.st_size})
+		digests = dict()
+		sha1 = hashlib.sha1()
+		position = 0
+		with open(self.reviews_csv_path, 'rb') as reviews_file:
+			for size in sizes + [stat.st_size]:
+				while position < size:
+					block = reviews_file.read(min(HASH_BLOCK_SIZE, size - position))
+					if not block:
+						break
+					sha1.update(block)
+					position += len(block)
+				digests[size] = sha1.hexdigest()
+
+		prefixes = {fingerprint: dataset['size'] for fingerprint, dataset in datasets.items() if digests.get(dataset['size']) == fingerprint and dataset['size'] < stat.st_size}
+		fingerprint = digests[stat.st_size]
+		datasets.setdefault(fingerprint, dict())['prefixes'] = list(prefixes)
+		return fingerprint, prefixes
+
+	def _entry_key(self, fingerprint, main_user_id, use_cosine_approach, use_avg_on_non_rated_recipe):
+		key = '%s:%s:%d:%d' % (fingerprint, main_user_id, use_cosine_approach, use_avg_on_non_rated_recipe)
+		return hashlib.sha1(key.encode('utf-8')).hexdigest()[:24]
+
+	def _entry_path(self, key):
+		return os.path.join(self.cache_dir, key + '.npy')
+
+	def appended_user_ids(self, base_size):
+		"""User IDs of the reviews after the first base_size bytes of the reviews file."""
+		if base_size not in self._appended_user_ids:
+			with open(self.reviews_csv_path, 'rb') as reviews_file:
+				header = reviews_file.readline()
+				reviews_file.seek(base_size)
+				appended = reviews_file.read()
+			reader = csv.DictReader(io.StringIO((header + appended).decode('utf-8')))
+			self._appended_user_ids[base_size] = {row['user_id'] for row in reader}
+		return self._appended_user_ids[base_size]
+
+	def get(self, main_user_id, store, use_cosine_approach, use_avg_on_non_rated_recipe, recompute):
+		"""Cached similarity weights of the main user, updated if only reviews were appended since they were measured.
+
+		Args:
+	    	main_user_id: String of user ID.
+	    	store: UserStore loaded from the reviews file.
+	    	use_cosine_approach: Similarity option the weights were measured with.
+	    	use_avg_on_non_rated_recipe: Similarity option the weights were measured with.
+	    	recompute: Function of a numpy array of store rows, returning the weights of the main user to these rows.
+
+	    Returns:
+			Numpy array of weights, one per store row, or None when nothing usable is cached.
+		"""
+		entries = self.index['entries']
+		key = self._entry_key(self.fingerprint, main_user_id, use_cosine_approach, use_avg_on_non_rated_recipe)
+		if key in entries:
+			try:
+				weights = np.load(self._entry_path(key))
+			except (OSError, ValueError):
+				self._drop(key)
+				return None
+			entries[key]['last_used'] = time.time()
+			self._save_index()
+			return weights
+
+		# The entry of the longest earlier version of the file, if the main user has no appended reviews.
+		for fingerprint, size in sorted(self.prefixes.items(), key=lambda item: -item[1]):
+			base_key = self._entry_key(fingerprint, main_user_id, use_cosine_approach, use_avg_on_non_rated_recipe)
+			if base_key not in entries:
+				continue
+			appended_user_ids = self.appended_user_ids(size)
+			if main_user_id in appended_user_ids:
+				return None
+			try:
+				base_weights = np.load(self._entry_path(base_key))
+			except (OSError, ValueError):
+				self._drop(base_key)
+				continue
+
+			# Rows of existing users do not move, new users are appended after them.
+			weights = np.zeros(len(store))
+			weights[:len(base_weights)] = base_weights
+			stale_rows = {store.row(user_id) for user_id in appended_user_ids} | set(range(len(base_weights), len(store)))
+			stale_rows = np.array(sorted(row for row in stale_rows if row is not None), dtype=np.int64)
+			if len(stale_rows) > 0:
+				weights[stale_rows] = recompute(stale_rows)
+			self.put(main_user_id, use_cosine_approach, use_avg_on_non_rated_recipe, weights)
+			return weights
+
+		return None
+
+	def put(self, main_user_id, use_cosine_approach, use_avg_on_non_rated_recipe, weights):
+		"""Store the similarity weights of the main user to every store row, then evict down to max_bytes."""
+		key = self._entry_key(self.fingerprint, main_user_id, use_cosine_approach, use_avg_on_non_rated_recipe)
+		np.save(self._entry_path(key), np.asarray(weights, dtype=np.float64))
+		self.index['entries'][key] = {
+			'dataset': self.fingerprint,
+			'user_id': main_user_id,
+			'bytes': os.path.getsize(self._entry_path(key)),
+			'last_used': time.time()
+		}
+		self._evict()
+		self._save_index()
+
+	def _drop(self, key):
+		self.index['entries'].pop(key, None)
+		try:
+			os.remove(self._entry_path(key))
+		except OSError:
+			pass
+
+	def _evict(self):
+		entries = self.index['entries']
+		total_bytes = sum(entry['bytes'] for entry in entries.values())
+		for key in sorted(entries, key=lambda key: entries[key]['last_used']):
+			if total_bytes <= self.max_bytes:
+				break
+			total_bytes -= entries[key]['bytes']
+			self._drop(key)
+
+		# Forget the datasets no entry refers to anymore, except the current one.
+		used = {entry['dataset'] for entry in entries.values()} | {self.fingerprint}
+		for fingerprint in list(self.index['datasets']):
+			if fingerprint not in used:
+				del self.index['datasets'][fingerprint]
@@ -0,0 +1,135 @@
+"""Scripted scrape of the fixture server, checking what recipe_scraper.py writes.
+
+In a temporary working directory, scrapes the root page, the categories and the recipes of fixture_server.py with the http backend
+and the shared work queues, the same steps as running recipe_scraper.py. The recipe csv must hold the 40 fixture recipes with every
+column equal to their row of recipes_example.csv (with the fixture server's root url), and a second run must not scrape any of them again.
+
+The page cache is checked on the recipe pages: a fresh cached page is not requested again, a stale one is revalidated with a 304,
+a stale one whose content was deleted is downloaded again, and --reparse gives back the same recipe csv without any request.
+
+The backend fallback of Fetcher is checked with stand-in backends: one returning the page without its recipe cards (like a page that
+needs JavaScript), before the http backend and before one that fails.
+
+python check_scraper.py
+"""
+import os
+import shutil
+import tempfile
+
+import pandas
+
+import recipe_scraper
+from page_cache import PageCache
+from fixture_server import EXAMPLE_CSV_PATH, FIXTURE_RECIPES, category_markup, fixture_server, serve_in_thread
+
+class EmptyPageFetcher:
+	"""Stand-in backend returning every category page without recipe cards."""
+
+	def get(self, url, wait=0):
+		return category_markup('empty', [])
+
+	def restart(self):
+		pass
+
+	def close(self):
+		pass
+
+class FailingFetcher(EmptyPageFetcher):
+	"""Stand-in backend failing on every page, like a browser that could not start."""
+
+	def get(self, url, wait=0):
+		raise RuntimeError('no browser')
+
+def check_fallback(root_url):
+	category_page_url = root_url + '/recipes/2/bread/?page=1'
+	with recipe_scraper.Fetcher([EmptyPageFetcher(), recipe_scraper.HttpFetcher()]) as fetcher:
+		urls = fetcher.scrape(category_page_url, recipe_scraper.parse_category_page, accept=bool)
+		assert len(urls) == 4, 'an empty page is fetched again with the next backend'
+	with recipe_scraper.Fetcher([EmptyPageFetcher(), FailingFetcher()]) as fetcher:
+		urls = fetcher.scrape(category_page_url, recipe_scraper.parse_category_page, accept=bool)
+		assert urls == [], 'the rejected page is kept when the next backend fails'
+	with recipe_scraper.Fetcher([FailingFetcher(), FailingFetcher()]) as fetcher:
+		try:
+			fetcher.scrape(category_page_url, recipe_scraper.parse_category_page, accept=bool)
+		except RuntimeError:
+			pass
+		else:
+			raise AssertionError('the error of the last backend is raised when no backend got a page')
+
+def check_page_cache(server, recipe_sources, page_cache_dir='cache/pages'):
+	recipe_scraper.configure(page_cache_dir=page_cache_dir)
+	page_cache = PageCache(page_cache_dir)
+	recipe_urls = [recipe_source['url'] for recipe_source in recipe_sources]
+
+	def fetch_all(fetcher):
+		with fetcher:
+			for url in recipe_urls:
+				fetcher.scrape(url, str)
+
+	def responses(fetch):
+		before = dict(server.stats)
+		fetch()
+		return {status: count - before.get(status, 0) for status, count in server.stats.items() if count != before.get(status, 0)}
+
+	assert responses(lambda: fetch_all(recipe_scraper.Fetcher.from_names(['http']))) == {'200': len(recipe_urls)}
+	assert responses(lambda: fetch_all(recipe_scraper.Fetcher.from_names(['http']))) == {}, 'fresh cached pages are not requested'
+	stale_fetcher = lambda: recipe_scraper.Fetcher([recipe_scraper.HttpFetcher(page_cache=page_cache, max_age=0)])
+	assert responses(lambda: fetch_all(stale_fetcher())) == {'304': len(recipe_urls)}, 'stale pages are revalidated'
+
+	os.remove(page_cache._blob_path(page_cache.entry(recipe_urls[0], 'http')['digest']))
+	assert responses(lambda: fetch_all(stale_fetcher())) == {'200': 1, '304': len(recipe_urls) - 1}, 'a stale page without content is downloaded again'
+
+	assert responses(lambda: recipe_scraper.reparse_cached_recipes('../data/reparsed.csv', 2, ['http'])) == {}
+	reparsed = pandas.read_csv('../data/reparsed.csv', dtype=str, keep_default_na=False)
+	pandas.testing.assert_frame_equal(reparsed, pandas.read_csv(recipe_scraper.RESULT_CSV_PATH, dtype=str, keep_default_na=False))
+	print('Page cache:', page_cache.stats())
+
+def scrape(root_url, backends):
+	"""The steps of recipe_scraper.py, returns the recipe sources."""
+	recipe_scraper.coalesce_recipe_scrape_caches()
+	category_root_urls = recipe_scraper.scrape_root_url(root_url + '/recipes/', backends)
+	recipe_scraper.process_category_root_urls_in_parallel(category_root_urls, 2, backends)
+	recipe_sources = recipe_scraper.coalesce_recipe_sources_from_category_cache(category_root_urls)
+	recipe_scraper.process_recipe_sources_in_parallel(recipe_sources, 4, backends)
+	return recipe_sources
+
+def expected_recipes(root_url):
+	expected = pandas.read_csv(EXAMPLE_CSV_PATH, dtype=str, keep_default_na=False).head(FIXTURE_RECIPES)
+	expected['url'] = expected['url'].str.replace('https://www.allrecipes.com', root_url, regex=False)
+	return expected
+
+def main():
+	server = fixture_server()
+	root_url = serve_in_thread(server)
+	recipe_scraper.configure(root_url, '')
+	working_dir = tempfile.mkdtemp()
+	current_dir = os.getcwd()
+	try:
+		# recipe_scraper.py keeps its caches in ./cache and writes ../data/recipes.csv
+		os.makedirs(os.path.join(working_dir, 'run', 'cache'))
+		os.makedirs(os.path.join(working_dir, 'data'))
+		os.chdir(os.path.join(working_dir, 'run'))
+
+		recipe_sources = scrape(root_url, ['http'])
+		print('Scrape:', server.stats)
+		assert server.stats == {'200': 1 + 27 + 10 + FIXTURE_RECIPES}, 'root page, 27 category pages and a blank one per category, recipes'
+		recipes = pandas.read_csv(recipe_scraper.RESULT_CSV_PATH, dtype=str, keep_default_na=False)
+		assert len(recipe_sources) == FIXTURE_RECIPES and len(recipes) == FIXTURE_RECIPES, (len(recipe_sources), len(recipes))
+		pandas.testing.assert_frame_equal(recipes, expected_recipes(root_url))
+
+		requests_len = server.stats['200']
+		scrape(root_url, ['http'])
+		# The categories resume after their last page, which is their blank page past the end.
+		assert server.stats['200'] - requests_len == 10, 'the second run only fetches the blank page past every category'
+		assert len(pandas.read_csv(recipe_scraper.RESULT_CSV_PATH)) == FIXTURE_RECIPES
+
+		check_page_cache(server, recipe_sources)
+		check_fallback(root_url)
+	finally:
+		os.chdir(current_dir)
+		shutil.rmtree(working_dir, ignore_errors=True)
+		server.shutdown()
+	print('ok')
+
+if __name__ == '__main__':
+	main()
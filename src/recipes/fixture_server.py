@@ -0,0 +1,199 @@
+"""Local fixture server of allrecipes.com, serving the saved pages in fixtures/site to recipe_scraper.py.
+
+The url path of a page maps to a file under fixtures/site: /recipes/ is recipes/index.html, page k of a category
+(/recipes/<n>/<name>/?page=k) is recipes/<n>/<name>/page-<k>.html, and a recipe (/recipe/<id>/<slug>/) is recipe/<id>/index.html.
+A category page past the last one has no recipe cards, anything else unknown is a 404. The links of the pages point to
+https://www.allrecipes.com like the site's, the server rewrites them to its own root url. Every response has an ETag and a
+Last-Modified header, and a matching If-None-Match gets 304 Not Modified. /stats returns the number of responses per status as json.
+
+The pages have the markup parse_root_page, parse_category_page and parse_recipe_page read. They are written from the first 40 recipes
+of recipes_example.csv (--write-fixtures), so scraping the server gives back those rows, with the server's root url in the recipe urls.
+
+python fixture_server.py --port 8000
+python recipe_scraper.py --root-url http://127.0.0.1:8000 --backends http --processes 2
+python check_scraper.py
+"""
+import argparse
+import ast
+import collections
+import hashlib
+import html
+import json
+import os
+import threading
+import time
+
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import pandas
+
+# Constants
+SITE_URL = 'https://www.allrecipes.com'
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'site')
+EXAMPLE_CSV_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'recipes_example.csv')
+FIXTURE_RECIPES = 40
+CARDS_PER_PAGE = 4
+
+def recipe_markup(recipe):
+	"""Recipe page of a row of recipes_example.csv, parse_recipe_page gives the row back."""
+	escape = lambda value: html.escape(str(value))
+	ratings = ''.join('<div class="rating"><span class="rating-stars">{}<i class="icon-star"></i></span><span class="rating-count">{}</span></div>'.format(stars, count)
+	                  for stars, count in ast.literal_eval(recipe['rating_detail']).items())
+	info = ''.join('<div class="recipe-meta-item"><div class="recipe-meta-item-header">{}:</div><div class="recipe-meta-item-body">{}</div></div>'.format(escape(header.capitalize()), escape(body))
+	               for header, body in ast.literal_eval(recipe['info']).items())
+
+	ingredients = ''
+	for section in filter(None, recipe['ingredients'].split('\n\n')):
+		legend, items = section.split('\n', 1)
+		ingredients += '<fieldset class="ingredients-section__fieldset"><legend class="ingredients-section__legend">{}</legend><ul>{}</ul></fieldset>'.format(
+			escape(legend), ''.join('<li class="ingredients-item"><label>{}</label></li>'.format(escape(item)) for item in items.split('. ')))
+	directions = ''.join('<fieldset class="instructions-section__fieldset"><ul>{}</ul></fieldset>'.format(
+		''.join('<li class="instructions-section-item"><div class="section-body">{}</div></li>'.format(escape(item)) for item in section.split('. ')))
+		for section in filter(None, recipe['directions'].split('\n\n')))
+
+	notes = '<div class="component recipe-notes"><p>{}</p></div>'.format(escape(recipe['notes'])) if recipe['notes'] else ''
+	nutrition = '<div class="nutrition-section container"><div class="section-body">{}</div></div>'.format(escape(recipe['nutrition'])) if recipe['nutrition'] else ''
+	main_image = '<div class="lazy-image" data-src="{}"></div>'.format(escape(recipe['main_image'])) if recipe['main_image'] else ''
+	ugc_images = ''.join('<a class="ugc-photos-link" href="#photos"><img src="{}" alt=""/></a>'.format(escape(src)) for src in ast.literal_eval(recipe['ugc_image']))
+
+	return """<!DOCTYPE html>
+<html lang="en">
+<head><meta charset="utf-8"><title>{title} | Allrecipes</title></head>
+<body>
+<div class="content-breadcrumbs">{breadcrumbs}</div>
+<main>
+<div class="intro article-info"><h1 class="headline heading-content">{title}</h1></div>
+<div class="recipe-summary"><p>{summary}</p></div>
+<div class="recipe-ratings-list">{ratings}</div>
+<div class="lead-content-wrapper"><div class="image-container">{main_image}</div><div class="ugc-photos">{ugc_images}</div></div>
+<div class="recipe-info-section">{info}</div>
+<section class="ingredients-section">{ingredients}</section>
+<section class="instructions-section">{directions}</section>
+{notes}
+{nutrition}
+</main>
+</body>
+</html>
+""".format(title=escape(recipe['title']), summary=escape(recipe['summary']), ratings=ratings, main_image=main_image, ugc_images=ugc_images, info=info,
+           breadcrumbs=''.join('<a class="breadcrumbs__link" href="#"><span class="breadcrumbs__title">{}</span></a>'.format(escape(title)) for title in ast.literal_eval(recipe['breadcrumb'])),
+           ingredients=ingredients, directions=directions, notes=notes, nutrition=nutrition)
+
+def category_markup(category_name, recipes):
+	"""Page of a category with a card per recipe, an empty list of recipes for a page past the last one."""
+	cards = ''.join('<div class="card__detailsContainer"><a class="card__titleLink" href="{}/recipe/{}/{}/?internalSource=hub%20recipe">{}</a></div>'.format(
+		SITE_URL, recipe['id'], recipe['url'].rstrip('/').rsplit('/', 1)[1], html.escape(recipe['title'])) for recipe in recipes)
+	return '<!DOCTYPE html>\n<html lang="en">\n<head><meta charset="utf-8"><title>{} Recipes</title></head>\n<body><section class="category-page-list">{}</section></body>\n</html>\n'.format(
+		html.escape(category_name), cards)
+
+def write_fixtures(example_csv_path=EXAMPLE_CSV_PATH, directory=FIXTURES_DIR, recipes_len=FIXTURE_RECIPES, cards_per_page=CARDS_PER_PAGE):
+	"""Write the root, category and recipe pages of the first recipes of the example csv.
+
+	Args:
+		example_csv_path: Recipe csv written by recipe_scraper.py. Defaults to recipes_example.csv.
+		directory: Directory of the pages. Defaults to FIXTURES_DIR.
+		recipes_len: Number of recipes to write pages of.
+		cards_per_page: Number of recipe cards on a category page.
+	"""
+	recipes = pandas.read_csv(example_csv_path, keep_default_na=False).head(recipes_len).to_dict('records')
+	category_recipes = collections.defaultdict(list)
+	for recipe in recipes:
+		for category_name in ast.literal_eval(recipe['category']):
+			category_recipes[category_name].append(recipe)
+
+	def write(relative_path, text):
+		page_path = os.path.join(directory, relative_path)
+		os.makedirs(os.path.dirname(page_path), exist_ok=True)
+		with open(page_path, 'w', encoding='utf-8') as page_file:
+			page_file.write(text)
+
+	category_names = sorted(category_recipes)
+	write('recipes/index.html', '<!DOCTYPE html>\n<html lang="en">\n<head><meta charset="utf-8"><title>Recipes</title></head>\n<body><nav class="carouselNav">{}</nav></body>\n</html>\n'.format(
+		''.join('<a class="carouselNav__link recipeCarousel__link" href="{}/recipes/{}/{}/">{}</a>'.format(SITE_URL, i, category_name, category_name) for i, category_name in enumerate(category_names, start=1))))
+	for i, category_name in enumerate(category_names, start=1):
+		category_pages = range(0, len(category_recipes[category_name]), cards_per_page)
+		for page_index, start in enumerate(category_pages, start=1):
+			write('recipes/{}/{}/page-{}.html'.format(i, category_name, page_index), category_markup(category_name, category_recipes[category_name][start:start+cards_per_page]))
+		print('Category', category_name, ':', len(category_recipes[category_name]), 'recipes in', len(category_pages), 'pages')
+	for recipe in recipes:
+		write('recipe/{}/index.html'.format(recipe['id']), recipe_markup(recipe))
+	print('Wrote', len(recipes), 'recipes to', directory)
+
+class FixtureHandler(BaseHTTPRequestHandler):
+	def do_GET(self):
+		server = self.server
+		url = urlsplit(self.path)
+		if url.path == '/stats':
+			return self.reply(200, json.dumps(server.stats).encode('utf-8'), count=False)
+		if server.delay:
+			time.sleep(server.delay)
+
+		parts = [part for part in url.path.split('/') if part]
+		page_path = None
+		if parts == ['recipes']:
+			page_path = os.path.join(server.directory, 'recipes', 'index.html')
+		elif len(parts) == 3 and parts[0] == 'recipes' and os.path.isdir(os.path.join(server.directory, *parts)):
+			page = parse_qs(url.query).get('page', ['1'])[0]
+			page_path = os.path.join(server.directory, *parts, 'page-{}.html'.format(page))
+			if not os.path.exists(page_path):
+				return self.reply(200, category_markup(parts[2], []).encode('utf-8'))
+		elif len(parts) >= 2 and parts[0] == 'recipe':
+			page_path = os.path.join(server.directory, 'recipe', parts[1], 'index.html')
+
+		if page_path is None or not os.path.exists(page_path):
+			return self.reply(404, b'')
+		with open(page_path, 'rb') as page_file:
+			self.reply(200, page_file.read(), last_modified=os.path.getmtime(page_path))
+
+	def reply(self, status, body, last_modified=None, count=True):
+		body = body.replace(SITE_URL.encode('utf-8'), self.server.root_url.encode('utf-8'))
+		etag = '"{}"'.format(hashlib.sha1(body).hexdigest())
+		if status == 200 and count and self.headers.get('If-None-Match') == etag:
+			status, body = 304, b''
+		if count:
+			with self.server.lock:
+				self.server.stats[str(status)] = self.server.stats.get(str(status), 0) + 1
+
+		self.send_response(status)
+		self.send_header('Content-Type', 'text/html; charset=utf-8' if count else 'application/json')
+		self.send_header('Content-Length', str(len(body)))
+		if count:
+			self.send_header('ETag', etag)
+			self.send_header('Last-Modified', formatdate(last_modified or 0, usegmt=True))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, *args):
+		pass
+
+def fixture_server(port=0, directory=FIXTURES_DIR, delay=0.0):
+	"""Fixture server on localhost, port 0 picks a free port (server.server_address[1]). server.stats counts the responses per status."""
+	server = ThreadingHTTPServer(('127.0.0.1', port), FixtureHandler)
+	server.daemon_threads = True
+	server.root_url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+	server.directory = directory
+	server.delay = delay
+	server.stats = dict()
+	server.lock = threading.Lock()
+	return server
+
+def serve_in_thread(server):
+	"""Start the server in a daemon thread, returns its root url."""
+	threading.Thread(target=server.serve_forever, daemon=True).start()
+	return server.root_url
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Serve the saved pages of fixtures/site like allrecipes.com')
+	parser.add_argument('--port', type=int, default=8000)
+	parser.add_argument('--pages', default=FIXTURES_DIR, help='directory of the saved pages')
+	parser.add_argument('--delay', type=float, default=0.0, help='seconds added to every response')
+	parser.add_argument('--write-fixtures', action='store_true', help='write the pages from recipes_example.csv instead of serving')
+	args = parser.parse_args()
+
+	if args.write_fixtures:
+		write_fixtures(directory=args.pages)
+	else:
+		server = fixture_server(args.port, args.pages, args.delay)
+		print('Serving', args.pages, 'on', server.root_url)
+		server.serve_forever()
@@ -0,0 +1,119 @@
+"""Content-addressed on-disk cache of the raw pages fetched by recipe_scraper.py.
+
+Every distinct page content is stored once, gzip-compressed, at pages/<sha256[:2]>/<sha256>.gz.
+index.sqlite maps every (url, backend) to the content it last gave, with the fetch time and the HTTP validators
+(ETag, Last-Modified) needed to revalidate it with a conditional request. The index is SQLite so that the scraping processes can share one cache.
+
+cache = PageCache('cache/pages')
+cache.put(url, 'http', response.content, encoding='utf-8', etag=response.headers.get('ETag'))
+html = cache.read(cache.entry(url, 'http'))
+"""
+import gzip
+import hashlib
+import os
+import sqlite3
+import time
+
+# Constants
+INDEX_FILE = 'index.sqlite'
+COMPRESS_LEVEL = 6
+
+class PageCache:
+	"""Raw pages keyed by url and fetch backend, see the module docstring."""
+
+	def __init__(self, cache_dir):
+		self.cache_dir = cache_dir
+		os.makedirs(os.path.join(cache_dir, 'pages'), exist_ok=True)
+		self._connection = None
+		self._pid = None
+
+	def __getstate__(self):
+		return {'cache_dir': self.cache_dir}
+
+	def __setstate__(self, state):
+		self.__init__(state['cache_dir'])
+
+	def _db(self):
+		# A connection must not be used across a fork, every process opens its own.
+		if self._connection is None or self._pid != os.getpid():
+			self._connection = sqlite3.connect(os.path.join(self.cache_dir, INDEX_FILE), timeout=60)
+			self._connection.row_factory = sqlite3.Row
+			self._connection.execute('CREATE TABLE IF NOT EXISTS pages (url TEXT, backend TEXT, digest TEXT, size INTEGER, fetched_at REAL, '
+			                         'etag TEXT, last_modified TEXT, encoding TEXT, PRIMARY KEY (url, backend))')
+			self._connection.commit()
+			self._pid = os.getpid()
+		return self._connection
+
+	def _blob_path(self, digest):
+		return os.path.join(self.cache_dir, 'pages', digest[:2], digest + '.gz')
+
+	def entry(self, url, backend):
+		"""Index entry of the page, or None if the backend never fetched it.
+
+		Args:
+			url: Url of the page.
+			backend: Name of the fetch backend (e.g., 'http').
+
+		Returns:
+			Dictionary of url, backend, digest, size, fetched_at, etag, last_modified and encoding.
+		"""
+		row = self._db().execute('SELECT * FROM pages WHERE url = ? AND backend = ?', (url, backend)).fetchone()
+		return dict(row) if row is not None else None
+
+	def has_content(self, entry):
+		"""Whether the content of an index entry is still stored, e.g. its blob was not deleted by hand."""
+		return os.path.exists(self._blob_path(entry['digest']))
+
+	def read(self, entry):
+		"""Content of the page of an index entry: text when its encoding is known, bytes otherwise."""
+		with gzip.open(self._blob_path(entry['digest']), 'rb') as blob:
+			content = blob.read()
+		return content.decode(entry['encoding'], errors='replace') if entry['encoding'] else content
+
+	def put(self, url, backend, content, encoding=None, etag=None, last_modified=None):
+		"""Store the content fetched now from the url, a content already stored is not written again.
+
+		Args:
+			url: Url of the page.
+			backend: Name of the fetch backend the content comes from.
+			content: Bytes (or text) of the page.
+			encoding: Encoding of the bytes, if known. Text is stored as UTF-8.
+			etag: ETag header of the response, if any.
+			last_modified: Last-Modified header of the response, if any.
+
+		Returns:
+			SHA-256 hex digest of the content.
+		"""
+		if isinstance(content, str):
+			encoding = encoding or 'utf-8'
+			content = content.encode(encoding)
+
+		digest = hashlib.sha256(content).hexdigest()
+		blob_path = self._blob_path(digest)
+		if not os.path.exists(blob_path):
+			os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+			tmp_path = '{}.{}.tmp'.format(blob_path, os.getpid())
+			with gzip.open(tmp_path, 'wb', compresslevel=COMPRESS_LEVEL) as blob:
+				blob.write(content)
+			os.replace(tmp_path, blob_path)
+
+		with self._db() as db:
+			db.execute('INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+			           (url, backend, digest, len(content), time.time(), etag, last_modified, encoding))
+		return digest
+
+	def touch(self, url, backend):
+		"""Record that the cached page was revalidated now (the server answered 304 Not Modified)."""
+		with self._db() as db:
+			db.execute('UPDATE pages SET fetched_at = ? WHERE url = ? AND backend = ?', (time.time(), url, backend))
+
+	def urls(self):
+		"""Sorted list of the urls with at least one cached page."""
+		return [row[0] for row in self._db().execute('SELECT DISTINCT url FROM pages ORDER BY url')]
+
+	def stats(self):
+		"""Number of pages and distinct contents, and their raw and compressed sizes in bytes."""
+		pages = self._db().execute('SELECT COUNT(*) FROM pages').fetchone()[0]
+		contents = self._db().execute('SELECT digest, MAX(size) FROM pages GROUP BY digest').fetchall()
+		compressed_bytes = sum(os.path.getsize(self._blob_path(digest)) for digest, _ in contents if os.path.exists(self._blob_path(digest)))
+		return {'pages': pages, 'contents': len(contents), 'raw_bytes': sum(size for _, size in contents), 'compressed_bytes': compressed_bytes}
@@ -1,18 +1,22 @@
 
+import argparse
 import csv
+import functools
 import json
 import multiprocessing
 import pandas
 import re
+import requests
 import sys
 import time
 import unicodedata
 import urllib
 
 from bs4 import BeautifulSoup
-from selenium import webdriver 
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.common.action_chains import ActionChains
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from page_cache import PageCache
 
 import os.path
 from os import path
@@ -24,6 +28,12 @@ RECIPE_CSV_FIELDNAMES = ['id', 'url', 'title', 'summary', 'category', 'breadcrum
 
 RESULT_CSV_PATH = '../data/recipes.csv'
 
+ROOT_URL = 'https://www.allrecipes.com'		# Overridden by configure(), e.g. to scrape a local fixture server.
+FETCH_BACKENDS = ['http', 'selenium']		# Tried in order for every page, see Fetcher.
+PAGE_CACHE_DIR = None		# Raw pages are kept in this PageCache directory when set, see configure().
+PAGE_MAX_AGE = 7 * 24 * 3600		# Seconds a cached page is used without asking the server whether it changed.
+USER_AGENT = 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_14_0) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/74.0.3729.131 Safari/537.36'
+
 
 def is_valid_recipe_url(url):
 	"""Check whether the given url is a valid recipe url.
@@ -34,7 +44,7 @@ def is_valid_recipe_url(url):
 	Returns:
 		True if the given url is a valid recipe url.
 	"""
-	return url.startswith('https://www.allrecipes.com/recipe')
+	return url.startswith(ROOT_URL + '/recipe/')
 
 def clean_url(url):
 	"""Clean the given url into the expected format of a recipe url. Invalid url will be marked as None.
@@ -48,12 +58,12 @@ def clean_url(url):
 	"""
 	url = url.split('?')[0]
 
-	root_url = 'https://www.allrecipes.com'
+	root_url = ROOT_URL
 
 	if not url.startswith(root_url):
 		url = root_url + url
 
-	if not is_valid_recipe_url:
+	if not is_valid_recipe_url(url):
 		return None
 
 	return url
@@ -131,50 +141,328 @@ def clean_text(text):
 	text = text.strip()		# Clean unnecessary leading or trailing whitespaces.
 	return text
 
-def scrape_root_url(root_url):
+def configure(root_url=None, page_cache_dir=None):
+	"""Set the site to scrape, the recipe urls are expected under it, and the directory of the raw page cache.
+
+	Args:
+		root_url: Root url of the site (e.g., 'http://localhost:8000' for a local fixture server). Defaults to keeping the current one.
+		page_cache_dir: Directory of the PageCache the fetch backends keep the raw pages in, '' to stop caching. Defaults to keeping the current one.
+	"""
+	global ROOT_URL, PAGE_CACHE_DIR
+	if root_url:
+		ROOT_URL = root_url.rstrip('/')
+	if page_cache_dir is not None:
+		PAGE_CACHE_DIR = page_cache_dir or None
+
+def is_fresh(entry, max_age):
+	"""Whether a page cache entry is recent enough to be used without a request, max_age None meaning forever."""
+	return entry is not None and (max_age is None or time.time() - entry['fetched_at'] < max_age)
+
+class HttpFetcher:
+	"""Fetch backend for pages that do not need JavaScript: plain GET requests through a pooled keep-alive session.
+
+	With a page cache, a cached page younger than max_age is returned without a request. An older one is revalidated
+	with a conditional request (If-None-Match / If-Modified-Since) and only downloaded again if it changed.
+	"""
+
+	name = 'http'
+
+	def __init__(self, pool_size=4, timeout=30, retries=3, page_cache=None, max_age=PAGE_MAX_AGE):
+		adapter = HTTPAdapter(pool_maxsize=pool_size, max_retries=Retry(total=retries, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504]))
+		self.session = requests.Session()
+		self.session.headers['User-Agent'] = USER_AGENT
+		self.session.mount('http://', adapter)
+		self.session.mount('https://', adapter)
+		self.timeout = timeout
+		self.page_cache = page_cache
+		self.max_age = max_age
+
+	def get(self, url, wait=0):
+		"""Content of the page at the given url, there is nothing to render so wait is ignored."""
+		entry = self.page_cache.entry(url, self.name) if self.page_cache is not None else None
+		if entry is not None and not self.page_cache.has_content(entry):
+			# The cached content is gone, download the page again without a conditional request a 304 could not be served from.
+			entry = None
+		headers = dict()
+		if entry is not None:
+			if is_fresh(entry, self.max_age):
+				return self.page_cache.read(entry)
+			if entry['etag']:
+				headers['If-None-Match'] = entry['etag']
+			if entry['last_modified']:
+				headers['If-Modified-Since'] = entry['last_modified']
+
+		response = self.session.get(url, headers=headers, timeout=self.timeout)
+		if response.status_code == 304 and entry is not None:
+			self.page_cache.touch(url, self.name)
+			return self.page_cache.read(entry)
+		response.raise_for_status()
+
+		# Without a charset in the headers, BeautifulSoup detects the encoding from the bytes.
+		encoding = response.encoding if 'charset' in response.headers.get('Content-Type', '').lower() else None
+		if self.page_cache is not None:
+			self.page_cache.put(url, self.name, response.content, encoding, response.headers.get('ETag'), response.headers.get('Last-Modified'))
+		return response.text if encoding else response.content
+
+	def restart(self):
+		# The session reconnects by itself.
+		pass
+
+	def close(self):
+		self.session.close()
+
+class SeleniumFetcher:
+	"""Fetch backend for pages that need JavaScript: a headless Chrome, only started when a page is first fetched with it.
+
+	With a page cache, the rendered pages are cached, and a cached page younger than max_age is returned without the browser.
+	"""
+
+	name = 'selenium'
+
+	def __init__(self, chromedriver_path='./chromedriver', page_cache=None, max_age=PAGE_MAX_AGE):
+		self.chromedriver_path = chromedriver_path
+		self.driver = None
+		self.page_cache = page_cache
+		self.max_age = max_age
+
+	def get(self, url, wait=0):
+		"""Body of the page at the given url, once the page had wait seconds to render."""
+		entry = self.page_cache.entry(url, self.name) if self.page_cache is not None else None
+		if is_fresh(entry, self.max_age) and self.page_cache.has_content(entry):
+			return self.page_cache.read(entry)
+
+		if self.driver is None:
+			# Imported here so that scraping without the browser does not need Selenium installed.
+			from selenium import webdriver
+			from selenium.webdriver.chrome.options import Options
+			options = Options()
+			options.headless = True
+			self.driver = webdriver.Chrome(self.chromedriver_path,options=options)
+
+		self.driver.get(url)
+		time.sleep(wait)
+		html = self.driver.execute_script('return document.body.innerHTML')
+		if self.page_cache is not None:
+			self.page_cache.put(url, self.name, html)
+		return html
+
+	def restart(self):
+		"""Quit the browser, sometimes the driver experiences a connection failure. A new one is started for the next page."""
+		self.close()
+		time.sleep(1)
+
+	def close(self):
+		if self.driver is not None:
+			try:
+				self.driver.close()
+				self.driver.quit()
+			finally:
+				self.driver = None
+
+class CachedPageFetcher:
+	"""Fetch backend reading the pages another backend left in a page cache, without any request. Used to parse the cached pages again."""
+
+	def __init__(self, page_cache, name):
+		self.page_cache = page_cache
+		self.name = name
+
+	def get(self, url, wait=0):
+		entry = self.page_cache.entry(url, self.name)
+		if entry is None:
+			raise KeyError('{} page not cached: {}'.format(self.name, url))
+		return self.page_cache.read(entry)
+
+	def restart(self):
+		pass
+
+	def close(self):
+		pass
+
+class Fetcher:
+	"""Pluggable fetch backends, tried in order for every page.
+
+	When a backend fails to fetch the page, when the page fails to parse, or when accept() rejects the parsed page,
+	the page is fetched again with the next backend. The last backend has the final word: its result is returned
+	even if accept() rejects it, and its errors are raised, unless an earlier backend's rejected result can be returned instead.
+
+	with Fetcher.from_names(['http', 'selenium']) as fetcher:
+		category_root_urls = fetcher.scrape('https://www.allrecipes.com/recipes/', parse_root_page, accept=bool)
+	"""
+
+	BACKENDS = {'http': HttpFetcher, 'selenium': SeleniumFetcher}
+
+	def __init__(self, backends):
+		self.backends = backends
+
+	@classmethod
+	def from_names(cls, names=FETCH_BACKENDS, page_cache_dir=None):
+		"""Fetcher of the backends with the given names, they share the page cache in page_cache_dir (defaults to PAGE_CACHE_DIR) if any."""
+		page_cache_dir = page_cache_dir or PAGE_CACHE_DIR
+		page_cache = PageCache(page_cache_dir) if page_cache_dir else None
+		return cls([cls.BACKENDS[name](page_cache=page_cache) for name in names])
+
+	@classmethod
+	def from_page_cache(cls, names=FETCH_BACKENDS, page_cache_dir=None):
+		"""Fetcher of the pages the backends with the given names left in the page cache, without any request."""
+		page_cache = PageCache(page_cache_dir or PAGE_CACHE_DIR)
+		return cls([CachedPageFetcher(page_cache, name) for name in names])
+
+	def scrape(self, url, parse, accept=None, wait=0):
+		"""Fetch and parse the page at the given url.
+
+		Args:
+			url: Url of the page.
+			parse: Function of the page content returning the parsed page.
+			accept: Function of the parsed page, returning False when the next backend should try. Defaults to accepting every page that parses.
+			wait: Seconds a rendering backend waits for the page to render.
+
+		Returns:
+			The parsed page, or the last one accept() rejected when the backends after it failed.
+		"""
+		rejected = None		# (result,) of the last backend whose page accept() rejected.
+		for i, backend in enumerate(self.backends):
+			is_last_backend = i == len(self.backends) - 1
+			try:
+				result = parse(backend.get(url, wait))
+			except Exception as exception:
+				if not is_last_backend:
+					print('Fetching', url, 'again after', type(backend).__name__, 'failed:', repr(exception))
+					continue
+				if rejected is None:
+					raise
+				print('Keeping the rejected page of', url, 'after', type(backend).__name__, 'failed:', repr(exception))
+				break
+
+			if is_last_backend or accept is None or accept(result):
+				return result
+			rejected = (result,)
+
+		return rejected[0]
+
+	def restart(self):
+		for backend in self.backends:
+			backend.restart()
+
+	def close(self):
+		for backend in self.backends:
+			backend.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc_info):
+		self.close()
+
+def iterate_work_queue(queue):
+	"""Items of a work queue shared by processes, until the queue's end marker (None).
+
+	Every process takes the next item as soon as it is done with the previous one, so a process with slow items does not leave the others idle.
+
+	Args:
+		queue: multiprocessing.Queue of items followed by one None per process.
+
+	Returns:
+		Generator of the items taken by this process.
+	"""
+	while True:
+		item = queue.get()
+		if item is None:
+			return
+		yield item
+
+def work_queue_process(queue, target, args, root_url, page_cache_dir):
+	"""Process entry point of run_work_queue, calls target with the items of the queue and the given args."""
+	configure(root_url, page_cache_dir or '')
+	target(iterate_work_queue(queue), *args)
+
+def run_work_queue(target, items, args_per_process):
+	"""Process the items with one process per args, sharing the items through a work queue instead of a fixed slice per process.
+
+	Args:
+		target: Function of an iterable of items and the args of the process, e.g. scrape_recipe_sources.
+		items: List of items to process.
+		args_per_process: List of argument lists, one per process.
+
+	Returns:
+		True if all the processes have finished running.
+	"""
+	queue = multiprocessing.Queue()
+	for item in items:
+		queue.put(item)
+	for _ in args_per_process:
+		queue.put(None)
+
+	processes = []
+	for args in args_per_process:
+		process = multiprocessing.Process(target=work_queue_process, args=[queue, target, args, ROOT_URL, PAGE_CACHE_DIR])
+		process.start()
+		processes.append(process)
+
+	for process in processes:
+		process.join()
+
+	return True
+
+def parse_root_page(html):
+	"""Category root urls of the root page. The main carousel nav is the source of category root urls."""
+	soup = BeautifulSoup(html,'html.parser')
+	return [link_holder['href'] for link_holder in soup.find_all(class_='carouselNav__link recipeCarousel__link')]
+
+def scrape_root_url(root_url, backends=FETCH_BACKENDS):
 	"""Scrape the root url to get category root urls. The main carousel nav is the source of category root urls.
 
 	Args:
-    	root_url: Root url of the site to scrape.
+		root_url: Root url of the site to scrape.
+		backends: Names of the fetch backends to try in order. Defaults to FETCH_BACKENDS.
 
-    Returns:
+	Returns:
 		A list of category urls.
 	"""
-	options = Options()
-	options.headless = True
-	driver = webdriver.Chrome('./chromedriver',options=options)
-
 	category_root_urls = []
 
-	try:
-		cache_path = 'cache/category_root_urls_cache.json'
+	cache_path = 'cache/category_root_urls_cache.json'
 
-		if path.exists(cache_path):
-			with open(cache_path, 'r') as json_file:
-				category_root_urls = json.load(json_file)
-		else:
-			driver.get(root_url)
-			soup = BeautifulSoup(driver.execute_script('return document.body.innerHTML'),'html.parser')
-
-			for link_holder in soup.find_all(class_='carouselNav__link recipeCarousel__link'):
-				url = link_holder['href']
-				category_root_urls.append(url)
+	if path.exists(cache_path):
+		with open(cache_path, 'r') as json_file:
+			category_root_urls = json.load(json_file)
+	else:
+		with Fetcher.from_names(backends) as fetcher:
+			category_root_urls = fetcher.scrape(root_url, parse_root_page, accept=bool)
 
-			with open(cache_path, 'w') as json_file:
-				json.dump(category_root_urls, json_file)
-	finally:
-		driver.close()
-		driver.quit()
+		with open(cache_path, 'w') as json_file:
+			json.dump(category_root_urls, json_file)
 
 	print('Number of category found: ', len(category_root_urls))
 	return category_root_urls
 
-def scrape_single_category_root_url(category_root_url, driver):
+def parse_category_page(html):
+	"""Recipe urls of one page of a category, an empty list when the page is past the last one."""
+	soup = BeautifulSoup(html,'html.parser')
+	urls = []
+
+	for link_holder in [container.find(class_='card__titleLink') for container in soup.find_all(class_='card__detailsContainer')]:
+		url = clean_url(link_holder['href'])
+		if url != None:
+			urls.append(url)
+
+	for link_holder in [container.find(class_='tout__titleLink') for container in soup.find_all(class_='component tout')]:
+		url = clean_url(link_holder['href'])
+		if url != None:
+			urls.append(url)
+
+	for link_holder in [container.find(class_='fixed-recipe-card__title-link') for container in soup.find_all(class_='fixed-recipe-card')]:
+		url = clean_url(link_holder['href'])
+		if url != None:
+			urls.append(url)
+
+	return urls
+
+def scrape_single_category_root_url(category_root_url, fetcher):
 	"""Scrape the given category root url for a list of recipe urls.
 
 	Args:
     	category_root_url: Category root url to scrape.
-    	driver: Selenium chrome driver used for scraping.
+    	fetcher: Fetcher used for scraping.
 
     Returns:
 		A list of recipe urls scraped from the category root url.
@@ -206,31 +494,11 @@ def scrape_single_category_root_url(category_root_url, driver):
 		page_url = category_root_url + '?page=' + str(page_index)
 		print('Looking at', page_url, '...')
 
-		driver.get(page_url)
-		time.sleep(0.25)
-		soup = BeautifulSoup(driver.execute_script('return document.body.innerHTML'),'html.parser')
-		
-		is_new_recipe_found = False
-
-		for link_holder in [container.find(class_='card__titleLink') for container in soup.find_all(class_='card__detailsContainer')]:
-			url = clean_url(link_holder['href'])
-			if url != None:
-				urls.append(url)
-				is_new_recipe_found = True
-
-		for link_holder in [container.find(class_='tout__titleLink') for container in soup.find_all(class_='component tout')]:
-			url = clean_url(link_holder['href'])
-			if url != None:
-				urls.append(url)
-				is_new_recipe_found = True
-
-		for link_holder in [container.find(class_='fixed-recipe-card__title-link') for container in soup.find_all(class_='fixed-recipe-card')]:
-			url = clean_url(link_holder['href'])
-			if url != None:
-				urls.append(url)
-				is_new_recipe_found = True
+		# An empty page ends the category, let the next backend confirm it is not just a page that needs JavaScript.
+		page_urls = fetcher.scrape(page_url, parse_category_page, accept=bool, wait=0.25)
+		urls.extend(page_urls)
 
-		if not is_new_recipe_found:
+		if not page_urls:
 			break
 
 		json_data['last_page'] = page_index
@@ -239,7 +507,7 @@ def scrape_single_category_root_url(category_root_url, driver):
 
 		# Save data per 100 page indices.
 		if page_index % 100 == 0:
-			urls = clean_url_list(urls=json_data['recipe_urls'])
+			urls = clean_url_list(urls=urls)
 			json_data['recipe_urls'] = urls
 			json_data['recipe_urls_length'] = len(urls)
 			json_data['timestamp'] = time.time()
@@ -250,7 +518,7 @@ def scrape_single_category_root_url(category_root_url, driver):
 		page_index += 1
 
 
-	urls = clean_url_list(urls=json_data['recipe_urls'])
+	urls = clean_url_list(urls=urls)
 	json_data['recipe_urls'] = urls
 	json_data['recipe_urls_length'] = len(urls)
 	json_data['timestamp'] = time.time()
@@ -260,33 +528,33 @@ def scrape_single_category_root_url(category_root_url, driver):
 
 	return json_data['recipe_urls']
 
-def scrape_category_root_urls(category_root_urls):
+def scrape_category_root_urls(category_root_urls, backends=FETCH_BACKENDS):
 	"""Scrape the given list of root urls.
 
 	Args:
-		category_root_urls: List of category root urls to scrape.
+		category_root_urls: List (or any iterable) of category root urls to scrape.
+		backends: Names of the fetch backends to try in order. Defaults to FETCH_BACKENDS.
 
     Returns:
 		True if the scraping has been completed for all categories.
 	"""
-	options = Options()
-	options.headless = True
-	driver = webdriver.Chrome('./chromedriver',options=options)
-
-	try:
+	with Fetcher.from_names(backends) as fetcher:
 		for category_root_url in category_root_urls:
-			scrape_single_category_root_url(category_root_url, driver)
-	finally:
-		driver.close()
-		driver.quit()
+			try:
+				scrape_single_category_root_url(category_root_url, fetcher)
+			except Exception as exception:
+				# Restart the backends and go on with the next category, the pages saved in its cache are resumed from on the next run.
+				print('Failed to scrape category {}: {!r}'.format(category_root_url, exception))
+				fetcher.restart()
 	return True
 
-def process_category_root_urls_in_parallel(category_root_urls, num_of_process=5):
-	"""Process the given list of root urls in parallel using a simple multiprocessing where each process is responsible for processing the same number of categories.
+def process_category_root_urls_in_parallel(category_root_urls, num_of_process=5, backends=FETCH_BACKENDS):
+	"""Process the given list of root urls in parallel, the processes take the next category from a shared work queue when they are done with one.
 
 	Args:
 		category_root_urls: List of category root url to scrape.
 		num_of_process: Number of process that invoked at the same time for multi-processing. Defaults to 5.
+		backends: Names of the fetch backends to try in order. Defaults to FETCH_BACKENDS.
 
     Returns:
 		True if all the processes have finished running.
@@ -294,18 +562,7 @@ def process_category_root_urls_in_parallel(category_root_urls, num_of_process=5)
 	start_time = time.perf_counter()
 
 	categories_len = len(category_root_urls)
-	num_of_category_per_process = categories_len / num_of_process
-	processes = []
-
-	for i in range(num_of_process):
-		start_index = int(i * num_of_category_per_process)
-		end_index = int((i+1) * num_of_category_per_process)
-		process = multiprocessing.Process(target=scrape_category_root_urls, args=[category_root_urls[start_index:end_index]])
-		process.start()
-		processes.append(process)
-
-	for process in processes:
-		process.join()
+	run_work_queue(scrape_category_root_urls, category_root_urls, [[backends] for _ in range(num_of_process)])
 
 	finish_time = time.perf_counter()
 	print('Done scraping', categories_len, 'categories in ', round(finish_time-start_time, 2), 'second(s).')
@@ -352,20 +609,22 @@ def coalesce_recipe_sources_from_category_cache(category_root_urls):
 
 	return combined_recipe_sources
 
-def scrape_single_recipe_url(recipe_url, recipe_category, driver):
+def scrape_single_recipe_url(recipe_url, recipe_category, fetcher):
 	"""Scrape recipe contents from a single recipe url.
 
 	Args:
 		recipe_url: URL of the recipe page to scrape.
 		recipe_category: List of categories associated with the recipe page.
-		driver: Selenium chrome driver used for scraping.
+		fetcher: Fetcher used for scraping.
 
     Returns:
 		Recipe content packaged in a dictionary. Key-value ma
 	"""
-	driver.get(recipe_url)
-	time.sleep(0.05)
-	soup = BeautifulSoup(driver.execute_script('return document.body.innerHTML'),'html.parser')
+	return fetcher.scrape(recipe_url, functools.partial(parse_recipe_page, recipe_url=recipe_url, recipe_category=recipe_category), wait=0.05)
+
+def parse_recipe_page(html, recipe_url, recipe_category):
+	"""Recipe contents of a recipe page, see scrape_single_recipe_url."""
+	soup = BeautifulSoup(html,'html.parser')
 
 	# Recipe ID
 	recipe_id = recipe_id_from_recipe_url(recipe_url)
@@ -464,19 +723,18 @@ def scrape_single_recipe_url(recipe_url, recipe_category, driver):
 
 	return recipe_json
 
-def scrape_recipe_sources(recipe_sources, batch_id):
+def scrape_recipe_sources(recipe_sources, batch_id, backends=FETCH_BACKENDS):
 	"""Scrape the given list of recipe sources. The scraping is processed with a process assigned with the given batch ID.
 
 	Args:
-		recipe_sources: List of recipe sources. A source contains a 'url', the recipe URL, and 'categories', the categories associated with the recipe page.
+		recipe_sources: List (or any iterable) of recipe sources. A source contains a 'url', the recipe URL, and 'categories', the categories associated with the recipe page.
 		batch_id: Batch ID assigned to the process where the scaping is conducted.
+		backends: Names of the fetch backends to try in order. Defaults to FETCH_BACKENDS.
 
     Returns:
 		True if the scraping has been completed for all recipe sources.
 	"""
-	options = Options()
-	options.headless = True
-	driver = webdriver.Chrome('./chromedriver',options=options)
+	fetcher = Fetcher.from_names(backends)
 
 	cache_path = recipe_cache_path(batch_id)
 
@@ -499,26 +757,18 @@ def scrape_recipe_sources(recipe_sources, batch_id):
 				if recipe_id in scraped_ids:
 					continue
 
-				recipe_content = None
-
-				# Sometimes the driver experiences a connection failure. Keep trying to scrape one page until it succeeded.
 				try:
-					recipe_content = scrape_single_recipe_url(recipe_source['url'], recipe_source['categories'], driver)
-				except:
-					# Instantiate a new driver.
-					try:
-						driver.close()
-						driver.quit()
-					finally:
-						time.sleep(1)
-						driver = webdriver.Chrome('./chromedriver',options=options)
-						recipe_content = None
+					recipe_content = scrape_single_recipe_url(recipe_source['url'], recipe_source['categories'], fetcher)
+				except Exception as exception:
+					# Sometimes the driver experiences a connection failure. Restart the backends, the recipe is scraped again on the next run.
+					print('Batch {} failed to scrape {}: {!r}'.format(batch_id, recipe_source['url'], exception))
+					fetcher.restart()
+					continue
 
 				writer.writerow(recipe_content)
 
 	finally:
-		driver.close()
-		driver.quit()
+		fetcher.close()
 
 	return True
 
@@ -548,12 +798,13 @@ def remove_scraped_recipe_from_list(recipe_sources):
 	return new_recipe_sources
 
 
-def process_recipe_sources_in_parallel(recipe_sources, num_of_process=5):
-	"""Process the given list of recipe sources in parallel using a simple multiprocessing where each process is responsible for processing the same number of categories.
+def process_recipe_sources_in_parallel(recipe_sources, num_of_process=5, backends=FETCH_BACKENDS):
+	"""Process the given list of recipe sources in parallel, the processes take the next recipe from a shared work queue when they are done with one.
 
 	Args:
 		recipe_sources: List of recipe sources. A source contains a 'url', the recipe URL, and 'categories', the categories associated with the recipe page.
 		num_of_process: Number of process that invoked at the same time for multi-processing. Defaults to 5.
+		backends: Names of the fetch backends to try in order. Defaults to FETCH_BACKENDS.
 
     Returns:
 		True if all the processes have finished running and after the csv caches have been combined into one csv.
@@ -563,18 +814,8 @@ def process_recipe_sources_in_parallel(recipe_sources, num_of_process=5):
 	recipe_sources = remove_scraped_recipe_from_list(recipe_sources)
 	recipe_sources_len = len(recipe_sources)
 
-	num_of_recipe_per_process = recipe_sources_len / num_of_process
-	processes = []
-
-	for i in range(num_of_process):
-		start_index = int(i * num_of_recipe_per_process)
-		end_index = int((i+1) * num_of_recipe_per_process)
-		process = multiprocessing.Process(target=scrape_recipe_sources, args=[recipe_sources[start_index:end_index],i])
-		process.start()
-		processes.append(process)
-
-	for process in processes:
-		process.join()
+	# The batch IDs stay 0..num_of_process-1, coalesce_recipe_scrape_caches expects them not to be sparse.
+	run_work_queue(scrape_recipe_sources, recipe_sources, [[i, backends] for i in range(num_of_process)])
 
 	finish_time = time.perf_counter()
 	print('Done scraping', recipe_sources_len, 'recipes in ', round(finish_time-start_time, 2), 'second(s).')
@@ -632,9 +873,84 @@ def coalesce_recipe_scrape_caches():
 
 	return True
 
+reparse_fetcher = None		# Fetcher of the cached pages, one per reparse_cached_recipes pool process.
+
+def reparse_process_init(root_url, page_cache_dir, backends):
+	"""Process pool initializer of reparse_cached_recipes."""
+	global reparse_fetcher
+	configure(root_url, page_cache_dir)
+	reparse_fetcher = Fetcher.from_page_cache(backends)
+
+def reparse_recipe(recipe_source):
+	"""Recipe contents of a cached recipe page, or None when no cached page of the recipe parses."""
+	try:
+		return scrape_single_recipe_url(recipe_source['url'], recipe_source['categories'], reparse_fetcher)
+	except Exception as exception:
+		print('Failed to parse the cached page of {}: {!r}'.format(recipe_source['url'], exception))
+		return None
+
+def reparse_cached_recipes(output_path=RESULT_CSV_PATH, num_of_process=None, backends=FETCH_BACKENDS):
+	"""Parse every recipe page of the page cache again, with a process pool and without any request, into a recipe csv.
+
+	Args:
+		output_path: Path of the recipe csv to write, sorted by recipe ID. Defaults to RESULT_CSV_PATH.
+		num_of_process: Number of processes of the pool. Defaults to the number of CPUs.
+		backends: Names of the fetch backends whose cached pages are tried in order. Defaults to FETCH_BACKENDS.
+
+    Returns:
+		Number of recipes written to the csv.
+	"""
+	start_time = time.perf_counter()
+
+	# The categories of a recipe come from the category scrape, they are not on the recipe page.
+	recipe_categories = dict()
+	if path.exists('cache/combined_recipe_urls_cache.json'):
+		with open('cache/combined_recipe_urls_cache.json', 'r') as json_file:
+			recipe_categories = {recipe_source['url']: recipe_source['categories'] for recipe_source in json.load(json_file)['recipe_sources']}
+
+	recipe_urls = clean_url_list(urls=[url for url in PageCache(PAGE_CACHE_DIR).urls() if is_valid_recipe_url(url)])
+	recipe_sources = [{'url': url, 'categories': recipe_categories.get(url, [])} for url in recipe_urls]
+
+	recipes_len = 0
+	tmp_path = output_path + '.tmp'
+	with multiprocessing.Pool(num_of_process, initializer=reparse_process_init, initargs=(ROOT_URL, PAGE_CACHE_DIR, backends)) as pool:
+		with open(tmp_path, 'w') as csv_file:
+			writer = csv.DictWriter(csv_file, fieldnames=RECIPE_CSV_FIELDNAMES)
+			writer.writeheader()
+			for recipe_content in pool.imap(reparse_recipe, recipe_sources, chunksize=16):
+				if recipe_content is not None:
+					writer.writerow(recipe_content)
+					recipes_len += 1
+	os.replace(tmp_path, output_path)
+
+	finish_time = time.perf_counter()
+	print('Parsed', recipes_len, 'of', len(recipe_sources), 'cached recipes in ', round(finish_time-start_time, 2), 'second(s).')
+	return recipes_len
+
 if __name__ == '__main__':
-	if not os.path.exists('chromedriver'):
-		sys.exit('ERROR: A chromedriver is not found at current directory.\nPlease download at https://chromedriver.chromium.org/downloads.')
+	parser = argparse.ArgumentParser(description='Scrape the recipe urls of every category')
+	parser.add_argument('--root-url', default=ROOT_URL, help='site to scrape, e.g. a local fixture server')
+	parser.add_argument('--backends', default=','.join(FETCH_BACKENDS), help='fetch backends to try in order: http, selenium')
+	parser.add_argument('--processes', type=int, default=5)
+	parser.add_argument('--page-cache', default='cache/pages', help="directory of the raw page cache, '' to not keep the pages")
+	parser.add_argument('--reparse', action='store_true', help='parse the cached recipe pages again into --output, without scraping')
+	parser.add_argument('--output', default=RESULT_CSV_PATH, help='recipe csv written by --reparse')
+	args = parser.parse_args()
+
+	configure(args.root_url, args.page_cache)
+	backends = args.backends.split(',')
+
+	if args.reparse:
+		if PAGE_CACHE_DIR is None:
+			sys.exit('ERROR: --reparse needs a --page-cache directory.')
+		reparse_cached_recipes(args.output, None, backends)
+		sys.exit(0)
+
+	if 'selenium' in backends and not os.path.exists('chromedriver'):
+		if backends == ['selenium']:
+			sys.exit('ERROR: A chromedriver is not found at current directory.\nPlease download at https://chromedriver.chromium.org/downloads.')
+		print('WARNING: A chromedriver is not found at current directory, pages that need JavaScript will fail to scrape.')
+		backends.remove('selenium')
 
 	if not os.path.exists('cache'):
 		os.makedirs('cache')
@@ -643,7 +959,7 @@ if __name__ == '__main__':
 	coalesce_recipe_scrape_caches()
 	
 	# Scrape scrape scrape!
-	root_url = 'https://www.allrecipes.com/recipes/'
-	category_root_urls = scrape_root_url(root_url)
-	process_category_root_urls_in_parallel(category_root_urls)
-	process_recipe_sources_in_parallel(coalesce_recipe_sources_from_category_cache(category_root_urls))
\ No newline at end of file
+	root_url = ROOT_URL + '/recipes/'
+	category_root_urls = scrape_root_url(root_url, backends)
+	process_category_root_urls_in_parallel(category_root_urls, args.processes, backends)
+	process_recipe_sources_in_parallel(coalesce_recipe_sources_from_category_cache(category_root_urls), args.processes, backends)
\ No newline at end of file
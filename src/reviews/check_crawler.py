@@ -0,0 +1,91 @@
+'''Scripted crawl of the saved review pages through stub_server.py, checking what crawler.py writes.
+
+Two runs over fixtures/recipe_ids.csv into a temporary directory:
+1. recipe 6903 is throttled (429 with Retry-After on every page), 6665 always
+   answers 500, 6664 has no pages (404) and 9000001 has a page the parser
+   cannot read. The other recipes must be paginated to their blank page,
+   6665 and 9000001 must fail without stopping the crawl.
+2. after a crash is simulated (a torn row past the checkpoint), the crawl is
+   resumed with 6665 answering again: only the recipes missing from the
+   checkpoint are requested, the torn row is gone, and the CSV holds the
+   reviews of the saved pages.
+
+python check_crawler.py
+'''
+import csv
+import os
+import tempfile
+import time
+
+import pandas as pd
+
+from crawler import ReviewCrawler
+from review_sink import REVIEW_FIELDS, review_key
+from stub_server import FIXTURES_DIR, serve_in_thread, stub_server
+
+RECIPE_IDS = os.path.join(os.path.dirname(FIXTURES_DIR), 'recipe_ids.csv')
+REVIEWS_CSV = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'reviews.csv')
+RETRY_AFTER = 1
+
+
+def expected_reviews(recipe_ids):
+    '''Rows of reviews.csv the saved pages were written from, without the repeated reviews the sink drops'''
+    reviews = pd.read_csv(REVIEWS_CSV, dtype=str, keep_default_na=False)
+    rows, seen = [], set()
+    for review in reviews[reviews['recipe_id'].isin([str(recipe_id) for recipe_id in recipe_ids])].to_dict('records'):
+        if review_key(review) not in seen:
+            seen.add(review_key(review))
+            rows.append(tuple(review[field] for field in REVIEW_FIELDS))
+    return sorted(rows)
+
+
+def read_output(path):
+    with open(path, newline='', encoding='utf-8') as f:
+        return sorted(tuple(row[field] for field in REVIEW_FIELDS) for row in csv.DictReader(f))
+
+
+def pages_requested(server, recipe_id):
+    return sorted({page for requested_id, page in server.requests if requested_id == str(recipe_id)})
+
+
+def crawl(base_url, output, recipe_ids):
+    crawler = ReviewCrawler(output, root_url=base_url, concurrency=4, rate=0, max_retries=2, backoff=0.05, chunk_rows=60)
+    start_time = time.perf_counter()
+    stats = crawler.run(recipe_ids)
+    return stats, time.perf_counter() - start_time
+
+
+def main():
+    recipe_ids = pd.read_csv(RECIPE_IDS)['id'].tolist()
+    server = stub_server(throttle=[6903], fail=[6665], retry_after=RETRY_AFTER)
+    base_url = serve_in_thread(server)
+    with tempfile.TemporaryDirectory() as directory:
+        output = os.path.join(directory, 'reviews.csv')
+
+        stats, elapsed_time = crawl(base_url, output, recipe_ids)
+        print(f'run 1: {stats["recipes"]} recipes, {stats["pages"]} pages, {stats["retries"]} retries, failed {stats["failed"]} in {elapsed_time:.1f}s')
+        assert sorted(stats['failed']) == [6665, 9000001], stats['failed']
+        assert pages_requested(server, 6903) == [1, 2, 3, 4], 'pagination stops at the first blank page'
+        assert pages_requested(server, 7047) == [1, 2]
+        assert pages_requested(server, 6664) == [1], 'a 404 recipe has no second page'
+        assert stats['retries'] >= 4 and elapsed_time >= RETRY_AFTER, 'every 429 is retried after Retry-After'
+        assert read_output(output) == expected_reviews([6903, 7047, 7979])
+
+        # a crash while a chunk was being written leaves rows the checkpoint never recorded
+        with open(output, 'a', encoding='utf-8') as f:
+            f.write('2019-01-01,5,6665,123')
+        server.fail.clear()
+        server.requests.clear()
+
+        stats, elapsed_time = crawl(base_url, output, recipe_ids)
+        print(f'run 2: {stats["recipes"]} recipes, {stats["pages"]} pages, {stats["retries"]} retries, failed {stats["failed"]} in {elapsed_time:.1f}s')
+        assert {int(recipe_id) for recipe_id, _ in server.requests} == {6665, 9000001}, 'only the recipes missing from the checkpoint are crawled again'
+        assert pages_requested(server, 6665) == [1, 2, 3, 4, 5]
+        assert stats['failed'] == [9000001]
+        assert read_output(output) == expected_reviews([6903, 6665, 7047, 7979]), 'the torn row is dropped on resume'
+    server.shutdown()
+    print('ok')
+
+
+if __name__ == '__main__':
+    main()
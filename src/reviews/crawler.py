@@ -0,0 +1,213 @@
+'''Concurrent review crawler, the asynchronous counterpart of get_all_users in scraper.py.
+
+Worker tasks take recipes from a queue and fetch their review pages in order
+until a blank page, so many recipes are in flight at once. The requests go
+through one keep-alive requests.Session run in a thread pool, at most
+per_host at a time per host, and at most rate per second overall (token
+bucket). Connection errors, 429 and 5xx responses are retried with
+exponential backoff, honouring Retry-After.
+
+The reviews of a recipe go to a ReviewSink once all its pages are parsed.
+It writes them to the output CSV in fsynced chunks and checkpoints the
+recipes of every chunk, so an interrupted crawl resumes with the recipes not
+on disk yet. check_crawler.py runs it against the saved pages of stub_server.py.
+
+python crawler.py --output ../data/reviews.csv --concurrency 32 --rate 20
+python crawler.py --base-url http://localhost:8000 --recipe-ids fixtures/recipe_ids.csv --output /tmp/reviews.csv   # python stub_server.py
+'''
+import argparse
+import asyncio
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+
+from review_sink import CHUNK_ROWS, ReviewSink
+from scraper import HEADERS, MAX_PAGES, ROOT_URL, parse_reviews_page, reviews_url
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class CrawlError(Exception):
+    pass
+
+
+class TokenBucket:
+    '''Lets rate requests per second through on average, in bursts of up to capacity requests'''
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = None
+
+    async def acquire(self):
+        if not self.rate or self.rate <= 0:
+            return
+        # created here, asyncio objects bind to the event loop running when they are made
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class ReviewCrawler:
+    '''Crawls the reviews of many recipes concurrently into a CSV, see the module docstring'''
+    def __init__(self, output_path, checkpoint_path=None, root_url=ROOT_URL, concurrency=16, per_host=8,
+                 rate=10.0, max_retries=4, backoff=1.0, timeout=30, chunk_rows=CHUNK_ROWS):
+        self.sink = ReviewSink(output_path, checkpoint_path, chunk_rows)
+        self.root_url = root_url.rstrip('/')
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.bucket = TokenBucket(rate)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(per_host, 1))
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+        self.host_limits = {}
+        self.stats = {'recipes': 0, 'pages': 0, 'reviews': 0, 'retries': 0, 'failed': []}
+
+    def fetch(self, url, page):
+        '''Blocking GET of one review page, run in the thread pool'''
+        response = self.session.get(url, headers=HEADERS, params={'pagenumber': page}, timeout=self.timeout)
+        return response.status_code, response.content, response.headers.get('Retry-After')
+
+    def _retry_delay(self, attempt, retry_after):
+        if retry_after is not None and retry_after.strip().isdigit():
+            return float(retry_after)
+        return self.backoff * 2 ** attempt * (0.5 + random.random())
+
+    async def get_page(self, recipe_id, page):
+        '''Content of one review page, b'' when the recipe does not exist'''
+        loop = asyncio.get_event_loop()
+        url = reviews_url(recipe_id, self.root_url)
+        host = urlsplit(url).netloc
+        if host not in self.host_limits:
+            self.host_limits[host] = asyncio.Semaphore(self.per_host)
+
+        for attempt in range(self.max_retries + 1):
+            await self.bucket.acquire()
+            async with self.host_limits[host]:
+                try:
+                    status, content, retry_after = await loop.run_in_executor(self.executor, self.fetch, url, page)
+                except requests.RequestException as error:
+                    status, content, retry_after = None, error, None
+
+            if status == 200:
+                self.stats['pages'] += 1
+                return content
+            if status == 404:
+                return b''
+            if status is not None and status not in RETRY_STATUSES:
+                raise CrawlError(f'recipe {recipe_id} page {page}: HTTP {status}')
+            if attempt == self.max_retries:
+                raise CrawlError(f'recipe {recipe_id} page {page}: {content if status is None else "HTTP %d" % status}')
+            self.stats['retries'] += 1
+            await asyncio.sleep(self._retry_delay(attempt, retry_after))
+
+    async def crawl_recipe(self, recipe_id):
+        '''All the reviews of a recipe, its pages are fetched one after another until a blank one'''
+        loop = asyncio.get_event_loop()
+        users = []
+        for page in range(1, MAX_PAGES + 1):
+            content = await self.get_page(recipe_id, page)
+            # parsing is CPU bound, keep it off the event loop
+            try:
+                page_users = await loop.run_in_executor(self.executor, parse_reviews_page, content, recipe_id) if content else []
+            except ValueError as error:
+                raise CrawlError(f'recipe {recipe_id} page {page}: {error}')
+            if not page_users:
+                break
+            users.extend(page_users)
+        return users
+
+    async def _worker(self, queue):
+        while True:
+            try:
+                recipe_id = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            try:
+                users = await self.crawl_recipe(recipe_id)
+            except CrawlError as error:
+                # not checkpointed, the next run tries the recipe again
+                print(f'Failed {error}')
+                self.stats['failed'].append(recipe_id)
+                continue
+            except Exception as error:
+                # an unexpected error, only this recipe is lost
+                print(f'Failed recipe {recipe_id}: {error!r}')
+                self.stats['failed'].append(recipe_id)
+                continue
+            self.sink.add(recipe_id, users)
+            self.stats['recipes'] += 1
+            self.stats['reviews'] += len(users)
+            print(f'Got {len(users)} reviews for recipe {recipe_id}, {self.stats["recipes"]} recipes done')
+
+    async def crawl(self, recipe_ids):
+        '''Crawl the recipes not in the checkpoint yet, returns the stats of the run'''
+        with self.sink:
+            queue = asyncio.Queue()
+            for recipe_id in recipe_ids:
+                if str(recipe_id) not in self.sink.done:
+                    queue.put_nowait(recipe_id)
+            workers = [self._worker(queue) for _ in range(self.concurrency)]
+            await asyncio.gather(*workers)
+        self.stats['duplicates'] = self.sink.stats['duplicates']
+        return self.stats
+
+    def run(self, recipe_ids):
+        '''Blocking crawl of the recipes'''
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            return loop.run_until_complete(self.crawl(recipe_ids))
+        finally:
+            # on Ctrl-C the crawl coroutine is left suspended, write out the recipes done so far here
+            self.sink.close()
+            self.executor.shutdown(wait=True)
+            self.session.close()
+            loop.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Crawl the reviews of recipes concurrently")
+    parser.add_argument("--recipe-ids", default="../data/recipe_ids.csv", help="CSV with an id column")
+    parser.add_argument("--start", type=int, default=0, help="first recipe of the CSV to crawl")
+    parser.add_argument("--stop", type=int, default=None, help="recipe of the CSV to stop before")
+    parser.add_argument("--output", default="../data/reviews.csv")
+    parser.add_argument("--checkpoint", default=None, help="defaults to the output path + .checkpoint")
+    parser.add_argument("--base-url", default=ROOT_URL, help="site to crawl, e.g. a local stub server")
+    parser.add_argument("--concurrency", type=int, default=16, help="recipes crawled at once")
+    parser.add_argument("--per-host", type=int, default=8, help="requests in flight per host")
+    parser.add_argument("--rate", type=float, default=10.0, help="requests per second, 0 for no limit")
+    parser.add_argument("--retries", type=int, default=4)
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS, help="reviews written and fsynced at a time")
+    args = parser.parse_args()
+
+    recipe_ids = pd.read_csv(args.recipe_ids)["id"].tolist()[args.start:args.stop]
+    crawler = ReviewCrawler(args.output, args.checkpoint, args.base_url, args.concurrency, args.per_host,
+                            args.rate, args.retries, chunk_rows=args.chunk_rows)
+    start_time = time.time()
+    stats = crawler.run(recipe_ids)
+    elapsed_time = time.time() - start_time
+    print(f'{stats["recipes"]} recipes, {stats["pages"]} pages, {stats["reviews"]} reviews ({stats["duplicates"]} duplicates), {stats["retries"]} retries '
+          f'in {elapsed_time:.1f}s ({stats["pages"] / max(elapsed_time, 1e-9):.1f} pages/s)')
+    if stats['failed']:
+        print(f'Failed recipes: {stats["failed"]}')
@@ -0,0 +1,140 @@
+'''Parsing benchmark of the review pages, scraper.parse_review_columns against the find_all per review parser it replaced.
+
+Runs both parsers over a corpus of saved review pages, by default the
+fixtures/review_pages served by stub_server.py (or any files matching --pages),
+checks they extract the same reviews, and reports the time per page and the
+pages per second of each. Pages the previous parser cannot read are left out.
+With --synthetic, generated pages with the markup of the review pages are
+used instead, to time more or bigger pages.
+
+python parse_benchmark.py --save report.json
+python parse_benchmark.py --pages "saved_pages/*.html"
+python parse_benchmark.py --synthetic 200 --reviews 50
+'''
+import argparse
+import glob
+import json
+import os
+import re
+import sys
+import time
+
+import numpy as np
+from bs4 import BeautifulSoup
+
+from scraper import PAGE_FIELDS, parse_review_columns
+from stub_server import FIXTURES_DIR
+
+PERCENTILES = [50, 95, 99]
+
+
+def find_all_columns(content):
+    '''The previous parser, a find_all per field for every review'''
+    soup = BeautifulSoup(content,"lxml")
+    num_users = len(soup.find_all("h4",{"itemprop":"author"}))
+    columns = {field: [] for field in PAGE_FIELDS}
+    for i in range(num_users):
+        columns["user_id"].append(soup.find_all("div",{"class":"recipe-details-cook-stats-container"})[i].find("a")["href"].split("/")[-2])
+        columns["username"].append(re.sub(r'\\r\\n|\s\s','',soup.find_all("h4",{"itemprop":"author"})[i].text))
+        columns["rating"].append(soup.find_all("div",{"class":"stars-and-date-container"})[i]["title"].split(" ")[2])
+        columns["date"].append(soup.find_all("div",{"class":"review-date"})[i]["content"])
+    return columns
+
+
+def synthetic_page(page, n_reviews):
+    '''A review page of n_reviews reviews, with the markup parse_review_columns reads and some around it'''
+    reviews = []
+    for i in range(n_reviews):
+        user_id = 1000000 + page * 1000 + i
+        reviews.append(f'''
+<div class="review-container clearfix">
+  <div class="recipe-details-cook-stats-container">
+    <a href="https://www.allrecipes.com/cook/{user_id}/" class="cook-details"><img src="/img/{user_id}.jpg" alt=""/></a>
+    <ul class="cook-details__stats"><li>{i % 40} followers</li><li>{i % 90} reviews</li></ul>
+  </div>
+  <h4 itemprop="author">Cook\\r\\n  {user_id} é</h4>
+  <div class="stars-and-date-container" title="Rated as {1 + user_id % 5} out of 5 stars">
+    <span class="stars stars-{1 + user_id % 5}"></span>
+    <div class="review-date" content="2019-0{1 + i % 9}-1{i % 10}">{i} days ago</div>
+  </div>
+  <p itemprop="reviewBody">{"Tasty and easy, I added more garlic. " * (1 + i % 5)}</p>
+</div>''')
+    return f'''<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Reviews</title></head>
+<body><div class="reviews">{"".join(reviews)}</div></body></html>'''.encode("utf-8")
+
+
+def load_pages(pattern):
+    '''Contents of the saved pages, and the names of the ones find_all_columns fails on'''
+    pages, skipped = [], []
+    for path in sorted(glob.glob(pattern)):
+        with open(path, "rb") as f:
+            content = f.read()
+        try:
+            find_all_columns(content)
+        except (AttributeError, TypeError, KeyError, IndexError):
+            skipped.append(os.path.basename(path))
+            continue
+        pages.append(content)
+    return pages, skipped
+
+
+def time_parser(parser, pages, repeat):
+    '''Best of repeat timings of every page, in seconds, and the reviews parsed from the pages'''
+    timings = np.full(len(pages), np.inf)
+    for _ in range(repeat):
+        results = []
+        for i, content in enumerate(pages):
+            start = time.perf_counter()
+            results.append(parser(content))
+            timings[i] = min(timings[i], time.perf_counter() - start)
+    return timings, results
+
+
+def summarize(timings):
+    milliseconds = timings * 1000
+    summary = {f"p{p}_ms": float(np.percentile(milliseconds, p)) for p in PERCENTILES}
+    summary["mean_ms"] = float(milliseconds.mean())
+    summary["pages_per_second"] = float(len(timings) / timings.sum())
+    return summary
+
+
+def run(pages, repeat=3):
+    report = {"config": {"pages": len(pages), "repeat": repeat, "bytes": sum(len(content) for content in pages), "python": sys.version.split()[0]}}
+    reference = None
+    for name, parser in [("find_all", find_all_columns), ("single_pass", parse_review_columns)]:
+        timings, results = time_parser(parser, pages, repeat)
+        report[name] = summarize(timings)
+        if reference is None:
+            reference = results
+        elif results != reference:
+            mismatches = [i for i, (result, expected) in enumerate(zip(results, reference)) if result != expected]
+            raise AssertionError(f'{name} disagrees with find_all on pages {mismatches[:10]}')
+    report["reviews"] = sum(len(columns["username"]) for columns in reference)
+    report["speedup"] = report["single_pass"]["pages_per_second"] / report["find_all"]["pages_per_second"]
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Parsing benchmark of the review pages")
+    parser.add_argument("--pages", default=os.path.join(FIXTURES_DIR, "*.html"), help="glob of saved review pages")
+    parser.add_argument("--synthetic", type=int, default=None, help="number of synthetic pages, instead of the saved ones")
+    parser.add_argument("--reviews", type=int, default=50, help="reviews per synthetic page, 50 like the crawled pages")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--save", default=None, help="write the report here")
+    args = parser.parse_args()
+
+    if args.synthetic:
+        pages, skipped = [synthetic_page(page, args.reviews) for page in range(args.synthetic)], []
+    else:
+        pages, skipped = load_pages(args.pages)
+        if not pages:
+            parser.error(f"no readable pages match {args.pages}")
+    report = run(pages, args.repeat)
+    report["config"]["source"] = f"{args.synthetic} synthetic pages" if args.synthetic else args.pages
+    report["config"]["skipped"] = skipped
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+    print(json.dumps(report, indent=2))
@@ -0,0 +1,173 @@
+'''Append-only CSV sink of scraped reviews, written chunk by chunk.
+
+Reviews are buffered until chunk_rows of them are pending, then appended to
+the CSV, which is fsynced before a line is added to the checkpoint file:
+{"offset": size of the CSV after the chunk, "recipes": recipe IDs completed in it}.
+Opening the sink again truncates the CSV back to the last checkpointed offset,
+so a crash loses at most the chunk being written, and recipes that are not in
+the checkpoint are crawled again.
+
+Reviews already written with the same (user_id, recipe_id, date) are dropped.
+They are remembered as sorted runs of 64-bit hashes, 8 bytes per review,
+so memory stays flat as the CSV grows. Every chunk adds a run, merged with
+the one before it while that is no longer than twice its size, so there are
+O(log reviews) runs and a hash is merged O(log reviews) times. The columns
+are the ones of reviews.csv, the file can go straight into ratings.py /
+RatingsStore.from_csv.
+
+with ReviewSink("../data/reviews.csv") as sink:
+    for recipe_id in recipe_ids:
+        if str(recipe_id) not in sink.done:
+            sink.add(recipe_id, get_users(recipe_id))
+'''
+import csv
+import hashlib
+import json
+import os
+
+import numpy as np
+
+REVIEW_FIELDS = ['date', 'rating', 'recipe_id', 'user_id', 'username']
+CHUNK_ROWS = 5000
+
+
+def review_key(review):
+    '''64-bit hash of the (user_id, recipe_id, date) of a review'''
+    return _key(review['user_id'], review['recipe_id'], review['date'])
+
+
+def _key(user_id, recipe_id, date):
+    key = f'{user_id}\x1f{recipe_id}\x1f{date}'.encode('utf-8')
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), 'little')
+
+
+class ReviewSink:
+    '''Streams reviews to a CSV with fsynced checkpoints, see the module docstring'''
+    def __init__(self, path, checkpoint_path=None, chunk_rows=CHUNK_ROWS):
+        self.path = path
+        self.checkpoint_path = checkpoint_path or path + '.checkpoint'
+        self.chunk_rows = chunk_rows
+        self.done = set()
+        self.stats = {'rows': 0, 'duplicates': 0, 'chunks': 0}
+
+        self._runs = []   # sorted runs of the hashes of the reviews on disk, longest first
+        self._pending = []
+        self._pending_keys = set()
+        self._pending_recipes = []
+        self._file = None
+        self._writer = None
+        self._checkpoint = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _recover(self):
+        '''Offset of the last complete chunk and the recipes done before it, from the checkpoint'''
+        offset = None
+        if os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                        offset, recipes = entry['offset'], entry['recipes']
+                    except (ValueError, TypeError, KeyError):
+                        break  # torn last line
+                    self.done.update(str(recipe_id) for recipe_id in recipes)
+        return offset
+
+    def open(self):
+        if os.path.exists(self.path):
+            offset = self._recover()
+            if offset is not None and os.path.getsize(self.path) > offset:
+                # rows of a chunk the checkpoint never recorded
+                os.truncate(self.path, offset)
+            self._runs = [self._read_keys()]
+
+        self._file = open(self.path, 'a', newline='', encoding='utf-8')
+        self._writer = csv.DictWriter(self._file, fieldnames=REVIEW_FIELDS, extrasaction='ignore')
+        if self._file.tell() == 0:
+            self._writer.writeheader()
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+        # start the checkpoint over with one line of what was recovered, which also drops a torn line
+        with open(self.checkpoint_path + '.tmp', 'w') as f:
+            f.write(json.dumps({'offset': self._file.tell(), 'recipes': sorted(self.done)}) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(self.checkpoint_path + '.tmp', self.checkpoint_path)
+        self._checkpoint = open(self.checkpoint_path, 'a')
+        return self
+
+    def _read_keys(self):
+        '''Sorted hashes of the reviews in the CSV, only the key columns of every row are read'''
+        with open(self.path, newline='', encoding='utf-8') as f:
+            reader = csv.reader(f)
+            header = next(reader, None)
+            if header is None:
+                return np.empty(0, dtype=np.uint64)
+            columns = [header.index(field) for field in ('user_id', 'recipe_id', 'date')]
+            keys = np.fromiter((_key(*(row[column] for column in columns)) for row in reader if row), dtype=np.uint64)
+        return np.unique(keys)
+
+    def _on_disk(self, keys):
+        '''Mask of the keys (a uint64 array) of reviews already written, one binary search per run'''
+        seen = np.zeros(len(keys), dtype=bool)
+        for run in self._runs:
+            if len(run):
+                seen |= run[np.minimum(np.searchsorted(run, keys), len(run) - 1)] == keys
+        return seen
+
+    def add(self, recipe_id, reviews):
+        '''Buffers all the reviews of a recipe, and writes a chunk once chunk_rows are pending'''
+        reviews = list(reviews)
+        keys = [review_key(review) for review in reviews]
+        on_disk = self._on_disk(np.array(keys, dtype=np.uint64))
+        for review, key, seen in zip(reviews, keys, on_disk):
+            if seen or key in self._pending_keys:
+                self.stats['duplicates'] += 1
+                continue
+            self._pending_keys.add(key)
+            self._pending.append(review)
+        self._pending_recipes.append(str(recipe_id))
+        if len(self._pending) >= self.chunk_rows:
+            self.flush()
+
+    def flush(self):
+        '''Appends the pending reviews and checkpoints their recipes once they are on disk'''
+        if not self._pending_recipes:
+            return
+        self._writer.writerows(self._pending)
+        self._sync(self._pending_recipes)
+
+        if self._pending_keys:
+            self._runs.append(np.sort(np.fromiter(self._pending_keys, dtype=np.uint64, count=len(self._pending_keys))))
+        while len(self._runs) > 1 and len(self._runs[-2]) <= 2 * len(self._runs[-1]):
+            # both runs are sorted, the stable sort (timsort) merges them in one pass
+            newer = self._runs.pop()
+            self._runs[-1] = np.sort(np.concatenate((self._runs[-1], newer)), kind='stable')
+        self.done.update(self._pending_recipes)
+        self.stats['rows'] += len(self._pending)
+        self.stats['chunks'] += 1
+        self._pending, self._pending_keys, self._pending_recipes = [], set(), []
+
+    def _sync(self, recipes):
+        '''fsync the CSV, then record its size and the recipes it now holds in the checkpoint'''
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._checkpoint.write(json.dumps({'offset': self._file.tell(), 'recipes': recipes}) + '\n')
+        self._checkpoint.flush()
+        os.fsync(self._checkpoint.fileno())
+
+    def close(self):
+        if self._file is None:
+            return
+        try:
+            self.flush()
+        finally:
+            self._file.close()
+            self._checkpoint.close()
+            self._file = self._checkpoint = None
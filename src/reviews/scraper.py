@@ -1,46 +1,94 @@
 import requests
 import numpy as np
 import pandas as pd
-from bs4 import BeautifulSoup
+from bs4 import UnicodeDammit
+import lxml.html
 import re
 import json
 from time import sleep, time
 import random
 
+from review_sink import REVIEW_FIELDS, ReviewSink
+
+ROOT_URL = 'https://www.allrecipes.com'
+HEADERS = {'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_14_0) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/74.0.3729.131 Safari/537.36'}
+MAX_PAGES = 9
+PAGE_FIELDS = ['user_id', 'username', 'rating', 'date']
+
 class util:
     def __init__(self):
         pass
 
-# load recipes ids
-final_recipe_ids = pd.read_csv("../data/recipe_ids.csv")["id"].tolist()
-print(final_recipe_ids)
-
 ##### user reviews #####
+def reviews_url(recipe_id, root_url=ROOT_URL):
+    '''URL of the review pages of a recipe, the page number goes in the pagenumber parameter
+    '''
+    return f'{root_url}/recipe/getreviews/?recipeid={recipe_id}&recipeType=Recipe&sortBy=MostHelpful&pagesize=50'
+
+def _split_attribute(element, name, separator=None, index=0):
+    '''Part `index` of the attribute split on `separator` (the whole attribute without one),
+    ValueError if the attribute or the part is missing
+    '''
+    value = element.get(name)
+    parts = (value.split(separator) if separator else [value]) if value else []
+    if not -len(parts) <= index < len(parts):
+        raise ValueError(f'review page with a {element.tag} without a usable {name} attribute: {value!r}')
+    return parts[index]
+
+def parse_review_columns(content):
+    '''Returns the reviews of one review page as columns, {field: list of strings} for the PAGE_FIELDS
+
+    The page is walked once, in document order, so the i-th value of every column
+    belongs to the i-th review like the i-th match of a find_all per field would.
+    A page missing a link or an attribute its reviews need raises ValueError.
+    '''
+    columns = {field: [] for field in PAGE_FIELDS}
+    if isinstance(content, bytes):
+        content = UnicodeDammit(content, is_html=True).unicode_markup # same decoding as BeautifulSoup
+    if not content or not content.strip():
+        return columns
+
+    for element in lxml.html.fromstring(content).iter("h4", "div"):
+        if element.tag == "h4":
+            if element.get("itemprop") == "author":
+                columns["username"].append(re.sub(r'\\r\\n|\s\s','',element.text_content()))
+            continue
+        classes = element.get("class", "").split()
+        if "recipe-details-cook-stats-container" in classes:
+            link = element.find(".//a")
+            if link is None:
+                raise ValueError('review page with a cook without a profile link')
+            columns["user_id"].append(_split_attribute(link, "href", "/", -2))
+        if "stars-and-date-container" in classes:
+            columns["rating"].append(_split_attribute(element, "title", " ", 2))
+        if "review-date" in classes:
+            columns["date"].append(_split_attribute(element, "content"))
+
+    num_users = len(columns["username"]) # users on a page
+    if any(len(values) < num_users for values in columns.values()):
+        raise ValueError(f'review page with {num_users} authors but ' + ', '.join(f'{len(values)} {field}s' for field, values in columns.items()))
+    return {field: values[:num_users] for field, values in columns.items()}
+
+def parse_reviews_page(content, recipe_id):
+    '''Returns the users of one review page, an empty list for a blank page
+    '''
+    columns = parse_review_columns(content)
+    return [{"recipe_id": recipe_id, **dict(zip(PAGE_FIELDS, values))} for values in zip(*(columns[field] for field in PAGE_FIELDS))]
+
 def get_users(recipe_id):
     '''Returns users in a dictionary for a specific recipe
     '''
-    URL = f'https://www.allrecipes.com/recipe/getreviews/?recipeid={recipe_id}&recipeType=Recipe&sortBy=MostHelpful&pagesize=50'
-    headers = {'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_14_0) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/74.0.3729.131 Safari/537.36'}
+    URL = reviews_url(recipe_id)
     lst_of_users = []
-    for page in range(1,10): # loop through all pages
+    for page in range(1,MAX_PAGES+1): # loop through all pages
         params = {'pagenumber': page}
-        response = requests.get(URL,headers=headers, params=params)
-        soup = BeautifulSoup(response.content,"lxml")
-        num_users = len(soup.find_all("h4",{"itemprop":"author"})) # users on a page
-        print(num_users)
-        if num_users == 0: # if page is blank, break loop
+        response = requests.get(URL,headers=HEADERS, params=params)
+        users = parse_reviews_page(response.content, recipe_id)
+        print(len(users))
+        if len(users) == 0: # if page is blank, break loop
             break
-        index = 1
-        for i in range(num_users): # loop through users on a page
-            user = {}
-            user["recipe_id"] = recipe_id
-            user["user_id"] = soup.find_all("div",{"class":"recipe-details-cook-stats-container"})[i].find("a")["href"].split("/")[-2]
-            user["username"] = re.sub(r'\\r\\n|\s\s','',soup.find_all("h4",{"itemprop":"author"})[i].text)
-            user["rating"] = soup.find_all("div",{"class":"stars-and-date-container"})[i]["title"].split(" ")[2]
-            user["date"] = soup.find_all("div",{"class":"review-date"})[i]["content"]
-            lst_of_users.append(user)
-            print(f'Getting review seq: {index} of page {page}')
-            index +=1
+        lst_of_users.extend(users)
+        print(f'Got {len(users)} reviews of page {page}')
     return lst_of_users
 
 
@@ -48,7 +96,6 @@ def get_all_users(final_recipe_ids):
     '''Return all the users as a dataframe get_all_users(final_recipe_ids[0:2])
     '''   
     start_time = time()
-    df = pd.DataFrame(columns=['date', 'rating', 'recipe_id', 'user_id', 'username'])
     index = 1
     users = []
     for i in final_recipe_ids:
@@ -59,44 +106,25 @@ def get_all_users(final_recipe_ids):
         elapsed_time = time() - start_time
         print(elapsed_time)
         #sleep(random.randint(0,3))
-    # concat outside of the first loop function for better performance
-    lst = []
-    for user in users:
-        lst.append(pd.DataFrame([user]))
-    return pd.concat(lst)
-
-
-#data = get_all_users(final_recipe_ids[0:1000])
-#data.to_csv("../data/reviews.csv",index=False)
-
-
-data = get_all_users(final_recipe_ids[0:5])
-data.to_csv("../data/reviews.csv",index=False)
-
-data = get_all_users(final_recipe_ids[5:10])
-data.to_csv("../data/reviews.csv",index=False,mode='a', header=False)
-
-data = get_all_users(final_recipe_ids[10:100])
-data.to_csv("../data/reviews.csv",index=False,mode='a', header=False)
-
-data = get_all_users(final_recipe_ids[100:200])
-data.to_csv("../data/reviews.csv",index=False,mode='a', header=False)
-
-data = get_all_users(final_recipe_ids[200:400])
-data.to_csv("../data/reviews.csv",index=False,mode='a', header=False)
-
-data = get_all_users(final_recipe_ids[400:600])
-data.to_csv("../data/reviews.csv",index=False,mode='a', header=False)
-
-data = get_all_users(final_recipe_ids[600:800])
-data.to_csv("../data/reviews.csv",index=False,mode='a', header=False)
-
-data = get_all_users(final_recipe_ids[800:1000])
-data.to_csv("../data/reviews.csv",index=False,mode='a', header=False)
-
-
-
-
-
-
+    # one frame of all the rows, not a one-row frame per user
+    return pd.DataFrame(users, columns=REVIEW_FIELDS)
 
+def save_all_users(final_recipe_ids, path="../data/reviews.csv"):
+    '''Stream the users of the recipes to a CSV, skipping the recipes it already holds
+    '''
+    with ReviewSink(path) as sink:
+        for index, recipe_id in enumerate(final_recipe_ids, 1):
+            if str(recipe_id) in sink.done:
+                continue
+            sink.add(recipe_id, get_users(recipe_id))
+            print(f'Got users for recipe {index}/{len(final_recipe_ids)}')
+    return sink.stats
+
+
+if __name__ == '__main__':
+    # sequential crawl, crawler.py does the same concurrently
+    # load recipes ids
+    final_recipe_ids = pd.read_csv("../data/recipe_ids.csv")["id"].tolist()
+    print(final_recipe_ids)
+
+    save_all_users(final_recipe_ids[0:1000], "../data/reviews.csv")
@@ -0,0 +1,162 @@
+'''Local stub of the review pages endpoint, serving the saved pages in fixtures/review_pages.
+
+GET /recipe/getreviews/?recipeid=<id>&pagenumber=<n> answers with the saved
+page <id>-<n>.html, a blank page past the last saved page of a recipe, and
+404 for a recipe without saved pages, like the site did. Some failures can
+be injected to exercise crawler.py:
+    --throttle ID   the first request of every page of the recipe gets 429 with Retry-After
+    --fail ID       every request for the recipe gets 500
+    --delay S       latency added to every response
+
+The saved pages have the markup of the getreviews pages, rebuilt from the
+reviews crawled into ../data/reviews.csv (--write-fixtures); 9000001-1.html
+is a hand-edited page whose first review lost its profile link.
+
+python stub_server.py --port 8000 --throttle 6903
+python crawler.py --base-url http://localhost:8000 --recipe-ids fixtures/recipe_ids.csv --output /tmp/reviews.csv
+python stub_server.py --write-fixtures 6903 6665 7047 7979
+'''
+import argparse
+import html
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import pandas as pd
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'review_pages')
+PAGE_SIZE = 50
+
+
+def page_path(directory, recipe_id, page):
+    return os.path.join(directory, f'{recipe_id}-{page}.html')
+
+
+def review_markup(review):
+    '''One review of a getreviews page, the nodes parse_review_columns reads and the ones around them'''
+    user_id, username = review['user_id'], html.escape(review['username'])
+    return f'''
+<div class="review-container clearfix">
+    <div class="recipe-details-cook-stats-container">
+        <a href="https://www.allrecipes.com/cook/{user_id}/" class="cook-details" data-internal-referrer-link="reviews">
+            <img class="img-profile elevate-cook-thumbnail" src="https://images.media-allrecipes.com/userphotos/50x50/{user_id}.jpg" alt="{username}" title="{username}" />
+        </a>
+        <ul class="cook-details__stats">
+            <li><format-large-number number="{int(user_id) % 97}"></format-large-number> followers</li>
+            <li><format-large-number number="{int(user_id) % 53}"></format-large-number> reviews</li>
+        </ul>
+    </div>
+    <div class="review-detail">
+        <a href="https://www.allrecipes.com/cook/{user_id}/reviews/" data-internal-referrer-link="reviews">
+            <h4 itemprop="author">{username}</h4>
+        </a>
+        <div class="stars-and-date-container" title="Rated as {review['rating']} out of 5 stars">
+            <span class="stars stars-{review['rating']}"></span>
+            <div class="review-date" itemprop="dateCreated" content="{review['date']}">{review['date']}</div>
+        </div>
+        <div class="review-detail__link"><a class="review-detail__link" href="https://www.allrecipes.com/cook/{user_id}/reviews/">Read more</a></div>
+    </div>
+</div>'''
+
+
+def write_fixtures(reviews_csv, recipe_ids, directory=FIXTURES_DIR, page_size=PAGE_SIZE):
+    '''Saves the review pages of the recipes, page_size reviews a page in the order of the CSV'''
+    os.makedirs(directory, exist_ok=True)
+    reviews = pd.read_csv(reviews_csv, dtype=str, keep_default_na=False)
+    for recipe_id in recipe_ids:
+        rows = reviews[reviews['recipe_id'] == str(recipe_id)].to_dict('records')
+        for page, start in enumerate(range(0, len(rows), page_size), 1):
+            cards = ''.join(review_markup(review) for review in rows[start:start + page_size])
+            with open(page_path(directory, recipe_id, page), 'w', encoding='utf-8') as f:
+                f.write(f'<div class="reviews-list" data-recipe-id="{recipe_id}" data-page="{page}">{cards}\n</div>\n')
+        print(f'recipe {recipe_id}: {len(rows)} reviews in {-(-len(rows) // page_size)} pages')
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        url = urlsplit(self.path)
+        params = parse_qs(url.query)
+        if url.path.rstrip('/') != '/recipe/getreviews' or 'recipeid' not in params:
+            return self.reply(404)
+        recipe_id = params['recipeid'][0]
+        page = int(params.get('pagenumber', ['1'])[0])
+        server.requests.append((recipe_id, page))
+        if server.delay:
+            time.sleep(server.delay)
+
+        if recipe_id in server.fail:
+            return self.reply(500)
+        if recipe_id in server.throttle:
+            with server.lock:
+                first = (recipe_id, page) not in server.throttled
+                server.throttled.add((recipe_id, page))
+            if first:
+                return self.reply(429, headers={'Retry-After': str(server.retry_after)})
+
+        if not os.path.exists(page_path(server.directory, recipe_id, 1)):
+            return self.reply(404)
+        path = page_path(server.directory, recipe_id, page)
+        if not os.path.exists(path):
+            return self.reply(200, b'')   # blank page past the last one
+        with open(path, 'rb') as f:
+            self.reply(200, f.read())
+
+    def reply(self, status, body=b'', headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def stub_server(port=0, directory=FIXTURES_DIR, throttle=(), fail=(), retry_after=1, delay=0.0):
+    '''Review pages server on localhost, port 0 picks a free port (server.server_address[1]).
+
+    server.requests lists the (recipe_id, page) of every request it got.
+    '''
+    server = ThreadingHTTPServer(('127.0.0.1', port), StubHandler)
+    server.daemon_threads = True
+    server.directory = directory
+    server.throttle = {str(recipe_id) for recipe_id in throttle}
+    server.fail = {str(recipe_id) for recipe_id in fail}
+    server.retry_after = retry_after
+    server.delay = delay
+    server.requests = []
+    server.throttled = set()
+    server.lock = threading.Lock()
+    return server
+
+
+def serve_in_thread(server):
+    '''Starts the server in a daemon thread, returns its base URL'''
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f'http://127.0.0.1:{server.server_address[1]}'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serve the saved review pages like the review pages endpoint")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--pages", default=FIXTURES_DIR, help="directory of <recipe_id>-<page>.html files")
+    parser.add_argument("--throttle", nargs="*", default=[], help="recipes answered 429 on the first request of each page")
+    parser.add_argument("--fail", nargs="*", default=[], help="recipes always answered 500")
+    parser.add_argument("--retry-after", type=int, default=1, help="seconds, sent with the 429s")
+    parser.add_argument("--delay", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--write-fixtures", nargs="+", default=None, metavar="RECIPE_ID",
+                        help="save the pages of these recipes from --reviews instead of serving")
+    parser.add_argument("--reviews", default="../data/reviews.csv")
+    args = parser.parse_args()
+
+    if args.write_fixtures:
+        write_fixtures(args.reviews, args.write_fixtures, args.pages)
+    else:
+        server = stub_server(args.port, args.pages, args.throttle, args.fail, args.retry_after, args.delay)
+        print(f'Serving {args.pages} on http://127.0.0.1:{server.server_address[1]}')
+        server.serve_forever()